@@ -33,6 +33,7 @@ from aspirelib.lib import backend
 from aspirelib.lib import database
 from aspirelib.lib import transaction
 from aspirelib.lib import blocks
+from aspirelib.lib import holderindex
 from aspirelib.lib import script
 from aspirelib.lib import message_type
 from aspirelib.lib.messages import send
@@ -452,7 +453,8 @@ class APIServer(threading.Thread):
 
     def run(self):
         logger.info('Starting API Server.')
-        db = database.get_connection(read_only=True, integrity_check=False)
+        # Each request runs on its own thread with a connection checked out of the pool.
+        db = database.ConnectionPool(config.API_DB_POOL_SIZE)
         app = flask.Flask(__name__)
         auth = HTTPBasicAuth()
 
@@ -705,6 +707,7 @@ class APIServer(threading.Thread):
                 'gasp_block_count': latestBlockIndex,
                 'last_block': last_block,
                 'last_message_index': last_message['message_index'] if last_message else -1,
+                'backend_rpc_latency': backend.connection.get_latency_stats(),
                 'running_testnet': config.TESTNET,
                 'version_major': config.VERSION_MAJOR,
                 'version_minor': config.VERSION_MINOR,
@@ -736,6 +739,8 @@ class APIServer(threading.Thread):
         @dispatcher.add_method
         def get_holder_count(asset):
             asset = util.resolve_subasset_longname(db, asset)
+            if config.HOLDER_INDEX:
+                return {asset: holderindex.get_holder_count(db, asset)}
             holders = util.holders(db, asset)
             addresses = []
             for holder in holders:
@@ -754,7 +759,7 @@ class APIServer(threading.Thread):
 
         @dispatcher.add_method
         def get_unspent_txouts(address, unconfirmed=False, unspent_tx_hash=None):
-            return backend.get_unspent_txouts(address, unconfirmed=unconfirmed, multisig_inputs=False, unspent_tx_hash=unspent_tx_hash)
+            return backend.get_unspent_txouts(address, unconfirmed=unconfirmed, multisig_inputs=False, unspent_tx_hash=unspent_tx_hash, db=db)
 
         @dispatcher.add_method
         def getrawtransaction(tx_hash, verbose=False, skip_missing=False):
@@ -786,7 +791,7 @@ class APIServer(threading.Thread):
         @dispatcher.add_method
         # TODO: Rename this method.
         def search_pubkey(pubkeyhash, provided_pubkeys=None):
-            return backend.pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=provided_pubkeys)
+            return backend.pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=provided_pubkeys, db=db)
 
         def _set_cors_headers(response):
             if not config.RPC_NO_ALLOW_CORS:
@@ -800,31 +805,32 @@ class APIServer(threading.Thread):
         @conditional_decorator(auth.login_required, hasattr(config, 'RPC_PASSWORD'))
         def handle_root(args_path):
             """Handle all paths, decide where to forward the query."""
-            if args_path == '' or args_path.startswith('api/') or args_path.startswith('API/') or \
-               args_path.startswith('rpc/') or args_path.startswith('RPC/'):
-                if flask.request.method == 'POST':
-                    # Need to get those here because it might not be available in this aux function.
-                    request_json = flask.request.get_data().decode('utf-8')
-                    response = handle_rpc_post(request_json)
-                    return response
-                elif flask.request.method == 'OPTIONS':
-                    response = handle_rpc_options()
-                    return response
-                else:
-                    error = 'Invalid method.'
-                    return flask.Response(error, 405, mimetype='application/json')
-            elif args_path.startswith('rest/') or args_path.startswith('REST/'):
-                if flask.request.method == 'GET' or flask.request.method == 'POST':
-                    # Pass the URL path without /REST/ part and Flask request object.
-                    rest_path = args_path.split('/', 1)[1]
-                    response = handle_rest(rest_path, flask.request)
-                    return response
+            with db.checkout():
+                if args_path == '' or args_path.startswith('api/') or args_path.startswith('API/') or \
+                   args_path.startswith('rpc/') or args_path.startswith('RPC/'):
+                    if flask.request.method == 'POST':
+                        # Need to get those here because it might not be available in this aux function.
+                        request_json = flask.request.get_data().decode('utf-8')
+                        response = handle_rpc_post(request_json)
+                        return response
+                    elif flask.request.method == 'OPTIONS':
+                        response = handle_rpc_options()
+                        return response
+                    else:
+                        error = 'Invalid method.'
+                        return flask.Response(error, 405, mimetype='application/json')
+                elif args_path.startswith('rest/') or args_path.startswith('REST/'):
+                    if flask.request.method == 'GET' or flask.request.method == 'POST':
+                        # Pass the URL path without /REST/ part and Flask request object.
+                        rest_path = args_path.split('/', 1)[1]
+                        response = handle_rest(rest_path, flask.request)
+                        return response
+                    else:
+                        error = 'Invalid method.'
+                        return flask.Response(error, 405, mimetype='application/json')
                 else:
-                    error = 'Invalid method.'
-                    return flask.Response(error, 405, mimetype='application/json')
-            else:
-                # Not found
-                return flask.Response(None, 404, mimetype='application/json')
+                    # Not found
+                    return flask.Response(None, 404, mimetype='application/json')
 
         ######################
         # JSON-RPC API
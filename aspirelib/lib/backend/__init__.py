@@ -5,6 +5,8 @@ logger = logging.getLogger(__name__)
 import sys
 import json
 import time
+import queue
+import threading
 from decimal import Decimal as D
 
 import bitcoin as bitcoinlib
@@ -15,6 +17,8 @@ from aspirelib.lib import util
 from aspirelib.lib import script
 from aspirelib.lib import config
 from aspirelib.lib import exceptions
+from aspirelib.lib import utxoindex
+from aspirelib.lib import pubkeyindex
 
 from aspirelib.lib.backend import addrindex, btcd
 
@@ -126,6 +130,60 @@ def get_tx_list(block):
     return (tx_hash_list, raw_transactions)
 
 
+class BlockPrefetcher(threading.Thread):
+    """Fetch and deserialize upcoming blocks in the background, in order.
+
+    At most `depth` blocks are held in the queue; `get()` must be called for
+    consecutive block indexes, starting at `block_index`.
+    """
+    def __init__(self, block_index, depth):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.next_block_index = block_index
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=config.BACKEND_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        logger.debug('Starting block prefetcher at block {}.'.format(self.next_block_index))
+        block_count = None
+        while not self.stop_event.is_set():
+            block_index = self.next_block_index
+            try:
+                if block_count is None or block_index > block_count:
+                    block_count = getblockcount()
+                    if block_index > block_count:
+                        time.sleep(config.BACKEND_POLL_INTERVAL)
+                        continue
+                block_hash = getblockhash(block_index)
+                block = getblock(block_hash)
+                txhash_list, raw_transactions = get_tx_list(block)
+            except Exception as e:
+                # Hand the error over to the consumer, which raises it.
+                self._put((block_index, None, e))
+                return
+            self._put((block_index, (block_hash, block, txhash_list, raw_transactions), None))
+            self.next_block_index += 1
+
+    def get(self, block_index):
+        """Return `(block_hash, block, txhash_list, raw_transactions)` for `block_index`."""
+        prefetched_block_index, prefetched, error = self.queue.get()
+        assert prefetched_block_index == block_index
+        if error is not None:
+            raise error
+        return prefetched
+
+
 def sort_unspent_txouts(unspent, unconfirmed=False):
     # Filter out all dust amounts to avoid bloating the resultant transaction
     unspent = list(filter(lambda x: x['amount'] * config.UNIT > config.DEFAULT_MULTISIG_DUST_SIZE, unspent))
@@ -161,29 +219,47 @@ class MempoolError(Exception):
     pass
 
 
-def get_unspent_txouts(source, unconfirmed=False, multisig_inputs=False, unspent_tx_hash=None):
+def get_unspent_txouts(source, unconfirmed=False, multisig_inputs=False, unspent_tx_hash=None, db=None):
     """returns a list of unspent outputs for a specific address
     @return: A list of dicts, with each entry in the dict having the following keys:
+
+    With `db` and an up-to-date UTXO index (`config.UTXO_INDEX`), confirmed
+    outputs are read from the index, and only mempool transactions are
+    fetched from the backend. Backends which cannot list the mempool
+    transactions of an address (btcd) use `searchrawtransactions()`.
     """
     if not MEMPOOL_CACHE_INITIALIZED:
         raise MempoolError('Mempool is not yet ready; please try again in a few minutes.')
 
     # Get all outputs.
     logger.debug('Getting outputs for {}'.format(source))
+    indexed_outputs = []
     if unspent_tx_hash:
         raw_transactions = [getrawtransaction(unspent_tx_hash, verbose=True)]
     else:
         if script.is_multisig(source):
             pubkeyhashes = script.pubkeyhash_array(source)
-            raw_transactions = searchrawtransactions(pubkeyhashes[1], unconfirmed=True) # unconfirmed=True to prune unconfirmed spent outputs
+            search_address = pubkeyhashes[1]
         else:
             pubkeyhashes = [source]
-            raw_transactions = searchrawtransactions(source, unconfirmed=True)
+            search_address = source
+
+        raw_transactions = None
+        if db is not None and utxoindex.is_ready(db):
+            # Mempool transactions, to prune unconfirmed spent outputs: without
+            # them, outputs spent in the mempool would be listed as unspent.
+            try:
+                raw_transactions = BACKEND().unconfirmed_transactions(search_address)
+                indexed_outputs = utxoindex.get_unspent_txouts(db, script.make_canonical(source))
+            except NotImplementedError:
+                pass
+        if raw_transactions is None:
+            raw_transactions = searchrawtransactions(search_address, unconfirmed=True) # unconfirmed=True to prune unconfirmed spent outputs
 
     # Change format.
     # TODO: Slow.
     logger.debug('Formatting outputs for {}'.format(source))
-    outputs = {}
+    outputs = {'{}{}'.format(output['txid'], output['vout']): output for output in indexed_outputs}
     for tx in raw_transactions:
         for vout in tx['vout']:
             txid = tx['txid']
@@ -230,7 +306,7 @@ def get_unspent_txouts(source, unconfirmed=False, multisig_inputs=False, unspent
 class UnknownPubKeyError(Exception):
     pass
 
-def pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=None):
+def pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=None, db=None):
     # Search provided pubkeys.
     if provided_pubkeys:
         if type(provided_pubkeys) != list:
@@ -239,6 +315,11 @@ def pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=None):
             if pubkeyhash == script.pubkey_to_pubkeyhash(util.unhexlify(pubkey)):
                 return pubkey
 
+    # Search published pubkeys already known.
+    pubkey = pubkeyindex.lookup(db, pubkeyhash)
+    if pubkey is not None:
+        return pubkey
+
     # Search blockchain.
     raw_transactions = searchrawtransactions(pubkeyhash, unconfirmed=True)
     for tx in raw_transactions:
@@ -251,6 +332,7 @@ def pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=None):
                     try:
                         pubkey = asm[1]
                         if pubkeyhash == script.pubkey_to_pubkeyhash(util.unhexlify(pubkey)):
+                            pubkeyindex.remember(pubkeyhash, pubkey)
                             return pubkey
                     except binascii.Error:
                         pass
@@ -258,9 +340,9 @@ def pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys=None):
     raise UnknownPubKeyError('Public key was neither provided nor published in blockchain.')
 
 
-def multisig_pubkeyhashes_to_pubkeys(address, provided_pubkeys=None):
+def multisig_pubkeyhashes_to_pubkeys(address, provided_pubkeys=None, db=None):
     signatures_required, pubkeyhashes, signatures_possible = script.extract_array(address)
-    pubkeys = [pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys) for pubkeyhash in pubkeyhashes]
+    pubkeys = [pubkeyhash_to_pubkey(pubkeyhash, provided_pubkeys, db=db) for pubkeyhash in pubkeyhashes]
     return script.construct_array(signatures_required, pubkeys, signatures_possible)
 
 
@@ -3,69 +3,216 @@ logger = logging.getLogger(__name__)
 import sys
 import os
 import json
-import requests
-from requests.exceptions import Timeout, ReadTimeout, ConnectionError
 import time
 import threading
-import concurrent.futures
+import itertools
 import collections
 import binascii
 import hashlib
+import apsw
+import bitcoin as bitcoinlib
+from bitcoin.core import b2x, b2lx
+from bitcoin.core.script import CScriptInvalidError
 
-from aspirelib.lib import config, script, util
+from aspirelib.lib import config, script, util, exceptions
+from aspirelib.lib.backend import connection
 
 raw_transactions_cache = util.DictCache(size=config.BACKEND_RAW_TRANSACTIONS_CACHE_SIZE)  # used in getrawtransaction_batch()
+raw_transactions_disk_cache = None  # see get_raw_transactions_disk_cache()
+raw_transactions_cache_stats = collections.Counter()  # memory hits, disk hits and misses of getrawtransaction_batch()
+raw_transactions_cache_stats_lock = threading.Lock()
+# `{address: set(tx_hash)}` and `{tx_hash: set(address)}` for the mempool, with
+# binary transaction hashes and interned addresses, see `refresh_unconfirmed_transactions_cache()`.
 unconfirmed_transactions_cache = None
 reverse_unconfirmed_transactions_cache = None
 
 
+def get_scriptpubkey_addresses(scriptpubkey):
+    """Return the `addresses` the backend lists for an output script (a
+    `CScript`), or `None`."""
+    try:
+        asm = script.get_asm(scriptpubkey)
+        if asm[-1] == 'OP_CHECKSIG':
+            if len(asm) == 2 and type(asm[0]) == bytes:
+                return [script.pubkey_to_pubkeyhash(asm[0])]
+            return [script.base58_check_encode(binascii.hexlify(script.get_checksig(asm)).decode('utf-8'), config.ADDRESSVERSION)]
+        elif asm[-1] == 'OP_CHECKMULTISIG':
+            pubkeys, signatures_required = script.get_checkmultisig(asm)
+            return [script.pubkey_to_pubkeyhash(pubkey) for pubkey in pubkeys]
+        elif len(asm) == 3 and asm[0] == 'OP_HASH160' and asm[2] == 'OP_EQUAL':
+            return [script.base58_check_encode(binascii.hexlify(asm[1]).decode('utf-8'), config.P2SH_ADDRESSVERSION)]
+    except (exceptions.DecodeError, CScriptInvalidError):
+        pass
+    return None
+
+
+def decode_tx(tx_bytes):
+    """Return the fields of the verbose `getrawtransaction` output read by the
+    callers of `getrawtransaction_batch()` (`txid`, `hex`, and the outpoints,
+    values, scripts and addresses of `vin` and `vout`) for a serialised
+    transaction."""
+    ctx = bitcoinlib.core.CTransaction.deserialize(tx_bytes)
+    vin = []
+    for txin in ctx.vin:
+        if ctx.is_coinbase():
+            vin.append({'coinbase': b2x(txin.scriptSig), 'sequence': txin.nSequence})
+        else:
+            vin.append({'txid': b2lx(txin.prevout.hash), 'vout': txin.prevout.n,
+                        'scriptSig': {'hex': b2x(txin.scriptSig)}, 'sequence': txin.nSequence})
+    vout = []
+    for n, txout in enumerate(ctx.vout):
+        scriptpubkey = {'hex': b2x(txout.scriptPubKey)}
+        addresses = get_scriptpubkey_addresses(txout.scriptPubKey)
+        if addresses:
+            scriptpubkey['addresses'] = addresses
+        vout.append({'value': txout.nValue / config.UNIT, 'n': n, 'scriptPubKey': scriptpubkey})
+    return {'txid': b2lx(ctx.GetHash()), 'hex': b2x(tx_bytes), 'vin': vin, 'vout': vout}
+
+
+def pack_tx(tx):
+    """Return a verbose transaction as stored in the raw transactions cache
+    with `BACKEND_COMPACT_CACHES`: `(raw bytes, confirmations, block hash)`,
+    decoded again by `unpack_tx()`. The other verbose fields (`asm`, `type`,
+    `time`…) are not kept."""
+    blockhash = tx.get('blockhash')
+    return (binascii.unhexlify(tx['hex']), tx.get('confirmations'), binascii.unhexlify(blockhash) if blockhash else None)
+
+
+def unpack_tx(entry):
+    """Return the verbose transaction of a cache entry: compact entries (see
+    `pack_tx()`) are decoded, others returned unchanged."""
+    if isinstance(entry, tuple):
+        tx_bytes, confirmations, blockhash = entry
+        tx = decode_tx(tx_bytes)
+        if confirmations is not None:
+            tx['confirmations'] = confirmations
+        if blockhash is not None:
+            tx['blockhash'] = b2x(blockhash)
+        return tx
+    return entry
+
+
+def get_tx_hex(entry):
+    """Return the hex of a cache entry, without decoding it."""
+    if isinstance(entry, tuple):
+        return b2x(entry[0])
+    return entry['hex']
+
+
+class RawTransactionDiskCache(object):
+    """Size-bounded store of confirmed transactions, as their hex and the hash
+    of their block, in an SQLite file, evicting the oldest entries first. Safe
+    to share between threads.
+
+    The other verbose fields are decoded from the hex, or, for
+    `confirmations`, looked up again for the block: see `get_stored_txs()`."""
+    def __init__(self, path, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.db = apsw.Connection(path)
+        cursor = self.db.cursor()
+        cursor.execute('''PRAGMA journal_mode = WAL''')
+        # Verbose entries, stored by earlier versions.
+        cursor.execute('''DROP TABLE IF EXISTS raw_transactions''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS raw_transaction_hexes(
+                            tx_hash TEXT UNIQUE,
+                            tx_hex TEXT,
+                            block_hash TEXT)
+                       ''')
+        self.count = list(cursor.execute('''SELECT COUNT(*) FROM raw_transaction_hexes'''))[0][0]
+        cursor.close()
+
+    def get_many(self, txhash_list):
+        """Return `{tx_hash: (tx_hex, block_hash)}`."""
+        txs = {}
+        with self.lock:
+            cursor = self.db.cursor()
+            for chunk in util.chunkify(list(txhash_list), 500):
+                sql = '''SELECT tx_hash, tx_hex, block_hash FROM raw_transaction_hexes WHERE tx_hash IN ({})'''.format(','.join('?' * len(chunk)))
+                for tx_hash, tx_hex, block_hash in cursor.execute(sql, chunk):
+                    txs[tx_hash] = (tx_hex, block_hash)
+            cursor.close()
+        return txs
+
+    def put_many(self, txs):
+        """Store `{tx_hash: (tx_hex, block_hash)}`."""
+        with self.lock:
+            with self.db:
+                cursor = self.db.cursor()
+                total_changes = self.db.totalchanges()
+                cursor.executemany('''INSERT OR IGNORE INTO raw_transaction_hexes(tx_hash, tx_hex, block_hash) VALUES(?,?,?)''',
+                                   [(tx_hash, tx_hex, block_hash) for tx_hash, (tx_hex, block_hash) in txs.items()])
+                self.count += self.db.totalchanges() - total_changes
+                if self.count > self.size:
+                    cursor.execute('''DELETE FROM raw_transaction_hexes WHERE rowid IN
+                                      (SELECT rowid FROM raw_transaction_hexes ORDER BY rowid LIMIT ?)''', (self.count - self.size,))
+                    self.count = self.size
+                cursor.close()
+
+
+def get_raw_transactions_disk_cache():
+    """Return the on-disk tier of the raw transactions cache, or `None` if disabled."""
+    global raw_transactions_disk_cache
+    if raw_transactions_disk_cache is None and config.BACKEND_RAW_TRANSACTIONS_DISK_CACHE_SIZE:
+        raw_transactions_disk_cache = RawTransactionDiskCache(config.DATABASE + '.rawtx', config.BACKEND_RAW_TRANSACTIONS_DISK_CACHE_SIZE)
+    return raw_transactions_disk_cache
+
+
+def get_stored_txs(stored):
+    """Return `{tx_hash: entry}` (see `pack_tx()`) for the transactions
+    `{tx_hash: (tx_hex, block_hash)}` read from the disk cache whose block is
+    still in the main chain, with its current number of confirmations."""
+    block_hashes = sorted(set(block_hash for tx_hex, block_hash in stored.values()))
+    payload = [{
+        "method": 'getblockheader',
+        "params": [block_hash],
+        "jsonrpc": "2.0",
+        "id": i
+    } for i, block_hash in enumerate(block_hashes)]
+    confirmations = {}
+    for response in rpc_batch(payload):
+        # Blocks off the main chain have -1 confirmations.
+        if response.get('error') is None and response['result']['confirmations'] > 0:
+            confirmations[block_hashes[response['id']]] = response['result']['confirmations']
+    return {tx_hash: (binascii.unhexlify(tx_hex), confirmations[block_hash], binascii.unhexlify(block_hash))
+            for tx_hash, (tx_hex, block_hash) in stored.items() if block_hash in confirmations}
+
+
 class BackendRPCError(Exception):
     pass
 
 
 def rpc_call(payload):
     url = config.BACKEND_URL
-    response = None
-    TRIES = 12
 
-    for i in range(TRIES):
-        try:
-            response = requests.post(url, data=json.dumps(payload), headers={'content-type': 'application/json'},
-                verify=(not config.BACKEND_SSL_NO_VERIFY), timeout=config.REQUESTS_TIMEOUT)
-            if i > 0:
-                logger.debug('Successfully connected.')
-            break
-        except (Timeout, ReadTimeout, ConnectionError):
-            logger.debug('Could not connect to backend at `{}`. (Try {}/{})'.format(util.clean_url_for_log(url), i+1, TRIES))
-            time.sleep(5)
-
-    if response == None:
-        if config.TESTNET:
-            network = 'testnet'
+    for attempt in itertools.count():
+        response = connection.post(payload)
+
+        if response == None:
+            if config.TESTNET:
+                network = 'testnet'
+            else:
+                network = 'mainnet'
+            raise BackendRPCError('Cannot communicate with backend at `{}`. (server is set to run on {}, is backend?)'.format(util.clean_url_for_log(url), network))
+        elif response.status_code not in (200, 500):
+            raise BackendRPCError(str(response.status_code) + ' ' + response.reason)
+
+        # Return result, with error handling.
+        response_json = response.json()
+        # Batch query returns a list
+        if isinstance(response_json, list):
+            return response_json
+        if 'error' not in response_json.keys() or response_json['error'] == None:
+            return response_json['result']
+        elif response_json['error']['code'] == -5:   # RPC_INVALID_ADDRESS_OR_KEY
+            raise BackendRPCError('{} Is `txindex` enabled in {} Core?'.format(response_json['error'], config.BTC_NAME))
+        elif response_json['error']['code'] in [-28, -8, -2]:
+            # “Verifying blocks...” or “Block height out of range” or “The network does not appear to fully agree!“
+            delay = connection.backoff_delay(attempt, cap=connection.NOT_READY_BACKOFF_MAX)
+            logger.debug('Backend not ready. Sleeping for {:.1f} seconds.'.format(delay))
+            time.sleep(delay)
         else:
-            network = 'mainnet'
-        raise BackendRPCError('Cannot communicate with backend at `{}`. (server is set to run on {}, is backend?)'.format(util.clean_url_for_log(url), network))
-    elif response.status_code not in (200, 500):
-        raise BackendRPCError(str(response.status_code) + ' ' + response.reason)
-
-    # Return result, with error handling.
-    response_json = response.json()
-    # Batch query returns a list
-    if isinstance(response_json, list):
-        return response_json
-    if 'error' not in response_json.keys() or response_json['error'] == None:
-        return response_json['result']
-    elif response_json['error']['code'] == -5:   # RPC_INVALID_ADDRESS_OR_KEY
-        raise BackendRPCError('{} Is `txindex` enabled in {} Core?'.format(response_json['error'], config.BTC_NAME))
-    elif response_json['error']['code'] in [-28, -8, -2]:
-        # “Verifying blocks...” or “Block height out of range” or “The network does not appear to fully agree!“
-        logger.debug('Backend not ready. Sleeping for ten seconds.')
-        # If AspireGas Core takes more than `sys.getrecursionlimit() * 10 = 9970`
-        # seconds to start, this’ll hit the maximum recursion depth limit.
-        time.sleep(10)
-        return rpc_call(payload)
-    else:
-        raise BackendRPCError('{}'.format(response_json['error']))
+            raise BackendRPCError('{}'.format(response_json['error']))
 
 def rpc(method, params):
     payload = {
@@ -77,19 +224,14 @@ def rpc(method, params):
     return rpc_call(payload)
 
 def rpc_batch(request_list):
-    responses = collections.deque()
-
-    def make_call(chunk):
-        # send a list of requests to gaspd to be executed
-        # note that this is list executed serially, in the same thread in gaspd
-        # e.g. see: https://github.com/bitcoin/bitcoin/blob/master/src/rpcserver.cpp#L939
-        responses.extend(rpc_call(chunk))
-
+    # send lists of requests to gaspd to be executed, in parallel over the shared connections
+    # note that each list is executed serially, in the same thread in gaspd
+    # e.g. see: https://github.com/bitcoin/bitcoin/blob/master/src/rpcserver.cpp#L939
     chunks = util.chunkify(request_list, config.RPC_BATCH_SIZE)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=config.BACKEND_RPC_BATCH_NUM_WORKERS) as executor:
-        for chunk in chunks:
-            executor.submit(make_call, chunk)
-    return list(responses)
+    responses = []
+    for chunk_responses in connection.get_executor().map(rpc_call, chunks):
+        responses.extend(chunk_responses)
+    return responses
 
 def extract_addresses(txhash_list):
     logger.debug('extract_addresses, txs: %d' % (len(txhash_list), ))
@@ -128,17 +270,17 @@ def unconfirmed_transactions(address):
     if unconfirmed_transactions_cache is None:
         raise Exception("Unconfirmed transactions cache is not initialized")
 
-    tx_hashes = unconfirmed_transactions_cache.get(address, set())
+    tx_hashes = [binascii.hexlify(tx_hash).decode('ascii') for tx_hash in unconfirmed_transactions_cache.get(address, ())]
 
-    logger.debug("unconfirmed_transcations found: %s" % ",".join(list(tx_hashes)))
+    logger.debug("unconfirmed_transcations found: %s" % ",".join(tx_hashes))
 
-    return list(getrawtransaction_batch(list(tx_hashes), verbose=True).values()) if len(tx_hashes) else []
+    return list(getrawtransaction_batch(tx_hashes, verbose=True).values()) if len(tx_hashes) else []
 
 def refresh_unconfirmed_transactions_cache(mempool_txhash_list):
     global unconfirmed_transactions_cache, reverse_unconfirmed_transactions_cache
 
-    # turn list into set for better performance
-    mempool_txhash_list = set(mempool_txhash_list)
+    # turn list into set of binary hashes for better performance and memory use
+    mempool_txhash_list = set(binascii.unhexlify(tx_hash) for tx_hash in mempool_txhash_list)
 
     if unconfirmed_transactions_cache is None:
         unconfirmed_transactions_cache = {}
@@ -162,6 +304,8 @@ def refresh_unconfirmed_transactions_cache(mempool_txhash_list):
     for tx_hash in old_tx_hash_list:
         for address in reverse_unconfirmed_transactions_cache[tx_hash]:
             unconfirmed_transactions_cache[address].remove(tx_hash)
+            if not unconfirmed_transactions_cache[address]:
+                del unconfirmed_transactions_cache[address]
 
         del reverse_unconfirmed_transactions_cache[tx_hash]
 
@@ -171,7 +315,7 @@ def refresh_unconfirmed_transactions_cache(mempool_txhash_list):
 
     # tx_hashes_addresses is dict with tx addresses keyed by tx_hash
     # tx_hashes_tx is dict with tx info keyed by tx_hash
-    tx_hashes_addresses, tx_hashes_tx = extract_addresses(list(new_tx_hash_list))
+    tx_hashes_addresses, tx_hashes_tx = extract_addresses([binascii.hexlify(tx_hash).decode('ascii') for tx_hash in new_tx_hash_list])
 
     extract_time = time.time() - extract_start_time
 
@@ -179,9 +323,11 @@ def refresh_unconfirmed_transactions_cache(mempool_txhash_list):
 
     # add txs to cache and reverse cache
     for tx_hash, addresses in tx_hashes_addresses.items():
+        tx_hash = binascii.unhexlify(tx_hash)
         reverse_unconfirmed_transactions_cache.setdefault(tx_hash, set())
 
         for address in addresses:
+            address = sys.intern(address)
             unconfirmed_transactions_cache.setdefault(address, set())
             unconfirmed_transactions_cache[address].add(tx_hash)
             reverse_unconfirmed_transactions_cache[tx_hash].add(address)
@@ -274,9 +420,26 @@ def getrawtransaction_batch(txhash_list, verbose=False, skip_missing=False, _ret
 
     txhash_list = set(txhash_list)
 
+    # look up transactions missing from the memory cache in the disk cache, if any: non-verbose
+    # calls return their hex as is, verbose ones decode them into the memory cache
+    memory_misses = [tx_hash for tx_hash in txhash_list if tx_hash not in raw_transactions_cache]
+    disk_cache = get_raw_transactions_disk_cache()
+    disk_hits = {}
+    disk_hit_count = 0
+    if disk_cache is not None and memory_misses:
+        stored = disk_cache.get_many(memory_misses)
+        if not verbose:
+            disk_hits = {tx_hash: tx_hex for tx_hash, (tx_hex, block_hash) in stored.items()}
+            disk_hit_count = len(disk_hits)
+        elif stored:
+            stored = get_stored_txs(stored)
+            for tx_hash, entry in stored.items():
+                raw_transactions_cache[tx_hash] = entry if config.BACKEND_COMPACT_CACHES else unpack_tx(entry)
+            disk_hit_count = len(stored)
+
     # payload for transactions not in cache
     for tx_hash in txhash_list:
-        if tx_hash not in raw_transactions_cache:
+        if tx_hash not in raw_transactions_cache and tx_hash not in disk_hits:
             call_id = binascii.hexlify(os.urandom(5)).decode('utf8')
             payload.append({
                 "method": 'getrawtransaction',
@@ -289,36 +452,56 @@ def getrawtransaction_batch(txhash_list, verbose=False, skip_missing=False, _ret
     #refresh any/all cache entries that already exist in the cache,
     # so they're not inadvertently removed by another thread before we can consult them
     #(this assumes that the size of the working set for any given workload doesn't exceed the max size of the cache)
-    for tx_hash in txhash_list.difference(noncached_txhashes):
+    for tx_hash in txhash_list.difference(noncached_txhashes).difference(disk_hits):
         raw_transactions_cache.refresh(tx_hash)
 
-    _logger.debug("getrawtransaction_batch: txhash_list size: {} / raw_transactions_cache size: {} / # getrawtransaction calls: {}".format(
-        len(txhash_list), len(raw_transactions_cache), len(payload)))
+    # shared by the API and parsing threads
+    with raw_transactions_cache_stats_lock:
+        raw_transactions_cache_stats['memory_hits'] += len(txhash_list) - len(memory_misses)
+        raw_transactions_cache_stats['disk_hits'] += disk_hit_count
+        raw_transactions_cache_stats['misses'] += len(payload)
+        cache_stats = dict(raw_transactions_cache_stats)
+    _logger.debug("getrawtransaction_batch: txhash_list size: {} / raw_transactions_cache size: {} / # getrawtransaction calls: {} / cache stats: {}".format(
+        len(txhash_list), len(raw_transactions_cache), len(payload), cache_stats))
 
     # populate cache
     if len(payload) > 0:
         batch_responses = rpc_batch(payload)
+        confirmed_txs = {}
         for response in batch_responses:
             if 'error' not in response or response['error'] is None:
                 tx_hex = response['result']
                 tx_hash = tx_hash_call_id[response['id']]
-                raw_transactions_cache[tx_hash] = tx_hex
+                entry = pack_tx(tx_hex) if config.BACKEND_COMPACT_CACHES else tx_hex
+                raw_transactions_cache[tx_hash] = entry
+                if tx_hex.get('confirmations', 0) > 0:
+                    confirmed_txs[tx_hash] = (tx_hex['hex'], tx_hex['blockhash'])
             elif skip_missing and 'error' in response and response['error']['code'] == -5:
+                tx_hash = tx_hash_call_id[response['id']]
                 raw_transactions_cache[tx_hash] = None
                 logging.debug('Missing TX with no raw info skipped (txhash: {}): {}'.format(
                     tx_hash_call_id.get(response.get('id', '??'), '??'), response['error']))
             else:
                 #TODO: this seems to happen for bogus transactions? Maybe handle it more gracefully than just erroring out?
                 raise BackendRPCError('{} (txhash:: {})'.format(response['error'], tx_hash_call_id.get(response.get('id', '??'), '??')))
+        # Only confirmed transactions are final enough to outlive this process.
+        if disk_cache is not None and confirmed_txs:
+            disk_cache.put_many(confirmed_txs)
 
-    # get transactions from cache
+    # get transactions from cache, decoding compact entries
     result = {}
     for tx_hash in txhash_list:
+        if tx_hash in disk_hits:
+            result[tx_hash] = disk_hits[tx_hash]
+            continue
         try:
-            if verbose:
-                result[tx_hash] = raw_transactions_cache[tx_hash]
+            entry = raw_transactions_cache[tx_hash]
+            if entry is None:
+                result[tx_hash] = None
+            elif verbose:
+                result[tx_hash] = unpack_tx(entry)
             else:
-                result[tx_hash] = raw_transactions_cache[tx_hash]['hex'] if raw_transactions_cache[tx_hash] is not None else None
+                result[tx_hash] = get_tx_hex(entry)
         except KeyError as e: #shows up most likely due to finickyness with addrindex not always returning results that we need...
             _logger.warning("tx missing in rawtx cache: {} -- txhash_list size: {}, hash: {} / raw_transactions_cache size: {} / # rpc_batch calls: {} / txhash in noncached_txhashes: {} / txhash in txhash_list: {} -- list {}".format(
                 e, len(txhash_list), hashlib.md5(json.dumps(list(txhash_list)).encode()).hexdigest(), len(raw_transactions_cache), len(payload),
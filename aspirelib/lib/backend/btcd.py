@@ -5,37 +5,16 @@ import json
 
 from aspirelib.lib import script
 from aspirelib.lib import config, util
-
-import requests
-from requests.exceptions import Timeout, ReadTimeout, ConnectionError
-import time
-import json
+from aspirelib.lib.backend import connection
 
 from functools import lru_cache
 
-bitcoin_rpc_session = None
-
 class BackendRPCError(Exception):
     pass
 
 def rpc_call(payload):
     url = config.BACKEND_URL
-    headers = {'content-type': 'application/json'}
-
-    global bitcoin_rpc_session
-    if not bitcoin_rpc_session:
-        bitcoin_rpc_session = requests.Session()
-    response = None
-    TRIES = 12
-    for i in range(TRIES):
-        try:
-            response = bitcoin_rpc_session.post(url, data=json.dumps(payload), headers=headers, verify=(not config.BACKEND_SSL_NO_VERIFY), timeout=config.REQUESTS_TIMEOUT)
-            if i > 0:
-                logger.debug('Successfully connected.')
-            break
-        except (Timeout, ReadTimeout, ConnectionError):
-            logger.debug('Could not connect to backend at `{}`. (Try {}/{})'.format(util.clean_url_for_log(url), i+1, TRIES))
-            time.sleep(5)
+    response = connection.post(payload)
 
     if response == None:
         if config.TESTNET:
@@ -76,8 +55,8 @@ def rpc_batch(payload):
     for chunk in chunks:
         responses += rpc_call(chunk)
     '''
-    for query in payload:
-        responses.append(rpc_call(query))
+    # Single queries, dispatched in parallel over the shared connections.
+    responses.extend(connection.get_executor().map(rpc_call, payload))
 
     return responses
 
@@ -94,7 +73,7 @@ def searchrawtransactions(address, unconfirmed=False):
 
     return rawtransactions
 
-def unconfirmed_transactions():
+def unconfirmed_transactions(address):
     raise NotImplementedError
 
 def refresh_unconfirmed_transactions_cache():
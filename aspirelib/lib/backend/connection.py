@@ -0,0 +1,102 @@
+"""HTTP connections to the backend shared by its RPC clients: a keep-alive
+session pool, a worker pool for batch chunks, retries with exponential backoff,
+and per-method latency counters."""
+import logging
+logger = logging.getLogger(__name__)
+import json
+import time
+import random
+import threading
+import collections
+import concurrent.futures
+
+import requests
+import requests.adapters
+from requests.exceptions import Timeout, ReadTimeout, ConnectionError
+
+from aspirelib.lib import config, util
+
+TRIES = 12
+BACKOFF_BASE = 1     # seconds
+BACKOFF_MAX = 16     # seconds
+NOT_READY_BACKOFF_MAX = 60  # seconds, while the backend is starting up
+
+session = None
+executor = None
+lock = threading.Lock()
+
+# `{method: [calls, total seconds, max seconds]}`; a batch counts under the
+# method of each of its requests, with the batch time split evenly.
+latency_stats = collections.defaultdict(lambda: [0, 0.0, 0.0])
+latency_stats_lock = threading.Lock()
+
+
+def get_session():
+    """Return the `requests.Session` shared by all threads, keeping up to
+    `BACKEND_RPC_BATCH_NUM_WORKERS` connections to the backend alive."""
+    global session
+    with lock:
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=config.BACKEND_RPC_BATCH_NUM_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+    return session
+
+
+def get_executor():
+    """Return the thread pool batch chunks are dispatched over."""
+    global executor
+    with lock:
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.BACKEND_RPC_BATCH_NUM_WORKERS)
+    return executor
+
+
+def backoff_delay(attempt, cap=BACKOFF_MAX):
+    """Exponential backoff with full jitter, so that workers retrying at the
+    same time do not hit the backend in lockstep."""
+    return random.uniform(0, min(cap, BACKOFF_BASE * 2 ** attempt))
+
+
+def record_latency(payload, elapsed):
+    requests_ = payload if isinstance(payload, list) else [payload]
+    if not requests_:
+        return
+    share = elapsed / len(requests_)
+    with latency_stats_lock:
+        for request in requests_:
+            stats = latency_stats[request.get('method')]
+            stats[0] += 1
+            stats[1] += share
+            stats[2] = max(stats[2], share)
+
+
+def get_latency_stats():
+    """Return `{method: {'calls', 'total', 'mean', 'max'}}`, in seconds."""
+    with latency_stats_lock:
+        return {method: {'calls': calls, 'total': total, 'mean': total / calls, 'max': max_}
+                for method, (calls, total, max_) in latency_stats.items()}
+
+
+def post(payload):
+    """POST a JSON-RPC request (or batch) to the backend, retrying on
+    connection errors; return the response, or `None` if all tries failed."""
+    url = config.BACKEND_URL
+    for i in range(TRIES):
+        start = time.time()
+        try:
+            response = get_session().post(url, data=json.dumps(payload), headers={'content-type': 'application/json'},
+                verify=(not config.BACKEND_SSL_NO_VERIFY), timeout=config.REQUESTS_TIMEOUT)
+        except (Timeout, ReadTimeout, ConnectionError):
+            delay = backoff_delay(i)
+            logger.debug('Could not connect to backend at `{}`. (Try {}/{}, retrying in {:.1f} seconds.)'.format(util.clean_url_for_log(url), i+1, TRIES, delay))
+            time.sleep(delay)
+            continue
+        record_latency(payload, time.time() - start)
+        if i > 0:
+            logger.debug('Successfully connected.')
+        return response
+    return None
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -17,6 +17,11 @@ from Crypto.Cipher import ARC4
 import apsw
 import copy
 import http
+import concurrent.futures
+import multiprocessing
+import contextlib
+import itertools
+import glob
 
 import bitcoin as bitcoinlib
 from bitcoin.core.script import CScriptInvalidError
@@ -30,6 +35,9 @@ from aspirelib.lib import backend
 from aspirelib.lib import log
 from aspirelib.lib import database
 from aspirelib.lib import message_type
+from aspirelib.lib import utxoindex
+from aspirelib.lib import pubkeyindex
+from aspirelib.lib import holderindex
 from aspirelib.lib.messages import send
 from aspirelib.lib.messages import order
 from aspirelib.lib.messages import btcpay
@@ -70,6 +78,25 @@ UNDOLOG_TABLES = copy.copy(TABLES)
 UNDOLOG_TABLES.remove('messages')
 UNDOLOG_TABLES += ['balances']
 
+# Undolog operations: the statement that undoes an insert, an update and a delete.
+UNDO_DELETE = 1
+UNDO_UPDATE = 2
+UNDO_INSERT = 3
+
+# Tables copied into ledger snapshots.
+SNAPSHOT_TABLES = TABLES + ['balances']
+
+# Tables that parsing only ever inserts into: their secondary indexes serve the
+# API alone, so a fast reparse builds them once at the end.
+DEFERRED_INDEX_TABLES = ['messages', 'credits', 'debits', 'sends', 'btcpays', 'cancels', 'dividends',
+                         'bet_match_resolutions', 'order_expirations', 'order_match_expirations',
+                         'bet_expirations', 'bet_match_expirations', 'rps_expirations', 'rps_match_expirations']
+
+# Blocks indexed per transaction while building the UTXO index.
+UTXO_INDEX_COMMIT_INTERVAL = 1000
+
+DECODE_POOL = None
+
 
 def parse_tx(db, tx):
     """Parse the transaction, return True for success."""
@@ -160,6 +187,8 @@ def parse_block(db, block_index, block_time,
 
     assert block_index == util.CURRENT_BLOCK_INDEX
 
+    log.check_message_index(db)
+
     # Remove undolog records for any block older than we should be tracking
     undolog_oldest_block_index = block_index - config.UNDOLOG_MAX_PAST_BLOCKS
     first_undo_index = list(undolog_cursor.execute('''SELECT first_undo_index FROM undolog_block WHERE block_index == ?''', (undolog_oldest_block_index,)))
@@ -174,34 +203,35 @@ def parse_block(db, block_index, block_time,
         undolog_cursor.execute('''INSERT OR REPLACE INTO undolog_block(block_index, first_undo_index) VALUES(?,?)''', (block_index, 1,))
     undolog_cursor.close()
 
-    # Expire orders, bets and rps.
-    proofofwork.confirm(db, block_index)
-    order.expire(db, block_index)
-    bet.expire(db, block_index, block_time)
-    rps.expire(db, block_index)
-
-    # Parse transactions, sorting them by type.
-    cursor = db.cursor()
-    cursor.execute('''SELECT * FROM transactions WHERE block_index=? ORDER BY tx_index''', (block_index,))
-
-    if reparse:
-        # During reparse make sure to check for proof of work in coinbase.
-        # TODO: Improve this, probably dont need to do this much work to parse the coinbase
-        block_hash = backend.getblockhash(block_index)
-        block_data = backend.getblock(block_hash)
-        txhash_list, raw_transactions = backend.get_tx_list(block_data)
-        for txhash, tx_raw in raw_transactions.items():
-            get_tx_info(tx_raw, db=db)
-
-    txlist = []
-    for tx in list(cursor):
-        parse_tx(db, tx)
-        txlist.append('{}{}{}{}{}{}'.format(tx['tx_hash'], tx['source'], tx['destination'], tx['btc_amount'], tx['fee'], binascii.hexlify(tx['data']).decode('UTF-8')))
-
-    # Confirm proof of work
-    proofofwork.confirm(db, block_index)
+    with util.balances_cache():
+        # Expire orders, bets and rps.
+        proofofwork.confirm(db, block_index)
+        order.expire(db, block_index)
+        bet.expire(db, block_index, block_time)
+        rps.expire(db, block_index)
+
+        # Parse transactions, sorting them by type.
+        cursor = db.cursor()
+        cursor.execute('''SELECT * FROM transactions WHERE block_index=? ORDER BY tx_index''', (block_index,))
+
+        if reparse:
+            # During reparse make sure to check for proof of work in coinbase.
+            # Only the coinbase is decoded: it is the only transaction that
+            # decoding can credit, and the others are already listed.
+            block_hash = backend.getblockhash(block_index)
+            block_data = backend.getblock(block_hash)
+            txhash_list, raw_transactions = backend.get_tx_list(block_data)
+            get_tx_info(raw_transactions[txhash_list[0]], db=db)
+
+        txlist = []
+        for tx in list(cursor):
+            parse_tx(db, tx)
+            txlist.append('{}{}{}{}{}{}'.format(tx['tx_hash'], tx['source'], tx['destination'], tx['btc_amount'], tx['fee'], binascii.hexlify(tx['data']).decode('UTF-8')))
+
+        # Confirm proof of work
+        proofofwork.confirm(db, block_index)
 
-    cursor.close()
+        cursor.close()
 
     # Calculate consensus hashes.
     new_txlist_hash, found_txlist_hash = check.consensus_hash(db, 'txlist_hash', previous_txlist_hash, txlist)
@@ -391,6 +421,11 @@ def initialise(db):
     rps.initialise(db)
     rpsresolve.initialise(db)
 
+    # UTXO index, published pubkeys, asset holders
+    utxoindex.initialise(db)
+    pubkeyindex.initialise(db)
+    holderindex.initialise(db)
+
     # Messages
     cursor.execute('''CREATE TABLE IF NOT EXISTS messages(
                       message_index INTEGER PRIMARY KEY,
@@ -408,35 +443,57 @@ def initialise(db):
                       block_index_message_index_idx ON messages (block_index, message_index)
                    ''')
 
-    # Create undolog tables
+    # Discard an undolog in an older format, of SQL statements or of quoted
+    # rows: rolling back past the upgrade requires a full reparse.
+    undolog_columns = [column['name'] for column in cursor.execute('''PRAGMA table_info(undolog)''')]
+    if 'sql' in undolog_columns or 'old_row' in undolog_columns:
+        logger.warning('Discarding undolog in an old format.')
+        cursor.execute('''DROP TABLE undolog''')
+        cursor.execute('''DROP TABLE IF EXISTS undolog_block''')
+
+    # Create undolog tables. The values of an old row are stored as they are,
+    # in the columns `v0`, `v1`… (without affinity), so that they are replayed
+    # as bound parameters.
+    table_columns = {}
+    for table in UNDOLOG_TABLES:
+        table_columns[table] = [column['name'] for column in cursor.execute('''PRAGMA table_info({})'''.format(table))]
+    value_columns = ['v{}'.format(i) for i in range(max(len(columns) for columns in table_columns.values()))]
     cursor.execute('''CREATE TABLE IF NOT EXISTS undolog(
                         undo_index INTEGER PRIMARY KEY AUTOINCREMENT,
-                        sql TEXT)
+                        table_name TEXT,
+                        op INTEGER,
+                        row_id INTEGER)
                    ''')
+    undolog_columns = [column['name'] for column in cursor.execute('''PRAGMA table_info(undolog)''')]
+    for column in value_columns:
+        if column not in undolog_columns:
+            cursor.execute('''ALTER TABLE undolog ADD COLUMN {}'''.format(column))
     cursor.execute('''CREATE TABLE IF NOT EXISTS undolog_block(
                         block_index INTEGER PRIMARY KEY,
                         first_undo_index INTEGER)
                    ''')
 
-    # Create undolog triggers for all tables in TABLES list, plus the 'balances' table
+    # Create undolog triggers for all tables in TABLES list, plus the 'balances' table.
+    # They are recreated every time so that the old rows always list the current columns.
     for table in UNDOLOG_TABLES:
-        columns = [column['name'] for column in cursor.execute('''PRAGMA table_info({})'''.format(table))]
-        cursor.execute('''CREATE TRIGGER IF NOT EXISTS _{}_insert AFTER INSERT ON {} BEGIN
-                            INSERT INTO undolog VALUES(NULL, 'DELETE FROM {} WHERE rowid='||new.rowid);
+        columns = table_columns[table]
+        old_row_columns = ','.join(value_columns[:len(columns)])
+        old_row = ','.join('old.{}'.format(c) for c in columns)
+        for trigger_type in ('insert', 'update', 'delete'):
+            cursor.execute('DROP TRIGGER IF EXISTS _{}_{}'.format(table, trigger_type))
+
+        cursor.execute('''CREATE TRIGGER _{}_insert AFTER INSERT ON {} BEGIN
+                            INSERT INTO undolog(table_name, op, row_id) VALUES('{}', {}, new.rowid);
                             END;
-                       '''.format(table, table, table))
-
-        columns_parts = ["{}='||quote(old.{})||'".format(c, c) for c in columns]
-        cursor.execute('''CREATE TRIGGER IF NOT EXISTS _{}_update AFTER UPDATE ON {} BEGIN
-                            INSERT INTO undolog VALUES(NULL, 'UPDATE {} SET {} WHERE rowid='||old.rowid);
+                       '''.format(table, table, table, UNDO_DELETE))
+        cursor.execute('''CREATE TRIGGER _{}_update AFTER UPDATE ON {} BEGIN
+                            INSERT INTO undolog(table_name, op, row_id, {}) VALUES('{}', {}, old.rowid, {});
                             END;
-                       '''.format(table, table, table, ','.join(columns_parts)))
-
-        columns_parts = ["'||quote(old.{})||'".format(c) for c in columns]
-        cursor.execute('''CREATE TRIGGER IF NOT EXISTS _{}_delete BEFORE DELETE ON {} BEGIN
-                            INSERT INTO undolog VALUES(NULL, 'INSERT INTO {}(rowid,{}) VALUES('||old.rowid||',{})');
+                       '''.format(table, table, old_row_columns, table, UNDO_UPDATE, old_row))
+        cursor.execute('''CREATE TRIGGER _{}_delete BEFORE DELETE ON {} BEGIN
+                            INSERT INTO undolog(table_name, op, row_id, {}) VALUES('{}', {}, old.rowid, {});
                             END;
-                       '''.format(table, table, table, ','.join(columns), ','.join(columns_parts)))
+                       '''.format(table, table, old_row_columns, table, UNDO_INSERT, old_row))
     # Drop undolog tables on messages table if they exist (fix for adding them in 9.52.0)
     for trigger_type in ('insert', 'update', 'delete'):
         cursor.execute("DROP TRIGGER IF EXISTS _messages_{}".format(trigger_type))
@@ -455,27 +512,122 @@ def initialise(db):
     cursor.close()
 
 
-def get_tx_info(tx_hex, block_parser=None, block_index=None, db=None):
+def get_tx_info(tx_hex, block_parser=None, block_index=None, db=None, prevouts=None):
     """Get the transaction info. Returns normalized None data for DecodeError and BTCOnlyError."""
     try:
-        return _get_tx_info(tx_hex, block_parser, block_index, db=db)
+        return _get_tx_info(tx_hex, block_parser, block_index, db=db, prevouts=prevouts)
     except (DecodeError, BTCOnlyError):
         # NOTE: For debugging, logger.debug('Could not decode: ' + str(e))
         return b'', None, None, None, None
 
 
-def _get_tx_info(tx_hex, block_parser=None, block_index=None, db=None):
+def _get_tx_info(tx_hex, block_parser=None, block_index=None, db=None, prevouts=None):
     """Get the transaction info. Calls one of two subfunctions depending on signature type."""
     if not block_index:
         block_index = util.CURRENT_BLOCK_INDEX
     if util.enabled('p2sh_addresses', block_index=block_index):   # Protocol change.
-        return get_tx_info3(tx_hex, block_parser=block_parser, db=db, block_index=block_index)
+        return get_tx_info3(tx_hex, block_parser=block_parser, db=db, block_index=block_index, prevouts=prevouts)
     elif util.enabled('multisig_addresses', block_index=block_index):   # Protocol change.
-        return get_tx_info2(tx_hex, block_parser=block_parser, db=db)
+        return get_tx_info2(tx_hex, block_parser=block_parser, db=db, prevouts=prevouts)
     else:
         return get_tx_info1(tx_hex, block_index, block_parser=block_parser, db=db)
 
 
+def may_carry_data(ctx):
+    """Cheaply tell whether a transaction may have Aspire data outputs.
+
+    False positives only cost an unneeded prevout fetch, so any output that
+    `get_tx_info2()` could read as data counts.
+    """
+    if ctx.is_coinbase():
+        return False
+    key = ctx.vin[0].prevout.hash[::-1]
+    for vout in ctx.vout:
+        try:
+            asm = script.get_asm(vout.scriptPubKey)
+        except (DecodeError, CScriptInvalidError):
+            continue
+        if asm[0] == 'OP_RETURN' or asm[-1] == 'OP_CHECKMULTISIG':
+            return True
+        elif asm[-1] == 'OP_CHECKSIG':
+            try:
+                pubkeyhash = script.get_checksig(asm)
+            except DecodeError:
+                continue
+            chunk = ARC4.new(key).decrypt(pubkeyhash)
+            if chunk[1:len(config.PREFIX) + 1] == config.PREFIX:
+                return True
+    return False
+
+
+def get_prevouts(raw_transactions):
+    """Fetch, in a single batch call, the transactions spent by those of
+    `raw_transactions` that may carry data. Returns their raw hex keyed by
+    hash, to be passed to `get_tx_info()`."""
+    prevout_hashes = set()
+    for tx_hex in raw_transactions.values():
+        ctx = backend.deserialize(tx_hex)
+        if may_carry_data(ctx):
+            prevout_hashes.update(ib2h(vin.prevout.hash) for vin in ctx.vin)
+
+    # Inputs may spend outputs of earlier transactions in the same block.
+    prevouts = {}
+    for tx_hash in prevout_hashes.intersection(raw_transactions.keys()):
+        prevouts[tx_hash] = raw_transactions[tx_hash]
+    prevout_hashes.difference_update(prevouts.keys())
+
+    # Missing transactions are left for `get_tx_info()` to report.
+    if prevout_hashes:
+        for tx_hash, tx_hex in backend.getrawtransaction_batch(list(prevout_hashes), skip_missing=True).items():
+            if tx_hex is not None:
+                prevouts[tx_hash] = tx_hex
+    return prevouts
+
+
+def get_decode_pool():
+    """Return the process pool used by `decode_txs()`, or None if disabled.
+
+    Workers are spawned, not forked: by the time the pool is created the
+    parser holds database handles, backend sessions and the locks of its
+    prefetching threads, none of which may be shared with a child."""
+    global DECODE_POOL
+    if DECODE_POOL is None and config.DECODE_WORKERS:
+        config_values = {name: value for name, value in vars(config).items() if name.isupper()}
+        DECODE_POOL = concurrent.futures.ProcessPoolExecutor(max_workers=config.DECODE_WORKERS,
+                                                             mp_context=multiprocessing.get_context('spawn'),
+                                                             initializer=_init_decode_worker, initargs=(config_values,))
+    return DECODE_POOL
+
+
+def _init_decode_worker(config_values):
+    for name, value in config_values.items():
+        setattr(config, name, value)
+
+
+def _decode_txs(tx_hexes, block_index, current_block_index, prevouts):
+    util.CURRENT_BLOCK_INDEX = current_block_index
+    return [get_tx_info(tx_hex, block_index=block_index, prevouts=prevouts) for tx_hex in tx_hexes]
+
+
+def decode_txs(tx_hexes, block_index=None, prevouts=None):
+    """Run `get_tx_info()` on each of `tx_hexes` in the decode process pool.
+
+    Returns the `(source, destination, btc_amount, fee, data)` tuples in the
+    order of `tx_hexes`, or None if no pool is configured. Workers have no
+    database connection, so a coinbase that may pay proof of work must be
+    decoded by the caller instead.
+    """
+    pool = get_decode_pool()
+    if pool is None:
+        return None
+    chunks = util.chunkify(tx_hexes, -(-len(tx_hexes) // config.DECODE_WORKERS))
+    futures = [pool.submit(_decode_txs, chunk, block_index, util.CURRENT_BLOCK_INDEX, prevouts) for chunk in chunks]
+    tx_infos = []
+    for future in futures:
+        tx_infos += future.result()
+    return tx_infos
+
+
 def get_tx_info1(tx_hex, block_index, block_parser=None, db=None):
     """Get singlesig transaction info.
     The destination, if it exists, always comes before the data output; the
@@ -594,14 +746,17 @@ def get_tx_info1(tx_hex, block_index, block_parser=None, db=None):
     return source, destination, btc_amount, fee, data
 
 
-def get_tx_info3(tx_hex, block_parser=None, db=None, block_index=None):
-    return get_tx_info2(tx_hex, block_parser=block_parser, p2sh_support=True, db=db, block_index=block_index)
+def get_tx_info3(tx_hex, block_parser=None, db=None, block_index=None, prevouts=None):
+    return get_tx_info2(tx_hex, block_parser=block_parser, p2sh_support=True, db=db, block_index=block_index, prevouts=prevouts)
 
 
-def get_tx_info2(tx_hex, block_parser=None, p2sh_support=False, db=None, block_index=None):
+def get_tx_info2(tx_hex, block_parser=None, p2sh_support=False, db=None, block_index=None, prevouts=None):
     """Get multisig transaction info.
     The destinations, if they exists, always comes before the data output; the
     change, if it exists, always comes after.
+
+    `prevouts` optionally maps hashes of input transactions to their raw hex
+    (see `get_prevouts()`); inputs not found there are fetched.
     """
     # Decode transaction binary.
     ctx = backend.deserialize(tx_hex)
@@ -729,6 +884,8 @@ def get_tx_info2(tx_hex, block_parser=None, p2sh_support=False, db=None, block_i
         if block_parser:
             vin_tx = block_parser.read_raw_transaction(ib2h(vin.prevout.hash))
             vin_ctx = backend.deserialize(vin_tx['__data__'])
+        elif prevouts and ib2h(vin.prevout.hash) in prevouts:
+            vin_ctx = backend.deserialize(prevouts[ib2h(vin.prevout.hash)])
         else:
             vin_tx = backend.getrawtransaction(ib2h(vin.prevout.hash))
             vin_ctx = backend.deserialize(vin_tx)
@@ -770,6 +927,8 @@ def reinitialise(db, block_index=None):
     # Delete all of the results of parsing (including the undolog)
     for table in TABLES + ['balances', 'undolog', 'undolog_block']:
         cursor.execute('''DROP TABLE IF EXISTS {}'''.format(table))
+    log.reset_message_index()
+    util.clear_asset_cache()
 
     # Create missing tables
     initialise(db)
@@ -800,9 +959,170 @@ def reinitialise(db, block_index=None):
     cursor.close()
 
 
-def reparse(db, block_index=None, quiet=False):
+def snapshot_path(block_index):
+    return '{}.snapshot.{}'.format(config.DATABASE, block_index)
+
+
+def list_snapshots():
+    """Return the block indexes of the ledger snapshots on disk, newest first."""
+    prefix = snapshot_path('')
+    block_indexes = []
+    for path in glob.glob(glob.escape(prefix) + '*'):
+        if path[len(prefix):].isdigit():
+            block_indexes.append(int(path[len(prefix):]))
+    return sorted(block_indexes, reverse=True)
+
+
+def write_snapshot(db, block_index):
+    """Copy the ledger state at the end of block `block_index` to a snapshot,
+    tagged with the block hash and consensus hashes, and prune old snapshots."""
+    path = snapshot_path(block_index)
+    if os.path.exists(path + '.tmp'):
+        os.remove(path + '.tmp')
+
+    snapshot_start = time.time()
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    cursor.execute('''ATTACH DATABASE ? AS snapshot''', (path + '.tmp',))
+    try:
+        with db:
+            cursor.execute('''CREATE TABLE snapshot.snapshot_block AS
+                              SELECT block_index, block_hash, ledger_hash, txlist_hash, messages_hash
+                              FROM main.blocks WHERE block_index = ?''', (block_index,))
+            for table in SNAPSHOT_TABLES:
+                cursor.execute('''CREATE TABLE snapshot.{} AS SELECT rowid AS snapshot_rowid, * FROM main.{}'''.format(table, table))
+    finally:
+        cursor.execute('''DETACH DATABASE snapshot''')
+        cursor.close()
+    os.replace(path + '.tmp', path)
+
+    for old_block_index in list_snapshots()[config.SNAPSHOT_RETENTION:]:
+        os.remove(snapshot_path(old_block_index))
+    logger.info('Wrote ledger snapshot at block {} ({:.2f}s).'.format(block_index, time.time() - snapshot_start))
+
+
+def attach_snapshot(db, block_index):
+    """Attach, as `snapshot`, the newest ledger snapshot at or below `block_index`
+    whose tags match the blocks table, and return its block index (or `None`)."""
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    for snapshot_block_index in list_snapshots():
+        if snapshot_block_index > block_index:
+            continue
+        cursor.execute('''ATTACH DATABASE ? AS snapshot''', (snapshot_path(snapshot_block_index),))
+        try:
+            tables = [row[0] for row in cursor.execute("""SELECT name FROM snapshot.sqlite_master WHERE type = 'table'""")]
+            tags = list(cursor.execute('''SELECT block_index, block_hash, ledger_hash, txlist_hash, messages_hash FROM snapshot.snapshot_block'''))
+            blocks = list(cursor.execute('''SELECT block_index, block_hash, ledger_hash, txlist_hash, messages_hash FROM main.blocks
+                                            WHERE block_index = ?''', (snapshot_block_index,)))
+            if set(SNAPSHOT_TABLES) <= set(tables) and len(tags) == 1 and tags == blocks and None not in tags[0]:
+                cursor.close()
+                return snapshot_block_index
+        except apsw.Error as e:
+            logger.warning('Could not read ledger snapshot at block {} ({}).'.format(snapshot_block_index, e))
+        logger.info('Skipping ledger snapshot at block {}, which does not match the database.'.format(snapshot_block_index))
+        cursor.execute('''DETACH DATABASE snapshot''')
+    cursor.close()
+    return None
+
+
+def restore_snapshot(db):
+    """Copy the attached snapshot over the ledger tables."""
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    for table in SNAPSHOT_TABLES:
+        # `initialise()` has listed some rows already (the `assets` of GASP and ASP).
+        cursor.execute('''DELETE FROM main.{}'''.format(table))
+        columns = [column[1] for column in cursor.execute('''PRAGMA snapshot.table_info({})'''.format(table))]
+        cursor.execute('''INSERT INTO main.{}(rowid,{}) SELECT {} FROM snapshot.{}'''.format(
+            table, ','.join(columns[1:]), ','.join(columns), table))
+    # The undolog cannot reach back past the snapshot.
+    cursor.execute('''DELETE FROM undolog''')
+    cursor.execute('''DELETE FROM undolog_block''')
+    cursor.close()
+
+
+def drop_deferred_indexes(db):
+    """Drop the non-unique indexes of `DEFERRED_INDEX_TABLES`; `initialise()`
+    creates them again."""
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    indexes = list(cursor.execute('''SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({})'''.format(
+        ','.join('?' * len(DEFERRED_INDEX_TABLES))), DEFERRED_INDEX_TABLES))
+    for name, sql in indexes:
+        if not sql.upper().startswith('CREATE UNIQUE'):
+            cursor.execute('''DROP INDEX {}'''.format(name))
+    cursor.close()
+
+
+def interrupted_reparse(db):
+    """Return the cursor of a checkpointed reparse that did not finish, or `None`."""
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reparse_cursor(
+                        target_block_index INTEGER,
+                        last_block_index INTEGER,
+                        ledger_hash TEXT,
+                        txlist_hash TEXT,
+                        messages_hash TEXT)
+                   ''')
+    reparse_cursors = list(cursor.execute('''SELECT * FROM reparse_cursor'''))
+    cursor.close()
+    return reparse_cursors[0] if reparse_cursors else None
+
+
+def save_reparse_cursor(db, target_block_index, last_block_index, ledger_hash, txlist_hash, messages_hash):
+    # The cursor is not part of the ledger: keep it out of the messages.
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.execute('''DELETE FROM reparse_cursor''')
+    cursor.execute('''INSERT INTO reparse_cursor VALUES(?,?,?,?,?)''',
+                   (target_block_index, last_block_index, ledger_hash, txlist_hash, messages_hash))
+    cursor.close()
+
+
+def replay_undolog(cursor, undolog):
+    """Replay undolog entries `(undo_index, table_name, op, row_id, *old_row)`,
+    newest first, with one `executemany()` per run of the same table and
+    operation.
+
+    Updates are undone with `UPDATE`, as the statements of the old undolog
+    did, so that the triggers on the tables see the same changes.
+
+    Return the number of entries replayed per table.
+    """
+    columns = {}
+    replayed = collections.Counter()
+    for (table, op), entries in itertools.groupby(undolog, key=lambda entry: (entry[1], entry[2])):
+        entries = list(entries)
+        replayed[table] += len(entries)
+        if op == UNDO_DELETE:
+            cursor.executemany('''DELETE FROM {} WHERE rowid = ?'''.format(table), [(entry[3],) for entry in entries])
+            continue
+
+        if table not in columns:
+            columns[table] = [column[1] for column in cursor.execute('''PRAGMA table_info({})'''.format(table))]
+        width = len(columns[table])
+        if op == UNDO_UPDATE:
+            cursor.executemany('''UPDATE {} SET {} WHERE rowid = ?'''.format(table, ','.join('{} = ?'.format(c) for c in columns[table])),
+                               [entry[4:4 + width] + entry[3:4] for entry in entries])
+        else:
+            cursor.executemany('''INSERT INTO {}(rowid,{}) VALUES({})'''.format(table, ','.join(columns[table]), ','.join('?' * (width + 1))),
+                               [entry[3:4 + width] for entry in entries])
+    return replayed
+
+
+def reparse(db, block_index=None, quiet=False, fast=False):
     """Reparse all transactions (atomically). If block_index is set, rollback
     to the end of that block.
+
+    With `fast`, a reparse that cannot use the undolog runs with the database
+    locked in `database.FAST_WRITE_PRAGMAS` mode and builds the indexes of
+    `DEFERRED_INDEX_TABLES` only once it is done.
     """
     def reparse_from_undolog(db, block_index, quiet):
         """speedy reparse method that utilizes the undolog.
@@ -814,47 +1134,45 @@ def reparse(db, block_index=None, quiet=False):
         undolog_cursor.setexectrace(None)
         undolog_cursor.setrowtrace(None)
 
-        def get_block_index_for_undo_index(undo_indexes, undo_index):
-            for block_index, first_undo_index in undo_indexes.items():  # in order
-                if undo_index < first_undo_index:
-                    return block_index - 1
-            else:
-                return next(reversed(undo_indexes))  # the last inserted block_index
-
-        with db:
-            # Check if we can reparse from the undolog
-            results = list(undolog_cursor.execute(
-                '''SELECT block_index, first_undo_index FROM undolog_block WHERE block_index >= ? ORDER BY block_index ASC''', (block_index,)))
-            undo_indexes = collections.OrderedDict()
-            for result in results:
-                undo_indexes[result[0]] = result[1]
-
-            undo_start_block_index = block_index + 1
-
-            if undo_start_block_index not in undo_indexes:
-                if block_index in undo_indexes:
-                    # Edge case, should only happen if we're "rolling back" to latest block (e.g. via cmd line)
-                    return True  # skip undo
-                else:
-                    return False  # Undolog doesn't go that far back, full reparse required...
-
-            # Grab the undolog...
-            undolog = list(undolog_cursor.execute(
-                '''SELECT undo_index, sql FROM undolog WHERE undo_index >= ? ORDER BY undo_index DESC''',
-                (undo_indexes[undo_start_block_index],)))
-
-            # Replay the undolog backwards, from the last entry to first_undo_index...
-            for entry in undolog:
-                logger.info("Undolog: Block {} (undo_index {}): {}".format(
-                    get_block_index_for_undo_index(undo_indexes, entry[0]), entry[0], entry[1]))
-                undolog_cursor.execute(entry[1])
-
-            # Trim back tx and blocks
-            undolog_cursor.execute('''DELETE FROM transactions WHERE block_index > ?''', (block_index,))
-            undolog_cursor.execute('''DELETE FROM blocks WHERE block_index > ?''', (block_index,))
-            # As well as undolog entries...
-            undolog_cursor.execute('''DELETE FROM undolog WHERE undo_index >= ?''', (undo_indexes[undo_start_block_index],))
-            undolog_cursor.execute('''DELETE FROM undolog_block WHERE block_index >= ?''', (undo_start_block_index,))
+        try:
+            with db:
+                # Check if we can reparse from the undolog
+                results = list(undolog_cursor.execute(
+                    '''SELECT block_index, first_undo_index FROM undolog_block WHERE block_index >= ? ORDER BY block_index ASC''', (block_index,)))
+                undo_indexes = collections.OrderedDict()
+                for result in results:
+                    undo_indexes[result[0]] = result[1]
+
+                undo_start_block_index = block_index + 1
+
+                if undo_start_block_index not in undo_indexes:
+                    if block_index in undo_indexes:
+                        # Edge case, should only happen if we're "rolling back" to latest block (e.g. via cmd line)
+                        return True  # skip undo
+                    else:
+                        return False  # Undolog doesn't go that far back, full reparse required...
+
+                # Grab the undolog...
+                undolog = undolog_cursor.execute(
+                    '''SELECT * FROM undolog WHERE undo_index >= ? ORDER BY undo_index DESC''',
+                    (undo_indexes[undo_start_block_index],))
+
+                # Replay the undolog backwards, from the last entry to first_undo_index...
+                undo_start = time.time()
+                replayed = replay_undolog(undolog_cursor, list(undolog))
+                logger.info('Undolog: replayed {} entries for blocks {} to {} in {:.3f}s ({}).'.format(
+                    sum(replayed.values()), undo_start_block_index, next(reversed(undo_indexes)), time.time() - undo_start,
+                    ', '.join('{}: {}'.format(table, count) for table, count in replayed.most_common())))
+
+                # Trim back tx and blocks
+                undolog_cursor.execute('''DELETE FROM transactions WHERE block_index > ?''', (block_index,))
+                undolog_cursor.execute('''DELETE FROM blocks WHERE block_index > ?''', (block_index,))
+                # As well as undolog entries...
+                undolog_cursor.execute('''DELETE FROM undolog WHERE undo_index >= ?''', (undo_indexes[undo_start_block_index],))
+                undolog_cursor.execute('''DELETE FROM undolog_block WHERE block_index >= ?''', (undo_start_block_index,))
+        except apsw.Error as e:
+            logger.warning('Could not replay undolog ({}).'.format(e))
+            return False
 
         undolog_cursor.close()
         return True
@@ -867,50 +1185,121 @@ def reparse(db, block_index=None, quiet=False):
     check.software_version()
     reparse_start = time.time()
 
-    # Reparse from the undolog if possible
-    reparsed = reparse_from_undolog(db, block_index, quiet)
-
     cursor = db.cursor()
 
+    # Resume a checkpointed reparse towards the same block; another target starts over.
+    resume = interrupted_reparse(db)
+    if resume and resume['target_block_index'] != block_index:
+        logger.warning('Discarding interrupted reparse towards block {}.'.format(resume['target_block_index']))
+        with db:
+            cursor.execute('''DELETE FROM reparse_cursor''')
+        resume = None
+
+    # Reparse from the undolog if possible
+    reparsed = not resume and reparse_from_undolog(db, block_index, quiet)
+
     if not reparsed:
-        if block_index:
+        if block_index and not resume:
             logger.info("Could not roll back from undolog. Performing full reparse instead...")
 
         if quiet:
             root_logger = logging.getLogger()
             root_level = logger.getEffectiveLevel()
 
-        with db:
-            reinitialise(db, block_index)
-
-            # Reparse all blocks, transactions.
-            if quiet:
-                root_logger.setLevel(logging.WARNING)
-
-            previous_ledger_hash, previous_txlist_hash, previous_messages_hash = None, None, None
-            cursor.execute('''SELECT * FROM blocks ORDER BY block_index''')
-            for block in cursor.fetchall():
-                util.CURRENT_BLOCK_INDEX = block['block_index']
-                previous_ledger_hash, previous_txlist_hash, previous_messages_hash, previous_found_messages_hash = parse_block(
-                                                                         db, block['block_index'], block['block_time'],
-                                                                         previous_ledger_hash=previous_ledger_hash,
-                                                                         previous_txlist_hash=previous_txlist_hash,
-                                                                         previous_messages_hash=previous_messages_hash,
-                                                                         reparse=True)
-                if quiet and block['block_index'] % 10 == 0:  # every 10 blocks print status
-                    root_logger.setLevel(logging.INFO)
-                logger.info('Block (re-parse): %s (hashes: L:%s / TX:%s / M:%s%s)' % (
-                    block['block_index'], previous_ledger_hash[-5:], previous_txlist_hash[-5:], previous_messages_hash[-5:],
-                    (' [overwrote %s]' % previous_found_messages_hash) if previous_found_messages_hash and previous_found_messages_hash != previous_messages_hash else ''))
-                if quiet and block['block_index'] % 10 == 0:
+        # Start from the newest ledger snapshot not past the rollback, if any.
+        snapshot_block_index = attach_snapshot(db, block_index) if block_index and not resume else None
+
+        if fast:
+            logger.info('Fast reparse: relaxing durability and deferring index builds.')
+            previous_settings = database.enter_fast_write_mode(db)
+        try:
+            # Without checkpoints, the whole reparse is a single transaction.
+            with (contextlib.ExitStack() if config.REPARSE_CHECKPOINT_INTERVAL else db):
+                with db:
+                    if resume:
+                        logger.info('Resuming interrupted reparse after block {}.'.format(resume['last_block_index']))
+                        last_block_index = resume['last_block_index']
+                        previous_ledger_hash = resume['ledger_hash']
+                        previous_txlist_hash = resume['txlist_hash']
+                        previous_messages_hash = resume['messages_hash']
+                    else:
+                        reinitialise(db, block_index)
+
+                        last_block_index = 0
+                        previous_ledger_hash, previous_txlist_hash, previous_messages_hash = None, None, None
+                        if snapshot_block_index is not None:
+                            logger.info('Restoring ledger snapshot at block {}.'.format(snapshot_block_index))
+                            restore_snapshot(db)
+                            cursor.execute('''SELECT * FROM blocks WHERE block_index = ?''', (snapshot_block_index,))
+                            snapshot_block = cursor.fetchall()[0]
+                            last_block_index = snapshot_block_index
+                            previous_ledger_hash = snapshot_block['ledger_hash']
+                            previous_txlist_hash = snapshot_block['txlist_hash']
+                            previous_messages_hash = snapshot_block['messages_hash']
+                        holderindex.rebuild(db)
+                    if fast:
+                        drop_deferred_indexes(db)
+                    if config.REPARSE_CHECKPOINT_INTERVAL:
+                        save_reparse_cursor(db, block_index, last_block_index,
+                                            previous_ledger_hash, previous_txlist_hash, previous_messages_hash)
+
+                # Reparse all blocks, transactions.
+                if quiet:
                     root_logger.setLevel(logging.WARNING)
 
+                cursor.execute('''SELECT * FROM blocks WHERE block_index > ? ORDER BY block_index''', (last_block_index,))
+                reparse_blocks = cursor.fetchall()
+                checkpoint_interval = config.REPARSE_CHECKPOINT_INTERVAL or len(reparse_blocks) or 1
+                for i in range(0, len(reparse_blocks), checkpoint_interval):
+                    with db:
+                        for block in reparse_blocks[i:i + checkpoint_interval]:
+                            util.CURRENT_BLOCK_INDEX = block['block_index']
+                            previous_ledger_hash, previous_txlist_hash, previous_messages_hash, previous_found_messages_hash = parse_block(
+                                                                                     db, block['block_index'], block['block_time'],
+                                                                                     previous_ledger_hash=previous_ledger_hash,
+                                                                                     previous_txlist_hash=previous_txlist_hash,
+                                                                                     previous_messages_hash=previous_messages_hash,
+                                                                                     reparse=True)
+                            if quiet and block['block_index'] % 10 == 0:  # every 10 blocks print status
+                                root_logger.setLevel(logging.INFO)
+                            logger.info('Block (re-parse): %s (hashes: L:%s / TX:%s / M:%s%s)' % (
+                                block['block_index'], previous_ledger_hash[-5:], previous_txlist_hash[-5:], previous_messages_hash[-5:],
+                                (' [overwrote %s]' % previous_found_messages_hash) if previous_found_messages_hash and previous_found_messages_hash != previous_messages_hash else ''))
+                            if quiet and block['block_index'] % 10 == 0:
+                                root_logger.setLevel(logging.WARNING)
+
+                        if config.REPARSE_CHECKPOINT_INTERVAL:
+                            save_reparse_cursor(db, block_index, block['block_index'],
+                                                previous_ledger_hash, previous_txlist_hash, previous_messages_hash)
+
+                with db:
+                    # Recreate any index dropped by this reparse, or by the interrupted one.
+                    if fast or resume:
+                        initialise(db)
+                    if config.REPARSE_CHECKPOINT_INTERVAL:
+                        cursor.execute('''DELETE FROM reparse_cursor''')
+        finally:
+            if snapshot_block_index is not None:
+                cursor.execute('''DETACH DATABASE snapshot''')
+            if fast:
+                database.leave_fast_write_mode(db, previous_settings)
+
         if quiet:
             root_logger.setLevel(root_level)
 
+    # Re-read the message index and assets after rolling back or reparsing.
+    log.reset_message_index()
+    util.clear_asset_cache()
+
     with db:
+        # Blocks past `block_index` are gone: so are their outputs and spends.
+        if block_index:
+            utxoindex.rollback(db, block_index)
+
         # Check for conservation of assets.
         #check.asset_conservation(db)
+        if config.HOLDER_INDEX and config.CHECK_ASSET_CONSERVATION:
+            check.holder_index(db)
 
         # Update database version number.
         database.update_version(db)
@@ -924,7 +1313,7 @@ def reparse(db, block_index=None, quiet=False):
         database.vacuum(db)
 
 
-def list_tx(db, block_hash, block_index, block_time, tx_hash, tx_index, tx_hex=None):
+def list_tx(db, block_hash, block_index, block_time, tx_hash, tx_index, tx_hex=None, prevouts=None):
     assert type(tx_hash) == str
     cursor = db.cursor()
 
@@ -937,7 +1326,7 @@ def list_tx(db, block_hash, block_index, block_time, tx_hash, tx_index, tx_hex=N
     # Get the important details about each transaction.
     if tx_hex is None:
         tx_hex = backend.getrawtransaction(tx_hash)
-    source, destination, btc_amount, fee, data = get_tx_info(tx_hex, db=db)
+    source, destination, btc_amount, fee, data = get_tx_info(tx_hex, db=db, prevouts=prevouts)
 
     # For mempool
     if block_hash is None:
@@ -978,6 +1367,77 @@ def list_tx(db, block_hash, block_index, block_time, tx_hash, tx_index, tx_hex=N
     return tx_index
 
 
+def get_tx_rows(db, block_hash, block_index, block_time, txhash_list, raw_transactions, tx_index, prevouts=None):
+    """Decode the transactions of `txhash_list` that are not yet listed, and
+    return rows for the `transactions` table for the Aspire ones among them,
+    numbered from `tx_index`. With `block_hash` None, they are mempool
+    transactions.
+    """
+    cursor = db.cursor()
+
+    # Edge case: confirmed tx_hash also in mempool
+    listed = set()
+    for txhash_chunk in util.chunkify(txhash_list, 500):
+        cursor.execute('''SELECT tx_hash FROM transactions WHERE tx_hash IN ({})'''.format(','.join('?' * len(txhash_chunk))), txhash_chunk)
+        listed.update(transaction['tx_hash'] for transaction in cursor)
+    cursor.close()
+    txhash_list = [tx_hash for tx_hash in txhash_list if tx_hash not in listed]
+
+    # For mempool
+    if block_hash is None:
+        block_hash = config.MEMPOOL_BLOCK_HASH
+        block_index = config.MEMPOOL_BLOCK_INDEX
+        coinbase_hash = None
+    else:
+        assert block_index == util.CURRENT_BLOCK_INDEX
+        coinbase_hash = txhash_list[0] if txhash_list else None
+
+    # Decode all but the coinbase in parallel, if enabled.
+    parallel_txhash_list = [tx_hash for tx_hash in txhash_list if tx_hash != coinbase_hash]
+    tx_infos = decode_txs([raw_transactions[tx_hash] for tx_hash in parallel_txhash_list], prevouts=prevouts)
+    tx_infos = dict(zip(parallel_txhash_list, tx_infos)) if tx_infos is not None else {}
+
+    rows = []
+    for tx_hash in txhash_list:
+        if tx_hash in tx_infos:
+            source, destination, btc_amount, fee, data = tx_infos[tx_hash]
+        else:
+            source, destination, btc_amount, fee, data = get_tx_info(raw_transactions[tx_hash], db=db, prevouts=prevouts)
+
+        if source and (data or destination == config.UNSPENDABLE):
+            logger.debug('Saving transaction: {}'.format(tx_hash))
+            rows.append((tx_index, tx_hash, block_index, block_hash, block_time, source, destination, btc_amount, fee, data))
+            tx_index += 1
+        else:
+            logger.getChild('list_tx.skip').debug('Skipping transaction: {}'.format(tx_hash))
+
+    return rows
+
+
+def insert_tx_rows(db, rows):
+    """Insert rows from `get_tx_rows()` into the `transactions` table."""
+    cursor = db.cursor()
+    cursor.executemany('''INSERT INTO transactions(
+                            tx_index,
+                            tx_hash,
+                            block_index,
+                            block_hash,
+                            block_time,
+                            source,
+                            destination,
+                            btc_amount,
+                            fee,
+                            data) VALUES(?,?,?,?,?,?,?,?,?,?)''', rows)
+    cursor.close()
+
+
+def list_txs(db, block_hash, block_index, block_time, txhash_list, raw_transactions, tx_index, prevouts=None):
+    """List all the transactions of a block at once. Return the next tx_index."""
+    rows = get_tx_rows(db, block_hash, block_index, block_time, txhash_list, raw_transactions, tx_index, prevouts=prevouts)
+    insert_tx_rows(db, rows)
+    return tx_index + len(rows)
+
+
 def kickstart(db, gaspd_dir):
     if gaspd_dir is None:
         if platform.system() == 'Darwin':
@@ -1026,8 +1486,22 @@ def kickstart(db, gaspd_dir):
 
             # Get `tx_info`s for transactions in this block.
             block = block_parser.read_raw_block(current_hash)
-            for tx in block['transactions']:
-                source, destination, btc_amount, fee, data = get_tx_info(tx['__data__'], block_parser=block_parser, block_index=block['block_index'])
+            tx_infos = None
+            if get_decode_pool() is not None:
+                # Read inputs here, as the block parser can't be shared with the pool.
+                prevouts = {}
+                for tx in block['transactions']:
+                    ctx = backend.deserialize(tx['__data__'])
+                    if may_carry_data(ctx):
+                        for vin in ctx.vin:
+                            vin_tx_hash = ib2h(vin.prevout.hash)
+                            prevouts[vin_tx_hash] = block_parser.read_raw_transaction(vin_tx_hash)['__data__']
+                tx_infos = decode_txs([tx['__data__'] for tx in block['transactions']], block_index=block['block_index'], prevouts=prevouts)
+            for i, tx in enumerate(block['transactions']):
+                if tx_infos is not None:
+                    source, destination, btc_amount, fee, data = tx_infos[i]
+                else:
+                    source, destination, btc_amount, fee, data = get_tx_info(tx['__data__'], block_parser=block_parser, block_index=block['block_index'])
                 if source and (data or destination == config.UNSPENDABLE):
                     transactions.append((
                         tx['tx_hash'], block['block_index'], block['block_hash'], block['block_time'],
@@ -1096,6 +1570,41 @@ def last_db_index(db):
         return 0
 
 
+def update_utxo_index(db):
+    """Bring the UTXO index up to the last parsed block, fetching the blocks
+    it misses from the backend. Stops early at a block that differs in the
+    backend, for `follow()` to handle the reorganisation first."""
+    if not config.UTXO_INDEX:
+        return
+
+    last_block_index = last_db_index(db)
+    with db:
+        # In case the index was not rolled back along with the blocks.
+        utxoindex.rollback(db, last_block_index)
+    first_block_index = utxoindex.last_block_index(db) + 1
+    if first_block_index > last_block_index:
+        return
+
+    logger.info('Updating UTXO index from block {} to block {}.'.format(first_block_index, last_block_index))
+    prefetcher = backend.BlockPrefetcher(first_block_index, max(config.BLOCK_PREFETCH_DEPTH, 1))
+    prefetcher.start()
+    cursor = db.cursor()
+    try:
+        for chunk_start in range(first_block_index, last_block_index + 1, UTXO_INDEX_COMMIT_INTERVAL):
+            with db:
+                for block_index in range(chunk_start, min(chunk_start + UTXO_INDEX_COMMIT_INTERVAL, last_block_index + 1)):
+                    block_hash, block, txhash_list, raw_transactions = prefetcher.get(block_index)
+                    blocks = list(cursor.execute('''SELECT block_hash FROM blocks WHERE block_index = ?''', (block_index,)))
+                    if not blocks or blocks[0]['block_hash'] != block_hash:
+                        logger.warning('Block {} differs in the backend: UTXO index left at block {}.'.format(block_index, block_index - 1))
+                        return
+                    utxoindex.index_block(db, block_index, block)
+            logger.info('UTXO index: block {}.'.format(block_index))
+    finally:
+        prefetcher.stop()
+        cursor.close()
+
+
 def get_next_tx_index(db):
     """Return index of next transaction."""
     cursor = db.cursor()
@@ -1109,8 +1618,92 @@ def get_next_tx_index(db):
     return tx_index
 
 
-class MempoolError(Exception):
-    pass
+def refresh_mempool(db, block_index, tx_index, not_supported, not_supported_sorted):
+    """Update the `mempool` table from the mempool of the backend. Return the
+    backend mempool, and the `(tx_hash, message)` pairs of the transactions
+    newly parsed.
+
+    The table is kept as a diff: messages of transactions that left the
+    mempool are dropped, and only new transactions are parsed, each in a
+    savepoint that is rolled back. Transactions that are not Aspire ones are
+    added to `not_supported` (and `not_supported_sorted`), and skipped from
+    then on.
+    """
+    cursor = db.cursor()
+
+    # Fake values for fake block.
+    curr_time = int(time.time())
+    mempool_tx_index = tx_index
+
+    raw_mempool = backend.getrawmempool()
+
+    # We first filter out which transactions we've already parsed before so we can batch fetch their raw data
+    old_mempool_hashes = set(message['tx_hash'] for message in cursor.execute('''SELECT tx_hash FROM mempool'''))
+    evicted_txs = old_mempool_hashes - set(raw_mempool)
+    parse_txs = [tx_hash for tx_hash in raw_mempool if tx_hash not in old_mempool_hashes and tx_hash not in not_supported]
+
+    # fetch raw for all transactions that need to be parsed
+    raw_transactions = backend.getrawtransaction_batch(parse_txs)
+    prevouts = get_prevouts(raw_transactions)
+
+    # Decode them all at once; each is then listed (and rolled back) on its own.
+    tx_rows = {row[1]: row for row in get_tx_rows(db, None, block_index, curr_time, parse_txs, raw_transactions, mempool_tx_index, prevouts=prevouts)}
+
+    xcp_mempool = []
+    with db:
+        cursor.executemany('''DELETE FROM mempool WHERE tx_hash = ?''', [(tx_hash,) for tx_hash in evicted_txs])
+
+        # Assets seen in a rolled-back savepoint must not reach the shared
+        # cache, so the cache is frozen rather than cleared after each one.
+        with util.frozen_asset_cache():
+            for tx_hash in parse_txs:
+                # If a transaction hasn’t been added to the table
+                # `transactions`, then it’s not a Aspire transaction.
+                if tx_hash not in tx_rows:
+                    not_supported[tx_hash] = ''
+                    not_supported_sorted.append((block_index, tx_hash))
+                    continue
+
+                cursor.execute('''SAVEPOINT mempool_tx''')
+                try:
+                    # List the fake block.
+                    cursor.execute('''INSERT INTO blocks(
+                                        block_index,
+                                        block_hash,
+                                        block_time) VALUES(?,?,?)''',
+                                   (config.MEMPOOL_BLOCK_INDEX,
+                                    config.MEMPOOL_BLOCK_HASH,
+                                    curr_time)
+                                   )
+                    insert_tx_rows(db, [tx_rows[tx_hash]])
+
+                    # Parse transaction.
+                    cursor.execute('''SELECT * FROM transactions WHERE tx_hash = ?''', (tx_hash,))
+                    transactions = list(cursor)
+                    assert len(transactions) == 1
+                    supported = parse_tx(db, transactions[0])
+                    if not supported:
+                        not_supported[tx_hash] = ''
+                        not_supported_sorted.append((block_index, tx_hash))
+
+                    # Save transaction and side‐effects in memory.
+                    cursor.execute('''SELECT * FROM messages WHERE block_index = ?''', (config.MEMPOOL_BLOCK_INDEX,))
+                    for message in list(cursor):
+                        xcp_mempool.append((tx_hash, message))
+                finally:
+                    cursor.execute('''ROLLBACK TO mempool_tx''')
+                    cursor.execute('''RELEASE mempool_tx''')
+                    # Message indexes created by this transaction were rolled back too.
+                    log.reset_message_index()
+
+        # Write the messages of new transactions to the database.
+        for message in xcp_mempool:
+            tx_hash, new_message = message
+            new_message['tx_hash'] = tx_hash
+            cursor.execute('''INSERT INTO mempool VALUES(:tx_hash, :command, :category, :bindings, :timestamp)''', new_message)
+
+    cursor.close()
+    return raw_mempool, xcp_mempool
 
 
 def follow(db):
@@ -1120,6 +1713,13 @@ def follow(db):
     # Initialise.
     initialise(db)
 
+    # Finish a reparse interrupted by a crash or shutdown before following.
+    interrupted = interrupted_reparse(db)
+    if interrupted:
+        logger.warning('Resuming interrupted reparse at block {}.'.format(interrupted['last_block_index']))
+        reparse(db, block_index=interrupted['target_block_index'], quiet=False)
+        util.CURRENT_BLOCK_INDEX = last_db_index(db)
+
     # Get index of last block.
     if util.CURRENT_BLOCK_INDEX == 0:
         logger.warning('New database.')
@@ -1143,11 +1743,16 @@ def follow(db):
     # Get index of last transaction.
     tx_index = get_next_tx_index(db)
 
+    update_utxo_index(db)
+
     not_supported = {}   # No false positives. Use a dict to allow for O(1) lookups
     not_supported_sorted = collections.deque()
     # ^ Entries in form of (block_index, tx_hash), oldest first. Allows for easy removal of past, unncessary entries
     cursor = db.cursor()
 
+    # While catching up, upcoming blocks are fetched in the background.
+    prefetcher = None
+
     # a reorg can happen without the block count increasing, or even for that
     # matter, with the block count decreasing. This should only delay
     # processing of the new blocks a bit.
@@ -1169,6 +1774,17 @@ def follow(db):
         # Get new blocks.
         if block_index <= block_count:
 
+            # Get this block (and, while catching up, prefetch the next ones).
+            if prefetcher is None and config.BLOCK_PREFETCH_DEPTH and block_index < block_count:
+                prefetcher = backend.BlockPrefetcher(block_index, config.BLOCK_PREFETCH_DEPTH)
+                prefetcher.start()
+            if prefetcher is not None:
+                block_hash, block, txhash_list, raw_transactions = prefetcher.get(block_index)
+            else:
+                block_hash = backend.getblockhash(block_index)
+                block = backend.getblock(block_hash)
+                txhash_list, raw_transactions = backend.get_tx_list(block)
+
             # Backwards check for incorrect blocks due to chain reorganisation, and stop when a common parent is found.
             current_index = block_index
             requires_rollback = False
@@ -1179,8 +1795,11 @@ def follow(db):
                 logger.debug('Checking that block {} is not an orphan.'.format(current_index))
 
                 # Backend parent hash.
-                current_hash = backend.getblockhash(current_index)
-                current_cblock = backend.getblock(current_hash)
+                if current_index == block_index:
+                    current_cblock = block
+                else:
+                    current_hash = backend.getblockhash(current_index)
+                    current_cblock = backend.getblock(current_hash)
                 backend_parent = bitcoinlib.core.b2lx(current_cblock.hashPrevBlock)
 
                 # DB parent hash.
@@ -1200,6 +1819,11 @@ def follow(db):
 
             # Rollback for reorganisation.
             if requires_rollback:
+                # Prefetched blocks may belong to the orphaned chain.
+                if prefetcher is not None:
+                    prefetcher.stop()
+                    prefetcher = None
+
                 # Record reorganisation.
                 logger.warning('Blockchain reorganisation at block {}.'.format(current_index))
                 log.message(db, block_index, 'reorg', None, {'block_index': current_index})
@@ -1208,18 +1832,17 @@ def follow(db):
                 reparse(db, block_index=current_index - 1, quiet=True)
                 block_index = current_index
                 tx_index = get_next_tx_index(db)
+                update_utxo_index(db)
                 continue
 
             # Check version. (Don’t add any blocks to the database while
             # running an out‐of‐date client!)
             check.software_version()
 
-            # Get and parse transactions in this block (atomically).
-            block_hash = backend.getblockhash(current_index)
-            block = backend.getblock(block_hash)
+            # Parse transactions in this block (atomically).
             previous_block_hash = bitcoinlib.core.b2lx(block.hashPrevBlock)
             block_time = block.nTime
-            txhash_list, raw_transactions = backend.get_tx_list(block)
+            prevouts = get_prevouts(raw_transactions)
 
             with db:
                 util.CURRENT_BLOCK_INDEX = block_index
@@ -1239,13 +1862,22 @@ def follow(db):
                                )
 
                 # List the transactions in the block.
-                for tx_hash in txhash_list:
-                    tx_hex = raw_transactions[tx_hash]
-                    tx_index = list_tx(db, block_hash, block_index, block_time, tx_hash, tx_index, tx_hex)
+                tx_index = list_txs(db, block_hash, block_index, block_time, txhash_list, raw_transactions, tx_index, prevouts=prevouts)
 
                 # Parse the transactions in the block.
                 new_ledger_hash, new_txlist_hash, new_messages_hash, found_messages_hash = parse_block(db, block_index, block_time)
 
+                # Apply the block to the UTXO index, unless it is behind.
+                if config.UTXO_INDEX and utxoindex.last_block_index(db) == block_index - 1:
+                    utxoindex.index_block(db, block_index, block)
+
+                # Record the pubkeys revealed by the block.
+                if config.PUBKEY_INDEX:
+                    pubkeyindex.index_block(db, block)
+
+            if config.SNAPSHOT_INTERVAL and block_index % config.SNAPSHOT_INTERVAL == 0:
+                write_snapshot(db, block_index)
+
             # When newly caught up, check for conservation of assets.
             #if block_index == block_count:
             #    if config.CHECK_ASSET_CONSERVATION:
@@ -1262,110 +1894,30 @@ def follow(db):
                 (' [overwrote %s]' % found_messages_hash) if found_messages_hash and found_messages_hash != new_messages_hash else ''))
 
             # Increment block index.
-            block_count = backend.getblockcount()
             block_index += 1
 
         else:
-            # Get old mempool.
-            old_mempool = list(cursor.execute('''SELECT * FROM mempool'''))
-            old_mempool_hashes = [message['tx_hash'] for message in old_mempool]
+            # Caught up: stop prefetching until we fall behind again.
+            if prefetcher is not None:
+                prefetcher.stop()
+                prefetcher = None
 
             if backend.MEMPOOL_CACHE_INITIALIZED is False:
+                old_mempool_hashes = [message['tx_hash'] for message in cursor.execute('''SELECT tx_hash FROM mempool''')]
                 backend.init_mempool_cache()
                 backend.refresh_unconfirmed_transactions_cache(old_mempool_hashes)
                 logger.info("Ready for queries.")
 
-            # Fake values for fake block.
-            curr_time = int(time.time())
-            mempool_tx_index = tx_index
-
-            xcp_mempool = []
-            raw_mempool = backend.getrawmempool()
-
-            # For each transaction in AspireGas Core mempool, if it’s new, create
-            # a fake block, a fake transaction, capture the generated messages,
-            # and then save those messages.
-            # Every transaction in mempool is parsed independently. (DB is rolled back after each one.)
-            # We first filter out which transactions we've already parsed before so we can batch fetch their raw data
-            parse_txs = []
-            for tx_hash in raw_mempool:
-                # If already in mempool, copy to new one.
-                if tx_hash in old_mempool_hashes:
-                    for message in old_mempool:
-                        if message['tx_hash'] == tx_hash:
-                            xcp_mempool.append((tx_hash, message))
-
-                # If not a supported ASP transaction, skip.
-                elif tx_hash in not_supported:
-                    pass
-
-                # Else: list, parse and save it.
-                else:
-                    parse_txs.append(tx_hash)
-
-            # fetch raw for all transactions that need to be parsed
             # Sometimes the transactions can’t be found: `{'code': -5, 'message': 'No information available about transaction'}`
             #  - is txindex enabled in gAsp?
             #  - or was there a block found while batch feting the raw txs
             #  - or was there a double spend for w/e reason accepted into the mempool (replace-by-fee?)
             try:
-                raw_transactions = backend.getrawtransaction_batch(parse_txs)
+                raw_mempool, xcp_mempool = refresh_mempool(db, block_index, tx_index, not_supported, not_supported_sorted)
             except backend.addrindex.BackendRPCError as e:
                 logger.warning('Failed to fetch raw for mempool TXs, restarting loop; %s', (e, ))
                 continue  # restart the follow loop
 
-            for tx_hash in parse_txs:
-                try:
-                    with db:
-                        # List the fake block.
-                        cursor.execute('''INSERT INTO blocks(
-                                            block_index,
-                                            block_hash,
-                                            block_time) VALUES(?,?,?)''',
-                                       (config.MEMPOOL_BLOCK_INDEX,
-                                        config.MEMPOOL_BLOCK_HASH,
-                                        curr_time)
-                                       )
-
-                        tx_hex = raw_transactions[tx_hash]
-                        mempool_tx_index = list_tx(db, None, block_index, curr_time, tx_hash, tx_index=mempool_tx_index, tx_hex=tx_hex)
-
-                        # Parse transaction.
-                        cursor.execute('''SELECT * FROM transactions WHERE tx_hash = ?''', (tx_hash,))
-                        transactions = list(cursor)
-                        if transactions:
-                            assert len(transactions) == 1
-                            transaction = transactions[0]
-                            supported = parse_tx(db, transaction)
-                            if not supported:
-                                not_supported[tx_hash] = ''
-                                not_supported_sorted.append((block_index, tx_hash))
-                        else:
-                            # If a transaction hasn’t been added to the
-                            # table `transactions`, then it’s not a
-                            # Aspire transaction.
-                            not_supported[tx_hash] = ''
-                            not_supported_sorted.append((block_index, tx_hash))
-                            raise MempoolError
-
-                        # Save transaction and side‐effects in memory.
-                        cursor.execute('''SELECT * FROM messages WHERE block_index = ?''', (config.MEMPOOL_BLOCK_INDEX,))
-                        for message in list(cursor):
-                            xcp_mempool.append((tx_hash, message))
-
-                        # Rollback.
-                        raise MempoolError
-                except MempoolError:
-                    pass
-
-            # Re‐write mempool messages to database.
-            with db:
-                cursor.execute('''DELETE FROM mempool''')
-                for message in xcp_mempool:
-                    tx_hash, new_message = message
-                    new_message['tx_hash'] = tx_hash
-                    cursor.execute('''INSERT INTO mempool VALUES(:tx_hash, :command, :category, :bindings, :timestamp)''', new_message)
-
             refresh_start_time = time.time()
             # let the backend refresh it's mempool stored data
             # Sometimes the transactions can’t be found: `{'code': -5, 'message': 'No information available about transaction'}`
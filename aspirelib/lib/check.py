@@ -7,6 +7,7 @@ import sys
 from aspirelib.lib import config
 from aspirelib.lib import util
 from aspirelib.lib import database
+from aspirelib.lib import holderindex
 
 logger = logging.getLogger(__name__)
 
@@ -85,6 +86,13 @@ def asset_conservation(db):
         logger.debug('{} has been conserved ({} {} both issued and held)'.format(asset, util.value_out(db, asset_issued, asset), asset))
 
 
+def holder_index(db):
+    logger.debug('Checking the asset holder index.')
+    mismatches = holderindex.check(db)
+    if mismatches:
+        raise SanityError('asset holder index out of date for {} holdings, e.g. {} {}'.format(len(mismatches), *mismatches[0]))
+
+
 class VersionError(Exception):
     pass
 
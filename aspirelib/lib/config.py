@@ -96,10 +96,23 @@ EXITCODE_UPDATE_REQUIRED = 5
 DEFAULT_CHECK_ASSET_CONSERVATION = True
 
 BACKEND_RAW_TRANSACTIONS_CACHE_SIZE = 20000
+DEFAULT_BACKEND_RAW_TRANSACTIONS_DISK_CACHE_SIZE = 0  # hex of confirmed transactions kept in `<database>.rawtx`; 0 disables it
+DEFAULT_BACKEND_COMPACT_CACHES = False  # keep cached transactions as raw bytes in memory, decoded on access
+DEFAULT_UTXO_INDEX = False  # maintain a local index of unspent outputs for `get_unspent_txouts()`
+DEFAULT_PUBKEY_INDEX = False  # record the pubkeys revealed in parsed blocks for `pubkeyhash_to_pubkey()`
+DEFAULT_HOLDER_INDEX = False  # maintain the `asset_holders` table of free and escrowed holdings per address
 BACKEND_RPC_BATCH_NUM_WORKERS = 6
 
+DEFAULT_BLOCK_PREFETCH_DEPTH = 10    # number of blocks fetched ahead while catching up; 0 disables prefetching
+DEFAULT_DECODE_WORKERS = 0      # processes decoding block transactions in parallel; 0 decodes in-process
+DEFAULT_API_DB_POOL_SIZE = 10   # read-only database connections shared by the API server threads
+
 UNDOLOG_MAX_PAST_BLOCKS = 100 #the number of past blocks that we store undolog history
 
+DEFAULT_SNAPSHOT_INTERVAL = 0   # blocks between ledger snapshots; 0 disables snapshots
+DEFAULT_SNAPSHOT_RETENTION = 2  # number of ledger snapshots kept on disk
+DEFAULT_REPARSE_CHECKPOINT_INTERVAL = 0  # blocks between commits of a full reparse; 0 reparses in a single transaction
+
 DEFAULT_UTXO_LOCKS_MAX_ADDRESSES = 1000
 DEFAULT_UTXO_LOCKS_MAX_AGE = 3.0 #in seconds
 
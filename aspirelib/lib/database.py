@@ -2,7 +2,9 @@ import apsw
 import logging
 logger = logging.getLogger(__name__)
 import time
-import copy
+import queue
+import threading
+import contextlib
 
 from aspirelib.lib import config
 from aspirelib.lib import util
@@ -11,6 +13,20 @@ from aspirelib.lib import log
 
 BLOCK_MESSAGES = []
 
+# Tables whose changes are not recorded as messages.
+SKIP_TABLES = frozenset([
+    'blocks', 'transactions',
+    'balances', 'messages', 'mempool', 'assets',
+    'suicides', 'postqueue',  # These tables are ephemeral.
+    'nonces', 'storage'  # List message manually.
+])
+# List message manually.
+SKIP_TABLES_UPDATE = SKIP_TABLES | frozenset(['orders', 'bets', 'rps', 'order_matches', 'bet_matches', 'rps_matches', 'contracts', 'proofofwork'])
+
+# `(command, category, record)` per SQL statement, see `statement_info()`.
+STATEMENT_CACHE = {}
+STATEMENT_CACHE_SIZE = 1000
+
 
 def rowtracer(cursor, sql):
     """Converts fetched SQL data into dict-style"""
@@ -20,17 +36,17 @@ def rowtracer(cursor, sql):
     return dictionary
 
 
-def exectracer(cursor, sql, bindings):
+def parse_statement(sql):
+    """Return `(command, category, record)` for an SQL statement, where
+    `record` tells whether it must be recorded as a message; or None if it
+    does not alter a table."""
     # This means that all changes to database must use a very simple syntax.
     # TODO: Need sanity checks here.
     sql = sql.lower()
 
     if sql.startswith('create trigger') or sql.startswith('drop trigger'):
         # CREATE TRIGGER stmts may include an "insert" or "update" as part of them
-        return True
-
-    if isinstance(bindings, tuple):
-        return True
+        return None
 
     # Parse SQL.
     array = sql.split('(')[0].split(' ')
@@ -41,34 +57,55 @@ def exectracer(cursor, sql, bindings):
         category = array[1]
     else:
         # CREATE TABLE, etc
+        return None
+
+    skip_tables = SKIP_TABLES_UPDATE if command == 'update' else SKIP_TABLES
+    return command, category, category not in skip_tables
+
+
+def statement_info(sql):
+    """Memoized `parse_statement()`."""
+    try:
+        return STATEMENT_CACHE[sql]
+    except KeyError:
+        info = parse_statement(sql)
+        # Statements built with inline values (from the API, say) must not grow the cache forever.
+        if len(STATEMENT_CACHE) >= STATEMENT_CACHE_SIZE:
+            STATEMENT_CACHE.clear()
+        STATEMENT_CACHE[sql] = info
+        return info
+
+
+def exectracer(cursor, sql, bindings):
+    if isinstance(bindings, tuple):
         return True
 
-    db = cursor.getconnection()
-    skip_tables = [
-        'blocks', 'transactions',
-        'balances', 'messages', 'mempool', 'assets',
-        'suicides', 'postqueue',  # These tables are ephemeral.
-        'nonces', 'storage'  # List message manually.
-    ]
-    skip_tables_block_messages = copy.copy(skip_tables)
-    if command == 'update':
-        # List message manually.
-        skip_tables += ['orders', 'bets', 'rps', 'order_matches', 'bet_matches', 'rps_matches', 'contracts', 'proofofwork']
+    info = statement_info(sql)
+    if info is None:
+        return True
+    command, category, record = info
 
     # Record alteration in database.
-    if category not in skip_tables:
-        log.message(db, bindings['block_index'], command, category, bindings)
+    if record:
+        record_message(cursor.getconnection(), command, category, bindings)
 
-        # don't include memo as part of the messages hash
-        #   until enhanced_sends are enabled
-        if category == 'sends' and not util.enabled('enhanced_sends'):
-            if isinstance(bindings, dict) and 'memo' in bindings:
-                del bindings['memo']
+    return True
 
-        sorted_bindings = sorted(bindings.items()) if isinstance(bindings, dict) else [bindings]
-        BLOCK_MESSAGES.append('{}{}{}'.format(command, category, sorted_bindings))
 
-    return True
+def record_message(db, command, category, bindings):
+    """Record the message of a ledger write, as the exec tracer does. For
+    writes made with the tracer off, before executing them: the bindings may
+    be altered."""
+    log.message(db, bindings['block_index'], command, category, bindings)
+
+    # don't include memo as part of the messages hash
+    #   until enhanced_sends are enabled
+    if category == 'sends' and not util.enabled('enhanced_sends'):
+        if isinstance(bindings, dict) and 'memo' in bindings:
+            del bindings['memo']
+
+    sorted_bindings = sorted(bindings.items()) if isinstance(bindings, dict) else [bindings]
+    BLOCK_MESSAGES.append('{}{}{}'.format(command, category, sorted_bindings))
 
 
 class DatabaseIntegrityError(exceptions.DatabaseError):
@@ -129,6 +166,90 @@ def get_connection(read_only=True, foreign_keys=True, integrity_check=True):
     return db
 
 
+class ConnectionPool(object):
+    """A bounded pool of read-only connections, shared by the threads of a server.
+
+    A thread checks a connection out with `checkout()`; while it holds one,
+    attribute access on the pool (`cursor()`, `changes()`…) is forwarded to
+    that connection, so the pool can be passed wherever a `db` is expected.
+    """
+    def __init__(self, size):
+        self.semaphore = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def checkout(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None:  # Nested checkout in the same thread.
+            yield db
+            return
+
+        self.semaphore.acquire()
+        try:
+            try:
+                db = self.idle.get_nowait()
+            except queue.Empty:
+                db = get_connection(read_only=True, integrity_check=False)
+            self.local.db = db
+            try:
+                yield db
+            finally:
+                self.local.db = None
+                self.idle.put(db)
+        finally:
+            self.semaphore.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __getattr__(self, name):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            raise exceptions.DatabaseError('No database connection checked out by this thread.')
+        return getattr(db, name)
+
+
+# Settings for bulk writes (a full reparse): no fsync, a large page cache,
+# memory-mapped I/O and an exclusive lock on the database file.
+FAST_WRITE_PRAGMAS = [
+    ('synchronous', 'OFF'),
+    ('cache_size', -1024 * 1024),  # KiB
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', 1024 * 1024 * 1024),
+    ('locking_mode', 'EXCLUSIVE'),
+]
+
+
+def enter_fast_write_mode(db):
+    """Apply `FAST_WRITE_PRAGMAS`, returning the previous settings for
+    `leave_fast_write_mode()`. Must be called outside of a transaction."""
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    previous = []
+    for pragma, value in FAST_WRITE_PRAGMAS:
+        previous.append((pragma, list(cursor.execute('PRAGMA {}'.format(pragma)))[0][0]))
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+    return previous
+
+
+def leave_fast_write_mode(db, previous):
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    for pragma, value in reversed(previous):
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    # The exclusive lock is only released on the next access to the database.
+    cursor.execute('SELECT COUNT(*) FROM sqlite_master').fetchall()
+    cursor.close()
+
+
 def version(db):
     cursor = db.cursor()
     user_version = cursor.execute('PRAGMA user_version').fetchall()[0]['user_version']
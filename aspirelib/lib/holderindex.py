@@ -0,0 +1,156 @@
+"""Holdings of every address in every asset, free and escrowed, kept in the
+`asset_holders` table (`config.HOLDER_INDEX`).
+
+The table aggregates the same rows as `util.holders()`. It is maintained by
+triggers on the balances and escrow tables, so that every credit, debit and
+escrow transition (and every undolog replay) updates it in the same
+statement; `entries` counts the rows behind each holding.
+
+Rows must be updated in place: `INSERT OR REPLACE` fires no delete triggers
+for the rows it replaces, and its conflict policy overrides the `INSERT OR
+IGNORE` of the triggers."""
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+
+from aspirelib.lib import config
+
+# `(table, condition, address, asset, quantity, column)`, as SQL templates on `{row}`.
+SOURCES = [
+    ('balances', None, '{row}.address', '{row}.asset', '{row}.quantity', 'free'),
+    # Funds escrowed in orders and pending order matches.
+    ('orders', "{row}.status = 'open'", '{row}.source', '{row}.give_asset', '{row}.give_remaining', 'escrowed'),
+    ('order_matches', "{row}.status = 'pending'", '{row}.tx0_address', '{row}.forward_asset', '{row}.forward_quantity', 'escrowed'),
+    ('order_matches', "{row}.status = 'pending'", '{row}.tx1_address', '{row}.backward_asset', '{row}.backward_quantity', 'escrowed'),
+    # Bets and RPS (and bet/rps matches) only escrow ASP.
+    ('bets', "{row}.status = 'open'", '{row}.source', '{xcp}', '{row}.wager_remaining', 'escrowed'),
+    ('bet_matches', "{row}.status = 'pending'", '{row}.tx0_address', '{xcp}', '{row}.forward_quantity', 'escrowed'),
+    ('bet_matches', "{row}.status = 'pending'", '{row}.tx1_address', '{xcp}', '{row}.backward_quantity', 'escrowed'),
+    ('rps', "{row}.status = 'open'", '{row}.source', '{xcp}', '{row}.wager', 'escrowed'),
+    ('rps_matches', "{row}.status IN ('pending', 'pending and resolved', 'resolved and pending')", '{row}.tx0_address', '{xcp}', '{row}.wager', 'escrowed'),
+    ('rps_matches', "{row}.status IN ('pending', 'pending and resolved', 'resolved and pending')", '{row}.tx1_address', '{xcp}', '{row}.wager', 'escrowed'),
+    ('executions', "{row}.status IN ('valid', 'out of gas')", '{row}.source', '{xcp}', '{row}.gas_cost', 'free'),
+    # ASP escrowed for not finished executions
+    ('executions', "{row}.status = 'out of gas'", '{row}.source', '{xcp}', '{row}.gas_remained', 'escrowed'),
+]
+
+
+def get_cursor(db):
+    # The index is not part of the ledger: no messages.
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    return cursor
+
+
+def expand(template, row):
+    return template.format(row=row, xcp="'{}'".format(config.XCP))
+
+
+def trigger_names(cursor):
+    return [trigger['name'] for trigger in cursor.execute('''SELECT name FROM sqlite_master WHERE type = ? AND name LIKE ?''', ('trigger', '_holders_%'))]
+
+
+def create_triggers(cursor):
+    for i, (table, condition, address, asset, quantity, column) in enumerate(SOURCES):
+        columns = sorted(set(re.findall(r'\{row\}\.(\w+)', ' '.join(filter(None, (condition, address, asset, quantity))))))
+        for event, row in (('insert', 'new'), ('update', 'new'), ('update', 'old'), ('delete', 'old')):
+            sign, change = ('+', 1) if row == 'new' else ('-', -1)
+            where = 'address = {} AND asset = {}'.format(expand(address, row), expand(asset, row))
+            body = []
+            if row == 'new':
+                body.append('''INSERT OR IGNORE INTO asset_holders(address, asset, free, escrowed, entries)
+                               VALUES({}, {}, 0, 0, 0);'''.format(expand(address, row), expand(asset, row)))
+            body.append('''UPDATE asset_holders SET {column} = {column} {sign} IFNULL({quantity}, 0), entries = entries + {change}
+                           WHERE {where};'''.format(column=column, sign=sign, quantity=expand(quantity, row), change=change, where=where))
+            if row == 'old':
+                body.append('''DELETE FROM asset_holders WHERE {} AND entries = 0;'''.format(where))
+            cursor.execute('''CREATE TRIGGER _holders_{i}_{event}_{row} AFTER {event_sql} ON {table} {when} BEGIN
+                                {body}
+                              END;
+                           '''.format(i=i, event=event, row=row, table=table,
+                                      event_sql='UPDATE OF {}'.format(', '.join(columns)) if event == 'update' else event.upper(),
+                                      when='WHEN {}'.format(expand(condition, row)) if condition else '',
+                                      body='\n'.join(body)))
+
+
+def compute_sql():
+    """Return a query of `(address, asset, free, escrowed, entries)` computed
+    from the balances and escrow tables."""
+    selects = []
+    for table, condition, address, asset, quantity, column in SOURCES:
+        free, escrowed = ('IFNULL({}, 0)'.format(quantity), '0') if column == 'free' else ('0', 'IFNULL({}, 0)'.format(quantity))
+        select = 'SELECT {} AS address, {} AS asset, {} AS free, {} AS escrowed FROM {}'.format(address, asset, free, escrowed, table)
+        if condition:
+            select += ' WHERE {}'.format(condition)
+        selects.append(expand(select, table))
+    return '''SELECT address, asset, SUM(free) AS free, SUM(escrowed) AS escrowed, COUNT(*) AS entries
+              FROM ({}) GROUP BY address, asset'''.format(' UNION ALL '.join(selects))
+
+
+def rebuild(db):
+    """Recompute the table from scratch."""
+    if not config.HOLDER_INDEX:
+        return
+    cursor = get_cursor(db)
+    cursor.execute('''DELETE FROM asset_holders''')
+    cursor.execute('''INSERT INTO asset_holders(address, asset, free, escrowed, entries) {}'''.format(compute_sql()))
+    cursor.close()
+
+
+def initialise(db):
+    """Create the table and its triggers, or drop them if the index is
+    disabled. The triggers are recreated every time; the table is built when
+    it is created."""
+    cursor = get_cursor(db)
+    for name in trigger_names(cursor):
+        cursor.execute('''DROP TRIGGER IF EXISTS {}'''.format(name))
+
+    if not config.HOLDER_INDEX:
+        cursor.execute('''DROP TABLE IF EXISTS asset_holders''')
+        cursor.close()
+        return
+
+    exists = list(cursor.execute('''SELECT name FROM sqlite_master WHERE type = ? AND name = ?''', ('table', 'asset_holders')))
+    cursor.execute('''CREATE TABLE IF NOT EXISTS asset_holders(
+                      address TEXT,
+                      asset TEXT,
+                      free INTEGER,
+                      escrowed INTEGER,
+                      entries INTEGER,
+                      PRIMARY KEY (asset, address))
+                   ''')
+    create_triggers(cursor)
+    cursor.close()
+
+    if not exists:
+        logger.info('Building the asset holder index.')
+        rebuild(db)
+
+
+def get_holders(db, asset):
+    """Return `[{'address', 'free', 'escrowed'}]` for the holders of `asset`."""
+    cursor = db.cursor()
+    holders = list(cursor.execute('''SELECT address, free, escrowed FROM asset_holders WHERE asset = ?''', (asset,)))
+    cursor.close()
+    return holders
+
+
+def get_holder_count(db, asset):
+    """Return the number of addresses listed by `util.holders()` for `asset`."""
+    cursor = db.cursor()
+    count = list(cursor.execute('''SELECT COUNT(*) AS count FROM asset_holders WHERE asset = ?''', (asset,)))[0]['count']
+    cursor.close()
+    return count
+
+
+def check(db):
+    """Return the `(address, asset)` pairs on which the table differs from
+    a fresh computation."""
+    cursor = db.cursor()
+    expected = {(row['address'], row['asset']): row for row in cursor.execute(compute_sql())}
+    found = {(row['address'], row['asset']): row for row in cursor.execute('''SELECT * FROM asset_holders''')}
+    cursor.close()
+    return sorted(key for key in set(expected) | set(found) if expected.get(key) != found.get(key))
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -155,17 +155,50 @@ def isodt(epoch_time):
         return '<datetime>'
 
 
+# Next message index to allocate; `None` until read from the `messages` table.
+MESSAGE_INDEX = None
+
+
+def _next_message_index_in_db(db):
+    cursor = db.cursor()
+    messages = list(cursor.execute('''SELECT MAX(message_index) AS message_index FROM messages'''))
+    cursor.close()
+    if messages[0]['message_index'] is None:
+        return 0
+    return messages[0]['message_index'] + 1
+
+
+def reset_message_index():
+    """Forget the in-memory message index, e.g. after a rollback or a reparse."""
+    global MESSAGE_INDEX
+    MESSAGE_INDEX = None
+
+
+def check_message_index(db):
+    """Resynchronise the in-memory message index with the `messages` table.
+    Called at block boundaries."""
+    global MESSAGE_INDEX
+    message_index = _next_message_index_in_db(db)
+    if MESSAGE_INDEX is not None and MESSAGE_INDEX != message_index:
+        logger.warning('In-memory message index ({}) out of sync with database ({}).'.format(MESSAGE_INDEX, message_index))
+    MESSAGE_INDEX = message_index
+
+
+def next_message_index(db):
+    """Allocate a message index."""
+    global MESSAGE_INDEX
+    if MESSAGE_INDEX is None:
+        MESSAGE_INDEX = _next_message_index_in_db(db)
+    message_index = MESSAGE_INDEX
+    MESSAGE_INDEX += 1
+    return message_index
+
+
 def message(db, block_index, command, category, bindings, tx_hash=None):
     cursor = db.cursor()
 
-    # Get last message index.
-    messages = list(cursor.execute('''SELECT * FROM messages
-                                      WHERE message_index = (SELECT MAX(message_index) from messages)'''))
-    if messages:
-        assert len(messages) == 1
-        message_index = messages[0]['message_index'] + 1
-    else:
-        message_index = 0
+    # Get next message index.
+    message_index = next_message_index(db)
 
     # Not to be misleading…
     if block_index == config.MEMPOOL_BLOCK_INDEX:
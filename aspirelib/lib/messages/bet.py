@@ -74,6 +74,10 @@ def initialise(db):
     cursor.execute('''CREATE INDEX IF NOT EXISTS
                       status_idx ON bets (status)
                    ''')
+    # Index names are shared by all tables, and `expire_idx` is taken by `orders`.
+    cursor.execute('''CREATE INDEX IF NOT EXISTS
+                      bets_status_expire_idx ON bets (status, expire_index)
+                   ''')
 
     # Bet Matches
     cursor.execute('''CREATE TABLE IF NOT EXISTS bet_matches(
@@ -122,6 +126,9 @@ def initialise(db):
     cursor.execute('''CREATE INDEX IF NOT EXISTS
                       status_idx ON bet_matches (status)
                    ''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS
+                      bet_matches_status_deadline_idx ON bet_matches (status, deadline)
+                   ''')
 
     # Bet Expirations
     cursor.execute('''CREATE TABLE IF NOT EXISTS bet_expirations(
@@ -571,7 +578,7 @@ def expire(db, block_index, block_time):
 
     # Expire bets and give refunds for the quantity wager_remaining.
     cursor.execute('''SELECT * FROM bets \
-                      WHERE (status = ? AND expire_index < ?)''', ('open', block_index))
+                      WHERE (status = ? AND expire_index < ?) ORDER BY rowid''', ('open', block_index))
     for bet in cursor.fetchall():
         cancel_bet(db, bet, 'expired', block_index)
 
@@ -587,7 +594,7 @@ def expire(db, block_index, block_time):
 
     # Expire bet matches whose deadline is more than two weeks before the current block time.
     cursor.execute('''SELECT * FROM bet_matches \
-                      WHERE (status = ? AND deadline < ?)''', ('pending', block_time - config.TWO_WEEKS))
+                      WHERE (status = ? AND deadline < ?) ORDER BY rowid''', ('pending', block_time - config.TWO_WEEKS))
     for bet_match in cursor.fetchall():
         cancel_bet_match(db, bet_match, 'expired', block_index)
 
@@ -32,6 +32,7 @@ from aspirelib.lib import exceptions
 from aspirelib.lib import config
 from aspirelib.lib import util
 from aspirelib.lib import log
+from aspirelib.lib import database
 from aspirelib.lib import message_type
 from . import bet
 
@@ -146,127 +147,40 @@ def compose(db, source, timestamp, value, fee_fraction, text):
     return (source, [], data)
 
 
-def parse(db, tx, message):
+def get_settlements(db, tx, timestamp, value, fee_fraction_int):
+    """Return the writes that settle the pending bet matches on the feed of
+    broadcast `tx`, as `(command, category, bindings)`, in the order in which
+    settling the matches one by one makes them: for each match, its credits,
+    its resolution and its new status."""
     cursor = db.cursor()
+    cursor.execute('''SELECT * FROM bet_matches \
+                      WHERE (status=? AND feed_address=?)
+                      ORDER BY tx1_index ASC, tx0_index ASC''',
+                   ('pending', tx['source']))
+    bet_matches = cursor.fetchall()
+    cursor.close()
 
-    # Unpack message.
-    try:
-        if util.enabled('broadcast_pack_text'):
-            timestamp, value, fee_fraction_int, rawtext = struct.unpack(FORMAT + '{}s'.format(len(message) - LENGTH), message)
-            textlen = VarIntSerializer.deserialize(rawtext)
-            text = rawtext[-textlen:]
-
-            assert len(text) == textlen
-        else:
-            if len(message) - LENGTH <= 52:
-                curr_format = FORMAT + '{}p'.format(len(message) - LENGTH)
-            else:
-                curr_format = FORMAT + '{}s'.format(len(message) - LENGTH)
-
-            timestamp, value, fee_fraction_int, text = struct.unpack(curr_format, message)
-
-        try:
-            text = text.decode('utf-8')
-        except UnicodeDecodeError:
-            text = ''
-        status = 'valid'
-    except:
-        timestamp, value, fee_fraction_int, text = 0, None, 0, None
-        status = 'invalid: could not unpack'
-
-    if status == 'valid':
-        # For SQLite3
-        timestamp = min(timestamp, config.MAX_INT)
-        value = min(value, config.MAX_INT)
-
-        problems = validate(db, tx['source'], timestamp, value, fee_fraction_int, text, tx['block_index'])
-        if problems:
-            status = 'invalid: ' + '; '.join(problems)
-
-    # Lock?
-    lock = False
-    if text and text.lower() == 'lock':
-        lock = True
-        timestamp, value, fee_fraction_int, text = 0, None, None, None
-    else:
-        lock = False
-
-    # Add parsed transaction to message-type–specific table.
-    bindings = {
-        'tx_index': tx['tx_index'],
-        'tx_hash': tx['tx_hash'],
-        'block_index': tx['block_index'],
-        'source': tx['source'],
-        'timestamp': timestamp,
-        'value': value,
-        'fee_fraction_int': fee_fraction_int,
-        'text': text,
-        'locked': lock,
-        'status': status,
-    }
-    if "integer overflow" not in status:
-        sql = 'insert into broadcasts values(:tx_index, :tx_hash, :block_index, :source, :timestamp, :value, :fee_fraction_int, :text, :locked, :status)'
-        cursor.execute(sql, bindings)
-    else:
-        logger.warn("Not storing [broadcast] tx [%s]: %s" % (tx['tx_hash'], status))
-        logger.debug("Bindings: %s" % (json.dumps(bindings), ))
-
-    # stop processing if broadcast is invalid for any reason
-    if util.enabled('broadcast_invalid_check') and status != 'valid':
-        return
+    settlements = []
 
-    # Options? if the status is invalid the previous if should have catched it
-    if util.enabled('options_require_memo'):
-        if text and text.lower().startswith('options'):
-            ops_spl = text.split(" ")
-            if len(ops_spl) == 2:
-                change_ops = False
-                options_int = 0
-                try:
-                    options_int = int(ops_spl.pop())
-                    change_ops = True
-                except:
-                    pass
+    def credit(address, quantity, action):
+        bindings = {
+            'block_index': tx['block_index'],
+            'address': address,
+            'asset': config.XCP,
+            'quantity': quantity,
+            'action': action,
+            'event': tx['tx_hash']
+        }
+        settlements.append(('insert', 'credits', bindings))
 
-                if change_ops:
-                    op_bindings = {'block_index': tx['block_index'],
-                                   'address': tx['source'],
-                                   'options': options_int}
-                    sql = 'insert or replace into addresses(address, options, block_index) values(:address, :options, :block_index)'
-                    cursor = db.cursor()
-                    cursor.execute(sql, op_bindings)
+    def resolve(bindings):
+        settlements.append(('insert', 'bet_match_resolutions', bindings))
 
-    # Negative values (default to ignore).
-    if value is None or value < 0:
-        # Cancel Open Bets?
-        if value == -2:
-            cursor.execute('''SELECT * FROM bets \
-                              WHERE (status = ? AND feed_address = ?)''',
-                           ('open', tx['source']))
-            for i in list(cursor):
-                bet.cancel_bet(db, i, 'dropped', tx['block_index'])
-        # Cancel Pending Bet Matches?
-        if value == -3:
-            cursor.execute('''SELECT * FROM bet_matches \
-                              WHERE (status = ? AND feed_address = ?)''',
-                           ('pending', tx['source']))
-            for bet_match in list(cursor):
-                bet.cancel_bet_match(db, bet_match, 'dropped', tx['block_index'])
-        cursor.close()
-        return
+    # Get known bet match type IDs.
+    cfd_type_id = util.BET_TYPE_ID['BullCFD'] + util.BET_TYPE_ID['BearCFD']
+    equal_type_id = util.BET_TYPE_ID['Equal'] + util.BET_TYPE_ID['NotEqual']
 
-    # stop processing if broadcast is invalid for any reason
-    # @TODO: remove this check once broadcast_invalid_check has been activated
-    if util.enabled('max_fee_fraction') and status != 'valid':
-        return
-
-    # Handle bet matches that use this feed.
-    cursor.execute('''SELECT * FROM bet_matches \
-                      WHERE (status=? AND feed_address=?)
-                      ORDER BY tx1_index ASC, tx0_index ASC''',
-                   ('pending', tx['source']))
-    for bet_match in cursor.fetchall():
-        broadcast_bet_match_cursor = db.cursor()
+    for bet_match in bet_matches:
         bet_match_id = util.make_id(bet_match['tx0_hash'], bet_match['tx1_hash'])
         bet_match_status = None
 
@@ -278,10 +192,6 @@ def parse(db, tx, message):
         fee = int(fee_fraction * total_escrow)              # Truncate.
         escrow_less_fee = total_escrow - fee
 
-        # Get known bet match type IDs.
-        cfd_type_id = util.BET_TYPE_ID['BullCFD'] + util.BET_TYPE_ID['BearCFD']
-        equal_type_id = util.BET_TYPE_ID['Equal'] + util.BET_TYPE_ID['NotEqual']
-
         # Get the bet match type ID of this bet match.
         bet_match_type_id = bet_match['tx0_bet_type'] + bet_match['tx1_bet_type']
 
@@ -314,18 +224,18 @@ def parse(db, tx, message):
                     bull_credit = escrow_less_fee
                     bear_credit = 0
                     bet_match_status = 'settled: liquidated for bull'
-                    util.credit(db, bull_address, config.XCP, bull_credit, action='bet {}'.format(bet_match_status), event=tx['tx_hash'])
+                    credit(bull_address, bull_credit, 'bet {}'.format(bet_match_status))
                 elif bull_credit <= 0:
                     bull_credit = 0
                     bear_credit = escrow_less_fee
                     bet_match_status = 'settled: liquidated for bear'
-                    util.credit(db, bear_address, config.XCP, bear_credit, action='bet {}'.format(bet_match_status), event=tx['tx_hash'])
+                    credit(bear_address, bear_credit, 'bet {}'.format(bet_match_status))
 
                 # Pay fee to feed.
-                util.credit(db, bet_match['feed_address'], config.XCP, fee, action='feed fee', event=tx['tx_hash'])
+                credit(bet_match['feed_address'], fee, 'feed fee')
 
                 # For logging purposes.
-                bindings = {
+                resolve({
                     'bet_match_id': bet_match_id,
                     'bet_match_type_id': bet_match_type_id,
                     'block_index': tx['block_index'],
@@ -335,22 +245,20 @@ def parse(db, tx, message):
                     'winner': None,
                     'escrow_less_fee': None,
                     'fee': fee
-                }
-                sql = 'insert into bet_match_resolutions values(:bet_match_id, :bet_match_type_id, :block_index, :settled, :bull_credit, :bear_credit, :winner, :escrow_less_fee, :fee)'
-                cursor.execute(sql, bindings)
+                })
 
             # Settle (if not liquidated).
             elif timestamp >= bet_match['deadline']:
                 bet_match_status = 'settled'
 
-                util.credit(db, bull_address, config.XCP, bull_credit, action='bet {}'.format(bet_match_status), event=tx['tx_hash'])
-                util.credit(db, bear_address, config.XCP, bear_credit, action='bet {}'.format(bet_match_status), event=tx['tx_hash'])
+                credit(bull_address, bull_credit, 'bet {}'.format(bet_match_status))
+                credit(bear_address, bear_credit, 'bet {}'.format(bet_match_status))
 
                 # Pay fee to feed.
-                util.credit(db, bet_match['feed_address'], config.XCP, fee, action='feed fee', event=tx['tx_hash'])
+                credit(bet_match['feed_address'], fee, 'feed fee')
 
                 # For logging purposes.
-                bindings = {
+                resolve({
                     'bet_match_id': bet_match_id,
                     'bet_match_type_id': bet_match_type_id,
                     'block_index': tx['block_index'],
@@ -360,9 +268,7 @@ def parse(db, tx, message):
                     'winner': None,
                     'escrow_less_fee': None,
                     'fee': fee
-                }
-                sql = 'insert into bet_match_resolutions values(:bet_match_id, :bet_match_type_id, :block_index, :settled, :bull_credit, :bear_credit, :winner, :escrow_less_fee, :fee)'
-                cursor.execute(sql, bindings)
+                })
 
         # Equal[/NotEqual] bet.
         elif bet_match_type_id == equal_type_id and timestamp >= bet_match['deadline']:
@@ -379,17 +285,17 @@ def parse(db, tx, message):
             if value == bet_match['target_value']:
                 winner = 'Equal'
                 bet_match_status = 'settled: for equal'
-                util.credit(db, equal_address, config.XCP, escrow_less_fee, action='bet {}'.format(bet_match_status), event=tx['tx_hash'])
+                credit(equal_address, escrow_less_fee, 'bet {}'.format(bet_match_status))
             else:
                 winner = 'NotEqual'
                 bet_match_status = 'settled: for notequal'
-                util.credit(db, notequal_address, config.XCP, escrow_less_fee, action='bet {}'.format(bet_match_status), event=tx['tx_hash'])
+                credit(notequal_address, escrow_less_fee, 'bet {}'.format(bet_match_status))
 
             # Pay fee to feed.
-            util.credit(db, bet_match['feed_address'], config.XCP, fee, action='feed fee', event=tx['tx_hash'])
+            credit(bet_match['feed_address'], fee, 'feed fee')
 
             # For logging purposes.
-            bindings = {
+            resolve({
                 'bet_match_id': bet_match_id,
                 'bet_match_type_id': bet_match_type_id,
                 'block_index': tx['block_index'],
@@ -399,21 +305,172 @@ def parse(db, tx, message):
                 'winner': winner,
                 'escrow_less_fee': escrow_less_fee,
                 'fee': fee
-            }
-            sql = 'insert into bet_match_resolutions values(:bet_match_id, :bet_match_type_id, :block_index, :settled, :bull_credit, :bear_credit, :winner, :escrow_less_fee, :fee)'
-            cursor.execute(sql, bindings)
+            })
 
         # Update the bet match’s status.
         if bet_match_status:
             bindings = {
                 'status': bet_match_status,
-                'bet_match_id': util.make_id(bet_match['tx0_hash'], bet_match['tx1_hash'])
+                'bet_match_id': bet_match_id
             }
-            sql = 'update bet_matches set status = :status where id = :bet_match_id'
-            cursor.execute(sql, bindings)
-            log.message(db, tx['block_index'], 'update', 'bet_matches', bindings)
+            settlements.append(('update', 'bet_matches', bindings))
+
+    return settlements
+
 
-        broadcast_bet_match_cursor.close()
+def settle_bet_matches(db, tx, timestamp, value, fee_fraction_int):
+    """Settle the pending bet matches on the feed of broadcast `tx`.
+
+    The payouts of all matches are computed first; the balances are then
+    updated once per address and the credits, resolutions and statuses are
+    written with `executemany`. The messages are recorded in the order of
+    `get_settlements()`."""
+    messages = get_settlements(db, tx, timestamp, value, fee_fraction_int)
+    if not messages:
+        return
+    credits = [bindings for command, category, bindings in messages if category == 'credits']
+    resolutions = [bindings for command, category, bindings in messages if category == 'bet_match_resolutions']
+    status_updates = [(bindings['status'], bindings['bet_match_id']) for command, category, bindings in messages if category == 'bet_matches']
+
+    util.apply_credits(db, [(bindings['address'], bindings['asset'], bindings['quantity']) for bindings in credits])
+
+    # Messages first, as the exec tracer would record them.
+    for command, category, bindings in messages:
+        if command == 'insert':
+            database.record_message(db, command, category, bindings)
+        else:
+            log.message(db, tx['block_index'], command, category, bindings)
+
+    settle_cursor = db.cursor()
+    settle_cursor.setexectrace(None)  # Messages recorded above.
+    if credits:
+        sql = 'insert into credits values(:block_index, :address, :asset, :quantity, :action, :event)'
+        settle_cursor.executemany(sql, credits)
+    if resolutions:
+        sql = 'insert into bet_match_resolutions values(:bet_match_id, :bet_match_type_id, :block_index, :settled, :bull_credit, :bear_credit, :winner, :escrow_less_fee, :fee)'
+        settle_cursor.executemany(sql, resolutions)
+    if status_updates:
+        sql = 'update bet_matches set status = ? where id = ?'
+        settle_cursor.executemany(sql, status_updates)
+    settle_cursor.close()
+
+
+def parse(db, tx, message):
+    cursor = db.cursor()
+
+    # Unpack message.
+    try:
+        if util.enabled('broadcast_pack_text'):
+            timestamp, value, fee_fraction_int, rawtext = struct.unpack(FORMAT + '{}s'.format(len(message) - LENGTH), message)
+            textlen = VarIntSerializer.deserialize(rawtext)
+            text = rawtext[-textlen:]
+
+            assert len(text) == textlen
+        else:
+            if len(message) - LENGTH <= 52:
+                curr_format = FORMAT + '{}p'.format(len(message) - LENGTH)
+            else:
+                curr_format = FORMAT + '{}s'.format(len(message) - LENGTH)
+
+            timestamp, value, fee_fraction_int, text = struct.unpack(curr_format, message)
+
+        try:
+            text = text.decode('utf-8')
+        except UnicodeDecodeError:
+            text = ''
+        status = 'valid'
+    except:
+        timestamp, value, fee_fraction_int, text = 0, None, 0, None
+        status = 'invalid: could not unpack'
+
+    if status == 'valid':
+        # For SQLite3
+        timestamp = min(timestamp, config.MAX_INT)
+        value = min(value, config.MAX_INT)
+
+        problems = validate(db, tx['source'], timestamp, value, fee_fraction_int, text, tx['block_index'])
+        if problems:
+            status = 'invalid: ' + '; '.join(problems)
+
+    # Lock?
+    lock = False
+    if text and text.lower() == 'lock':
+        lock = True
+        timestamp, value, fee_fraction_int, text = 0, None, None, None
+    else:
+        lock = False
+
+    # Add parsed transaction to message-type–specific table.
+    bindings = {
+        'tx_index': tx['tx_index'],
+        'tx_hash': tx['tx_hash'],
+        'block_index': tx['block_index'],
+        'source': tx['source'],
+        'timestamp': timestamp,
+        'value': value,
+        'fee_fraction_int': fee_fraction_int,
+        'text': text,
+        'locked': lock,
+        'status': status,
+    }
+    if "integer overflow" not in status:
+        sql = 'insert into broadcasts values(:tx_index, :tx_hash, :block_index, :source, :timestamp, :value, :fee_fraction_int, :text, :locked, :status)'
+        cursor.execute(sql, bindings)
+    else:
+        logger.warn("Not storing [broadcast] tx [%s]: %s" % (tx['tx_hash'], status))
+        logger.debug("Bindings: %s" % (json.dumps(bindings), ))
+
+    # stop processing if broadcast is invalid for any reason
+    if util.enabled('broadcast_invalid_check') and status != 'valid':
+        return
+
+    # Options? if the status is invalid the previous if should have catched it
+    if util.enabled('options_require_memo'):
+        if text and text.lower().startswith('options'):
+            ops_spl = text.split(" ")
+            if len(ops_spl) == 2:
+                change_ops = False
+                options_int = 0
+                try:
+                    options_int = int(ops_spl.pop())
+                    change_ops = True
+                except:
+                    pass
+
+                if change_ops:
+                    op_bindings = {'block_index': tx['block_index'],
+                                   'address': tx['source'],
+                                   'options': options_int}
+                    sql = 'insert or replace into addresses(address, options, block_index) values(:address, :options, :block_index)'
+                    cursor = db.cursor()
+                    cursor.execute(sql, op_bindings)
+
+    # Negative values (default to ignore).
+    if value is None or value < 0:
+        # Cancel Open Bets?
+        if value == -2:
+            cursor.execute('''SELECT * FROM bets \
+                              WHERE (status = ? AND feed_address = ?)''',
+                           ('open', tx['source']))
+            for i in list(cursor):
+                bet.cancel_bet(db, i, 'dropped', tx['block_index'])
+        # Cancel Pending Bet Matches?
+        if value == -3:
+            cursor.execute('''SELECT * FROM bet_matches \
+                              WHERE (status = ? AND feed_address = ?)''',
+                           ('pending', tx['source']))
+            for bet_match in list(cursor):
+                bet.cancel_bet_match(db, bet_match, 'dropped', tx['block_index'])
+        cursor.close()
+        return
+
+    # stop processing if broadcast is invalid for any reason
+    # @TODO: remove this check once broadcast_invalid_check has been activated
+    if util.enabled('max_fee_fraction') and status != 'valid':
+        return
+
+    # Handle bet matches that use this feed.
+    settle_bet_matches(db, tx, timestamp, value, fee_fraction_int)
 
     cursor.close()
 
@@ -185,8 +185,8 @@ def parse(db, tx, message):
         util.transfer(db, tx['source'], foundation_addy, config.XCP, fee, action='dividend fee', event=tx['tx_hash'])
 
         # Credit.
-        for output in outputs:
-            util.credit(db, output['address'], dividend_asset, output['dividend_quantity'], action='dividend', event=tx['tx_hash'])
+        util.credit_many(db, [(output['address'], dividend_asset, output['dividend_quantity']) for output in outputs],
+                         action='dividend', event=tx['tx_hash'])
 
     # Add parsed transaction to message-type–specific table.
     bindings = {
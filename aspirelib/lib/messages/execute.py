@@ -8,6 +8,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from aspirelib.lib import util
+from aspirelib.lib import log
 from aspirelib.lib import config
 from aspirelib.lib import exceptions
 from aspirelib.lib import message_type
@@ -177,6 +178,9 @@ def parse(db, tx, message):
         status = 'out of gas'
         output = None
     finally:
+        # Balance changes and messages made inside a failed message have been rolled back.
+        util.clear_balances_cache()
+        log.reset_message_index()
 
         if status == 'valid':
             logger.debug('TX FINISHED (gas_remained: {})'.format(gas_remained))
@@ -197,7 +201,7 @@ def parse(db, tx, message):
             'output': output,
             'status': status
         }
-        sql = 'insert into executions values(:tx_index, :tx_hash, :block_index, :source, :contract_id, :gasprice, :startgas, :gas_cost, :gas_remained, :value, :data, :output, :status)'
+        sql = 'insert into executions values(:tx_index, :tx_hash, :block_index, :source, :contract_id, :gasprice, :startgas, :gas_cost, :gas_remained, :value, :payload, :output, :status)'
         cursor = db.cursor()
         cursor.execute(sql, bindings)
 
@@ -426,6 +426,9 @@ def parse(db, tx, message, message_type_id):
     if "integer overflow" not in status:
         sql = 'insert into issuances values(:tx_index, :tx_hash, :block_index, :asset, :quantity, :divisible, :source, :issuer, :transfer, :callable, :call_date, :call_price, :description, :fee_paid, :locked, :status, :asset_longname)'
         issuance_parse_cursor.execute(sql, bindings)
+        # Mempool issuances are rolled back, and add nothing to the frozen cache.
+        if status == 'valid' and not util.ASSET_CACHE_FROZEN:
+            util.clear_asset_cache()
     else:
         logger.warn("Not storing [issuance] tx [%s]: %s" % (tx['tx_hash'], status))
         logger.debug("Bindings: %s" % (json.dumps(bindings), ))
@@ -20,6 +20,9 @@ FORMAT = '>QQQQHQ'
 LENGTH = 8 + 8 + 8 + 8 + 2 + 8
 ID = 10
 
+# Relative margin on prices computed by SQLite as REAL, for their rounding.
+PRICE_ROUNDING_MARGIN = 1 + 1e-9
+
 
 def initialise(db):
     cursor = db.cursor()
@@ -70,6 +73,11 @@ def initialise(db):
     cursor.execute('''CREATE INDEX IF NOT EXISTS
                       give_asset_idx ON orders (give_asset)
                    ''')
+    # Index names are shared by all tables: `expire_idx` above is
+    # `(expire_index, status)`, which `expire()` would scan back to the first order.
+    cursor.execute('''CREATE INDEX IF NOT EXISTS
+                      orders_status_expire_idx ON orders (status, expire_index)
+                   ''')
 
     # Order Matches
     cursor.execute('''CREATE TABLE IF NOT EXISTS order_matches(
@@ -449,6 +457,31 @@ def parse(db, tx, message):
     order_parse_cursor.close()
 
 
+def get_candidates(db, tx, tx1):
+    """Return the open orders that may match `tx1`, in the order in which
+    they are considered."""
+    cursor = db.cursor()
+    if tx['block_index'] > 284500 or config.TESTNET:  # Protocol change.
+        # Candidates are walked by price first, tx index second, and those
+        # priced above the inverse price of tx1 are all skipped: leave them
+        # out of the query (up to the rounding of REAL prices), and sort only
+        # the others, exactly.
+        tx1_inverse_price = util.price(tx1['give_quantity'], tx1['get_quantity'])
+        cursor.execute('''SELECT * FROM orders \
+                          WHERE (give_asset=? AND get_asset=? AND status=? AND tx_hash != ? AND
+                                 CAST(get_quantity AS REAL) / give_quantity <= ?)''',
+                       (tx1['get_asset'], tx1['give_asset'], 'open', tx1['tx_hash'], float(tx1_inverse_price) * PRICE_ROUNDING_MARGIN))
+        candidates = [tx0 for tx0 in cursor.fetchall() if util.price(tx0['get_quantity'], tx0['give_quantity']) <= tx1_inverse_price]
+        candidates.sort(key=lambda x: (util.price(x['get_quantity'], x['give_quantity']), x['tx_index']))
+    else:
+        cursor.execute('''SELECT * FROM orders \
+                          WHERE (give_asset=? AND get_asset=? AND status=? AND tx_hash != ?)''',
+                       (tx1['get_asset'], tx1['give_asset'], 'open', tx1['tx_hash']))
+        candidates = cursor.fetchall()
+    cursor.close()
+    return candidates
+
+
 def match(db, tx, block_index=None):
 
     cursor = db.cursor()
@@ -463,17 +496,10 @@ def match(db, tx, block_index=None):
         assert len(orders) == 1
     tx1 = orders[0]
 
-    cursor.execute('''SELECT * FROM orders \
-                      WHERE (give_asset=? AND get_asset=? AND status=? AND tx_hash != ?)''',
-                   (tx1['get_asset'], tx1['give_asset'], 'open', tx1['tx_hash']))
-
     tx1_give_remaining = tx1['give_remaining']
     tx1_get_remaining = tx1['get_remaining']
 
-    order_matches = cursor.fetchall()
-    if tx['block_index'] > 284500 or config.TESTNET:  # Protocol change.
-        order_matches = sorted(order_matches, key=lambda x: x['tx_index'])                              # Sort by tx index second.
-        order_matches = sorted(order_matches, key=lambda x: util.price(x['get_quantity'], x['give_quantity']))   # Sort by price first.
+    order_matches = get_candidates(db, tx, tx1)
 
     # Get fee remaining.
     tx1_fee_required_remaining = tx1['fee_required_remaining']
@@ -493,13 +519,8 @@ def match(db, tx, block_index=None):
         tx0_get_remaining = tx0['get_remaining']
 
         # Ignore previous matches. (Both directions, just to be sure.)
-        cursor.execute('''SELECT * FROM order_matches
-                          WHERE id = ? ''', (util.make_id(tx0['tx_hash'], tx1['tx_hash']), ))
-        if list(cursor):
-            logger.debug('Skipping: previous match')
-            continue
-        cursor.execute('''SELECT * FROM order_matches
-                          WHERE id = ? ''', (util.make_id(tx1['tx_hash'], tx0['tx_hash']), ))
+        cursor.execute('''SELECT id FROM order_matches
+                          WHERE id IN (?, ?)''', (order_match_id, util.make_id(tx1['tx_hash'], tx0['tx_hash'])))
         if list(cursor):
             logger.debug('Skipping: previous match')
             continue
@@ -670,7 +691,7 @@ def expire(db, block_index):
 
     # Expire orders and give refunds for the quantity give_remaining (if non-zero; if not GASP).
     cursor.execute('''SELECT * FROM orders \
-                      WHERE (status = ? AND expire_index < ?)''', ('open', block_index))
+                      WHERE (status = ? AND expire_index < ?) ORDER BY expire_index, rowid''', ('open', block_index))
     orders = list(cursor)
     for order in orders:
         cancel_order(db, order, 'expired', block_index)
@@ -681,14 +702,12 @@ def expire(db, block_index):
     for order_match in order_matches:
         cancel_order_match(db, order_match, 'expired', block_index)
 
-    # Re‐match.
+    # Re‐match. (`match()` only reads the index, hash and block of the
+    # transaction, as recorded in the order match.)
     for order_match in order_matches:
-        cursor.execute('''SELECT * FROM transactions\
-                          WHERE tx_hash = ?''', (order_match['tx0_hash'],))
-        match(db, list(cursor)[0], block_index)
-        cursor.execute('''SELECT * FROM transactions\
-                          WHERE tx_hash = ?''', (order_match['tx1_hash'],))
-        match(db, list(cursor)[0], block_index)
+        for tx_index, tx_hash, tx_block_index in ((order_match['tx0_index'], order_match['tx0_hash'], order_match['tx0_block_index']),
+                                                  (order_match['tx1_index'], order_match['tx1_hash'], order_match['tx1_block_index'])):
+            match(db, {'tx_index': tx_index, 'tx_hash': tx_hash, 'block_index': tx_block_index}, block_index)
 
     cursor.close()
 
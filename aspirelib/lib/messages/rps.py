@@ -64,6 +64,9 @@ def initialise(db):
     cursor.execute('''CREATE INDEX IF NOT EXISTS
                       status_idx ON rps (status)
                    ''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS
+                      rps_status_expire_idx ON rps (status, expire_index)
+                   ''')
 
     # RPS Matches
     cursor.execute('''CREATE TABLE IF NOT EXISTS rps_matches(
@@ -360,7 +363,7 @@ def expire(db, block_index):
     cursor = db.cursor()
 
     # Expire rps and give refunds for the quantity wager.
-    cursor.execute('''SELECT * FROM rps WHERE (status = ? AND expire_index < ?)''', ('open', block_index))
+    cursor.execute('''SELECT * FROM rps WHERE (status = ? AND expire_index < ?) ORDER BY rowid''', ('open', block_index))
     for rps in cursor.fetchall():
         cancel_rps(db, rps, 'expired', block_index)
 
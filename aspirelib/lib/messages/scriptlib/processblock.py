@@ -13,6 +13,7 @@ import math
 import fractions
 
 from aspirelib.lib import util
+from aspirelib.lib.log import reset_message_index  # `log` is defined below.
 from aspirelib.lib import config
 from aspirelib.lib import script
 from aspirelib.lib.messages.scriptlib import (rlp, utils, opcodes, blocks)
@@ -291,6 +292,9 @@ def apply_msg(db, block, tx, msg, code):
 
     # When out of gas, break out of the `with` and then `return`.
     except OutOfGas as e:
+        # The balance changes and messages of this call were rolled back with it.
+        util.clear_balances_cache()
+        reset_message_index()
         result = 0
         data = []
         gas_remained = compustate.gas
@@ -0,0 +1,73 @@
+"""Public keys published in the blockchain, by PubKeyHash, consulted by
+`backend.pubkeyhash_to_pubkey()` before searching the backend.
+
+With `config.PUBKEY_INDEX`, the public keys revealed by the inputs of every
+parsed block are kept in the `pubkeys` table. Keys found by earlier lookups
+are kept in memory in any case. A public key stays valid whatever happens to
+the block that revealed it, so nothing is rolled back on reorganisations."""
+import logging
+logger = logging.getLogger(__name__)
+
+import bitcoin as bitcoinlib
+from bitcoin.core.script import CScriptInvalidError
+
+from aspirelib.lib import config
+from aspirelib.lib import script
+from aspirelib.lib import util
+
+PUBKEY_CACHE_SIZE = 10000
+PUBKEY_CACHE = util.DictCache(size=PUBKEY_CACHE_SIZE)
+
+
+def initialise(db):
+    cursor = db.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS pubkeys(
+                      pubkeyhash TEXT PRIMARY KEY,
+                      pubkey TEXT)
+                   ''')
+    cursor.close()
+
+
+def get_pubkeys(ctx):
+    """Yield `(pubkeyhash, pubkey)` for the inputs of `ctx` that spend
+    PubKeyHash outputs, whose signature script is `<sig> <pubkey>`."""
+    if ctx.is_coinbase():
+        return
+    for vin in ctx.vin:
+        try:
+            pushes = list(vin.scriptSig)
+        except CScriptInvalidError:
+            continue
+        if len(pushes) != 2 or type(pushes[1]) != bytes:
+            continue
+        pubkey = pushes[1]
+        if (len(pubkey) == 33 and pubkey[0] in (2, 3)) or (len(pubkey) == 65 and pubkey[0] == 4):
+            yield script.pubkey_to_pubkeyhash(pubkey), bitcoinlib.core.b2x(pubkey)
+
+
+def index_block(db, block):
+    """Record the public keys revealed in `block` (a `CBlock`)."""
+    cursor = db.cursor()
+    cursor.setexectrace(None)  # Not part of the ledger.
+    cursor.executemany('''INSERT OR IGNORE INTO pubkeys(pubkeyhash, pubkey) VALUES(?,?)''',
+                       [pubkey for ctx in block.vtx for pubkey in get_pubkeys(ctx)])
+    cursor.close()
+
+
+def remember(pubkeyhash, pubkey):
+    PUBKEY_CACHE[pubkeyhash] = pubkey
+
+
+def lookup(db, pubkeyhash):
+    """Return the known public key of `pubkeyhash`, or None."""
+    pubkey = PUBKEY_CACHE.get(pubkeyhash)
+    if pubkey is None and db is not None and config.PUBKEY_INDEX:
+        cursor = db.cursor()
+        rows = list(cursor.execute('''SELECT pubkey FROM pubkeys WHERE pubkeyhash = ?''', (pubkeyhash,)))
+        cursor.close()
+        if rows:
+            pubkey = rows[0]['pubkey']
+            remember(pubkeyhash, pubkey)
+    return pubkey
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
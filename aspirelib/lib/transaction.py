@@ -72,7 +72,7 @@ def op_push (i):
         return b'\x4e' + (i).to_bytes(4, byteorder='little')    # OP_PUSHDATA4
 
 
-def get_dust_return_pubkey(source, provided_pubkeys, encoding):
+def get_dust_return_pubkey(source, provided_pubkeys, encoding, db=None):
     """Return the pubkey to which dust from data outputs will be sent.
 
     This pubkey is used in multi-sig data outputs (as the only real pubkey) to
@@ -81,10 +81,10 @@ def get_dust_return_pubkey(source, provided_pubkeys, encoding):
     """
     # Get hex dust return pubkey.
     if script.is_multisig(source):
-        a, self_pubkeys, b = script.extract_array(backend.multisig_pubkeyhashes_to_pubkeys(source, provided_pubkeys))
+        a, self_pubkeys, b = script.extract_array(backend.multisig_pubkeyhashes_to_pubkeys(source, provided_pubkeys, db=db))
         dust_return_pubkey_hex = self_pubkeys[0]
     else:
-        dust_return_pubkey_hex = backend.pubkeyhash_to_pubkey(source, provided_pubkeys)
+        dust_return_pubkey_hex = backend.pubkeyhash_to_pubkey(source, provided_pubkeys, db=db)
 
     # Convert hex public key into the (binary) dust return pubkey.
     try:
@@ -370,7 +370,7 @@ def construct (db, tx_info, encoding='auto',
         # Address.
         script.validate(address)
         if script.is_multisig(address):
-            destination_outputs_new.append((backend.multisig_pubkeyhashes_to_pubkeys(address, provided_pubkeys), value))
+            destination_outputs_new.append((backend.multisig_pubkeyhashes_to_pubkeys(address, provided_pubkeys, db=db), value))
         else:
             destination_outputs_new.append((address, value))
 
@@ -426,7 +426,7 @@ def construct (db, tx_info, encoding='auto',
 
         if not dust_return_pubkey:
             if encoding == 'multisig':
-                dust_return_pubkey = get_dust_return_pubkey(source, provided_pubkeys, encoding)
+                dust_return_pubkey = get_dust_return_pubkey(source, provided_pubkeys, encoding, db=db)
             else:
                 dust_return_pubkey = None
     else:
@@ -456,9 +456,9 @@ def construct (db, tx_info, encoding='auto',
         use_inputs = unspent = custom_inputs
     else:
         if unspent_tx_hash is not None:
-            unspent = backend.get_unspent_txouts(source, unconfirmed=allow_unconfirmed_inputs, unspent_tx_hash=unspent_tx_hash, multisig_inputs=multisig_inputs)
+            unspent = backend.get_unspent_txouts(source, unconfirmed=allow_unconfirmed_inputs, unspent_tx_hash=unspent_tx_hash, multisig_inputs=multisig_inputs, db=db)
         else:
-            unspent = backend.get_unspent_txouts(source, unconfirmed=allow_unconfirmed_inputs, multisig_inputs=multisig_inputs)
+            unspent = backend.get_unspent_txouts(source, unconfirmed=allow_unconfirmed_inputs, multisig_inputs=multisig_inputs, db=db)
 
         # filter out any locked UTXOs to prevent creating transactions that spend the same UTXO when they're created at the same time
         if UTXO_LOCKS is not None and source in UTXO_LOCKS:
@@ -538,7 +538,7 @@ def construct (db, tx_info, encoding='auto',
     # Change output.
     if change_quantity:
         if script.is_multisig(source):
-            change_address = backend.multisig_pubkeyhashes_to_pubkeys(source, provided_pubkeys)
+            change_address = backend.multisig_pubkeyhashes_to_pubkeys(source, provided_pubkeys, db=db)
         else:
             change_address = source
         change_output = (change_address, change_quantity)
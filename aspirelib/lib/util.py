@@ -19,6 +19,7 @@ import sha3
 import bitcoin as bitcoinlib
 import os
 import collections
+import contextlib
 import threading
 import random
 
@@ -47,9 +48,15 @@ BLOCK_LEDGER = []
 
 CURRENT_BLOCK_INDEX = None
 
+# Balances seen by `debit()` and `credit()` while a block is being parsed,
+# keyed by `(address, asset)`; `None` outside of `balances_cache()`.
+BALANCES_CACHE = None
+
 CURR_DIR = os.path.dirname(os.path.realpath(__file__))
 with open(CURR_DIR + '/../protocol_changes.json') as f:
     PROTOCOL_CHANGES = json.load(f)
+# `{testnet: {change_name: block_index}}`, compiled from `PROTOCOL_CHANGES`.
+ACTIVATION_BLOCK_INDEXES = {}
 
 
 class RPCError(Exception):
@@ -202,24 +209,35 @@ def get_asset_id(db, asset_name, block_index):
     """Return asset_id from asset_name."""
     if not enabled('hotfix_numeric_assets'):
         return generate_asset_id(asset_name, block_index)
-    cursor = db.cursor()
-    cursor.execute('''SELECT * FROM assets WHERE asset_name = ?''', (asset_name,))
-    assets = list(cursor)
-    if len(assets) == 1:
-        return int(assets[0]['asset_id'])
-    else:
+
+    def lookup():
+        cursor = db.cursor()
+        cursor.execute('''SELECT * FROM assets WHERE asset_name = ?''', (asset_name,))
+        assets = list(cursor)
+        if len(assets) == 1:
+            return int(assets[0]['asset_id'])
+
+    asset_id = cached_asset_lookup(('asset_id', asset_name), lookup)
+    if asset_id is None:
         raise exceptions.AssetError('No such asset: {}'.format(asset_name))
+    return asset_id
 
 
 def get_asset_name(db, asset_id, block_index):
     """Return asset_name from asset_id."""
     if not enabled('hotfix_numeric_assets'):
         return generate_asset_name(asset_id, block_index)
-    cursor = db.cursor()
-    cursor.execute('''SELECT * FROM assets WHERE asset_id = ?''', (str(asset_id),))
-    assets = list(cursor)
-    if len(assets) == 1:
-        return assets[0]['asset_name']
+
+    def lookup():
+        cursor = db.cursor()
+        cursor.execute('''SELECT * FROM assets WHERE asset_id = ?''', (str(asset_id),))
+        assets = list(cursor)
+        if len(assets) == 1:
+            return assets[0]['asset_name']
+
+    asset_name = cached_asset_lookup(('asset_name', str(asset_id)), lookup)
+    if asset_name is not None:
+        return asset_name
     return 0    # Strange, I know…
 
 
@@ -235,12 +253,17 @@ def resolve_subasset_longname(db, asset_name):
             subasset_longname = None
 
         if subasset_longname is not None:
-            cursor = db.cursor()
-            cursor.execute('''SELECT asset_name FROM assets WHERE asset_longname = ?''', (subasset_longname,))
-            assets = list(cursor)
-            cursor.close()
-            if len(assets) == 1:
-                return assets[0]['asset_name']
+            def lookup():
+                cursor = db.cursor()
+                cursor.execute('''SELECT asset_name FROM assets WHERE asset_longname = ?''', (subasset_longname,))
+                assets = list(cursor)
+                cursor.close()
+                if len(assets) == 1:
+                    return assets[0]['asset_name']
+
+            subasset_name = cached_asset_lookup(('asset_longname', subasset_longname), lookup)
+            if subasset_name is not None:
+                return subasset_name
 
     return asset_name
 
@@ -339,6 +362,45 @@ def generate_random_asset():
     return 'ASP' + str(random.randint(26**12 + 1, 2**64 - 1))
 
 
+@contextlib.contextmanager
+def balances_cache():
+    """Serve the balance lookups of `debit()` and `credit()` from memory.
+
+    Every write still goes to the `balances` table immediately, so the undolog,
+    the messages and all other readers of the table see exactly what they
+    would without the cache; only the `SELECT` preceding each write is saved.
+    The cache must not outlive the database transaction it was filled in.
+    """
+    global BALANCES_CACHE
+    BALANCES_CACHE = {}
+    try:
+        yield
+    finally:
+        BALANCES_CACHE = None
+
+
+def clear_balances_cache():
+    """Forget the cached balances, e.g. after rolling back to a savepoint."""
+    if BALANCES_CACHE is not None:
+        BALANCES_CACHE.clear()
+
+
+def get_cached_balances(cursor, address, asset):
+    """Return the quantities of the balance rows of `address` for `asset`."""
+    if BALANCES_CACHE is not None and (address, asset) in BALANCES_CACHE:
+        return BALANCES_CACHE[(address, asset)]
+    cursor.execute('''SELECT quantity FROM balances \
+                      WHERE (address = ? AND asset = ?)''', (address, asset))
+    balances = [balance['quantity'] for balance in cursor.fetchall()]
+    set_cached_balances(address, asset, balances)
+    return balances
+
+
+def set_cached_balances(address, asset, balances):
+    if BALANCES_CACHE is not None:
+        BALANCES_CACHE[(address, asset)] = balances
+
+
 class DebitError (Exception):
     pass
 
@@ -365,13 +427,11 @@ def debit(db, address, asset, quantity, action=None, event=None):
     if asset == config.BTC:
         raise exceptions.BalanceError('Cannot debit gasp from a {} address!'.format(config.XCP_NAME))
 
-    debit_cursor.execute('''SELECT * FROM balances \
-                            WHERE (address = ? AND asset = ?)''', (address, asset))
-    balances = debit_cursor.fetchall()
+    balances = get_cached_balances(debit_cursor, address, asset)
     if not len(balances) == 1:
         old_balance = 0
     else:
-        old_balance = balances[0]['quantity']
+        old_balance = balances[0]
 
     if old_balance < quantity:
         raise DebitError('Insufficient funds.')
@@ -387,6 +447,7 @@ def debit(db, address, asset, quantity, action=None, event=None):
     }
     sql = 'update balances set quantity = :quantity where (address = :address and asset = :asset)'
     debit_cursor.execute(sql, bindings)
+    set_cached_balances(address, asset, [balance] * len(balances))
 
     # Record debit.
     bindings = {
@@ -427,9 +488,7 @@ def credit(db, address, asset, quantity, action=None, event=None):
     if len(address) == 40:
         assert asset == config.XCP
 
-    credit_cursor.execute('''SELECT * FROM balances \
-                             WHERE (address = ? AND asset = ?)''', (address, asset))
-    balances = credit_cursor.fetchall()
+    balances = get_cached_balances(credit_cursor, address, asset)
     if len(balances) == 0:
         assert balances == []
 
@@ -441,10 +500,11 @@ def credit(db, address, asset, quantity, action=None, event=None):
         }
         sql = 'insert into balances values(:address, :asset, :quantity)'
         credit_cursor.execute(sql, bindings)
+        set_cached_balances(address, asset, [quantity])
     elif len(balances) > 1:
         assert False
     else:
-        old_balance = balances[0]['quantity']
+        old_balance = balances[0]
         assert type(old_balance) == int
         balance = round(old_balance + quantity)
         balance = min(balance, config.MAX_INT)
@@ -456,6 +516,7 @@ def credit(db, address, asset, quantity, action=None, event=None):
         }
         sql = 'update balances set quantity = :quantity where (address = :address and asset = :asset)'
         credit_cursor.execute(sql, bindings)
+        set_cached_balances(address, asset, [balance])
 
     # Record credit.
     bindings = {
@@ -474,6 +535,110 @@ def credit(db, address, asset, quantity, action=None, event=None):
     BLOCK_LEDGER.append('{}{}{}{}'.format(block_index, address, asset, quantity))
 
 
+def apply_credits(db, credits):
+    """Apply each `(address, asset, quantity)` of `credits`, in order, to the
+    balances and the block ledger as `credit()` would, but without recording
+    the `credits` rows, which are left to the caller.
+
+    The current balances are read with a few `IN (…)` queries and each balance
+    is written once, with its final quantity.
+    """
+    block_index = CURRENT_BLOCK_INDEX
+    if not credits:
+        return
+
+    for address, asset, quantity in credits:
+        if type(quantity) != int:
+            raise CreditError('Quantity must be an integer.')
+        if quantity < 0:
+            raise CreditError('Negative quantity.')
+        if quantity > config.MAX_INT:
+            raise CreditError('Quantity can\'t be higher than MAX_INT.')
+        if asset == config.BTC:
+            raise CreditError('Cannot credit gasp.')
+        # Contracts can only hold ASP balances.
+        if len(address) == 40:
+            assert asset == config.XCP
+
+    credit_cursor = db.cursor()
+
+    # Current balances.
+    balances = {}
+    missing = collections.defaultdict(set)
+    for address, asset, quantity in credits:
+        if BALANCES_CACHE is not None and (address, asset) in BALANCES_CACHE:
+            balances[(address, asset)] = list(BALANCES_CACHE[(address, asset)])
+        else:
+            missing[asset].add(address)
+    for asset, addresses in missing.items():
+        for address in addresses:
+            balances[(address, asset)] = []
+        for chunk in chunkify(sorted(addresses), 500):
+            credit_cursor.execute('''SELECT address, quantity FROM balances \
+                                     WHERE (asset = ? AND address IN ({}))'''.format(','.join('?' * len(chunk))), [asset] + chunk)
+            for balance in credit_cursor.fetchall():
+                balances[(balance['address'], asset)].append(balance['quantity'])
+
+    # New balances, accumulated as `credit()` would. New rows are inserted in
+    # the order of their first credit, as `credit()` would: `holders()`, and so
+    # dividends, follow the rowids of `balances`.
+    inserted, updated = collections.OrderedDict(), collections.OrderedDict()
+    for address, asset, quantity in credits:
+        key = (address, asset)
+        old_balances = balances[key]
+        if len(old_balances) == 0:
+            balances[key] = [quantity]
+            inserted[key] = True
+        elif len(old_balances) > 1:
+            assert False
+        else:
+            old_balance = old_balances[0]
+            assert type(old_balance) == int
+            balance = round(old_balance + quantity)
+            balances[key] = [min(balance, config.MAX_INT)]
+        if key not in inserted:
+            updated[key] = True
+
+    # `balances` is not a ledger table: no messages are recorded for these.
+    if inserted:
+        credit_cursor.executemany('insert into balances values(?, ?, ?)',
+                                  [key + (balances[key][0],) for key in inserted])
+    if updated:
+        credit_cursor.executemany('update balances set quantity = ? where (address = ? and asset = ?)',
+                                  [(balances[key][0],) + key for key in updated])
+    for key in list(inserted) + list(updated):
+        set_cached_balances(key[0], key[1], balances[key])
+
+    credit_cursor.close()
+
+    BLOCK_LEDGER.extend('{}{}{}{}'.format(block_index, address, asset, quantity) for address, asset, quantity in credits)
+
+
+def credit_many(db, credits, action=None, event=None):
+    """Credit each `(address, asset, quantity)` of `credits`, in order.
+
+    Equivalent to calling `credit()` for every item: the balances, the
+    `credits` rows, their messages and the ledger entries are the same, in the
+    same order.
+    """
+    if not credits:
+        return
+    apply_credits(db, credits)
+
+    # Record credits; the exec tracer records their messages row by row.
+    credit_cursor = db.cursor()
+    sql = 'insert into credits values(:block_index, :address, :asset, :quantity, :action, :event)'
+    credit_cursor.executemany(sql, [{
+        'block_index': CURRENT_BLOCK_INDEX,
+        'address': address,
+        'asset': asset,
+        'quantity': quantity,
+        'action': action,
+        'event': event
+    } for address, asset, quantity in credits])
+    credit_cursor.close()
+
+
 class QuantityError(Exception):
     pass
 
@@ -483,13 +648,18 @@ def is_divisible(db, asset):
     if asset in (config.BTC, config.XCP):
         return True
     else:
-        cursor = db.cursor()
-        cursor.execute('''SELECT * FROM issuances \
-                          WHERE (status = ? AND asset = ?)''', ('valid', asset))
-        issuances = cursor.fetchall()
-        if not issuances:
+        def lookup():
+            cursor = db.cursor()
+            cursor.execute('''SELECT * FROM issuances \
+                              WHERE (status = ? AND asset = ?)''', ('valid', asset))
+            issuances = cursor.fetchall()
+            if issuances:
+                return issuances[0]['divisible']
+
+        divisible = cached_asset_lookup(('divisible', asset), lookup)
+        if divisible is None:
             raise exceptions.AssetError('No such asset: {}'.format(asset))
-        return issuances[0]['divisible']
+        return divisible
 
 
 def value_input(quantity, asset, divisible):
@@ -776,17 +946,21 @@ def unhexlify(hex_string):
 
 
 # Protocol Changes
+def activation_block_indexes():
+    """Return the activation block index of every protocol change on the current network."""
+    testnet = bool(config.TESTNET)
+    if testnet not in ACTIVATION_BLOCK_INDEXES:
+        index_name = 'testnet_block_index' if testnet else 'block_index'
+        ACTIVATION_BLOCK_INDEXES[testnet] = {change_name: change[index_name] for change_name, change in PROTOCOL_CHANGES.items()}
+    return ACTIVATION_BLOCK_INDEXES[testnet]
+
+
 def enabled(change_name, block_index=None):
     """Return True if protocol change is enabled."""
-    index_name = 'testnet_block_index' if config.TESTNET else 'block_index'
-    enable_block_index = PROTOCOL_CHANGES[change_name][index_name]
-
     if not block_index:
         block_index = CURRENT_BLOCK_INDEX
 
-    if block_index >= enable_block_index:
-        return True
-    return False
+    return block_index >= activation_block_indexes()[change_name]
 
 
 def transfer(db, source, destination, asset, quantity, action, event):
@@ -824,6 +998,7 @@ class DictCache:
         self.size = size
         self.dict = collections.OrderedDict()
         self.lock = threading.Lock()
+        self.generation = 0
 
     def __getitem__(self, key):
         with self.lock:
@@ -851,6 +1026,66 @@ class DictCache:
         with self.lock:
             self.dict.move_to_end(key, last=True)
 
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as most recently used."""
+        with self.lock:
+            if key not in self.dict:
+                return default
+            self.dict.move_to_end(key, last=True)
+            return self.dict[key]
+
+    def set_unless_cleared(self, key, value, generation):
+        """Set `key`, unless the cache was cleared since `generation` was read."""
+        with self.lock:
+            if generation != self.generation:
+                return
+            while len(self.dict) >= self.size:
+                self.dict.popitem(last=False)
+            self.dict[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.dict.clear()
+            self.generation += 1
+
+
+# Asset ids, names, subasset longnames and divisibility, as found in the
+# database. Only found assets are cached: those rows change only with
+# issuances, reparses and rollbacks, all of which call `clear_asset_cache()`.
+ASSET_CACHE_SIZE = 10000
+ASSET_CACHE = DictCache(size=ASSET_CACHE_SIZE)
+
+
+# Set while the mempool is parsed: its lookups may see assets that are
+# rolled back with its savepoints, and the cache is shared with the API.
+ASSET_CACHE_FROZEN = False
+
+
+def cached_asset_lookup(key, lookup):
+    """Return `ASSET_CACHE[key]`, calling `lookup()` on a miss; `None` is not cached."""
+    value = ASSET_CACHE.get(key)
+    if value is None:
+        generation = ASSET_CACHE.generation
+        value = lookup()
+        if value is not None and not ASSET_CACHE_FROZEN:
+            ASSET_CACHE.set_unless_cleared(key, value, generation)
+    return value
+
+
+@contextlib.contextmanager
+def frozen_asset_cache():
+    """Serve asset lookups from the cache without adding to it."""
+    global ASSET_CACHE_FROZEN
+    ASSET_CACHE_FROZEN = True
+    try:
+        yield
+    finally:
+        ASSET_CACHE_FROZEN = False
+
+
+def clear_asset_cache():
+    ASSET_CACHE.clear()
+
 
 URL_USERNAMEPASS_REGEX = re.compile('.+://(.+)@')
 
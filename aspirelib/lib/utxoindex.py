@@ -0,0 +1,156 @@
+"""Local index of the unspent transaction outputs of every address, built from
+the blocks downloaded by the parser (`config.UTXO_INDEX`).
+
+`utxos` holds the unspent outputs up to block `utxo_index_block`; spends of
+the last `config.UNDOLOG_MAX_PAST_BLOCKS` blocks are kept in `utxo_spends`,
+so that the index can be rolled back on a chain reorganisation."""
+import logging
+logger = logging.getLogger(__name__)
+
+import bitcoin as bitcoinlib
+from bitcoin.core.script import CScriptInvalidError
+
+from aspirelib.lib import config
+from aspirelib.lib import exceptions
+from aspirelib.lib import script
+from aspirelib.lib.kickstart.utils import ib2h
+
+
+def get_cursor(db):
+    # The index is not part of the ledger: no messages, plain tuples.
+    cursor = db.cursor()
+    cursor.setexectrace(None)
+    cursor.setrowtrace(None)
+    return cursor
+
+
+def initialise(db):
+    cursor = get_cursor(db)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS utxos(
+                      tx_hash TEXT,
+                      vout INTEGER,
+                      address TEXT,
+                      value INTEGER,
+                      script TEXT,
+                      block_index INTEGER,
+                      PRIMARY KEY (tx_hash, vout))
+                   ''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS
+                      utxos_address_idx ON utxos (address)
+                   ''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS utxo_spends(
+                      tx_hash TEXT,
+                      vout INTEGER,
+                      address TEXT,
+                      value INTEGER,
+                      script TEXT,
+                      block_index INTEGER,
+                      spent_block_index INTEGER)
+                   ''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS
+                      utxo_spends_spent_block_index_idx ON utxo_spends (spent_block_index)
+                   ''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS utxo_index_block(
+                      block_index INTEGER)
+                   ''')
+    cursor.close()
+
+
+def last_block_index(db):
+    """Return the last block in the index."""
+    cursor = get_cursor(db)
+    rows = list(cursor.execute('''SELECT block_index FROM utxo_index_block'''))
+    cursor.close()
+    return rows[0][0] if rows else config.BLOCK_FIRST - 1
+
+
+def set_last_block_index(cursor, block_index):
+    cursor.execute('''DELETE FROM utxo_index_block''')
+    cursor.execute('''INSERT INTO utxo_index_block(block_index) VALUES(?)''', (block_index,))
+
+
+def is_ready(db):
+    """Whether the index is enabled and up to date with the parsed blocks."""
+    if not config.UTXO_INDEX:
+        return False
+    cursor = get_cursor(db)
+    last_parsed_block_index = list(cursor.execute('''SELECT MAX(block_index) FROM blocks'''))[0][0]
+    cursor.close()
+    return last_parsed_block_index is not None and last_block_index(db) == last_parsed_block_index
+
+
+def get_address(scriptpubkey):
+    try:
+        return script.scriptpubkey_to_address(scriptpubkey)
+    except (exceptions.DecodeError, CScriptInvalidError):
+        return None
+
+
+def index_block(db, block_index, block):
+    """Apply the outputs and spends of `block` (a `CBlock`), which must follow
+    the last block in the index. Run within the transaction parsing the block."""
+    cursor = get_cursor(db)
+
+    spent = []
+    created = []
+    for ctx in block.vtx:
+        tx_hash = bitcoinlib.core.b2lx(ctx.GetHash())
+        if not ctx.is_coinbase():
+            spent.extend((ib2h(vin.prevout.hash), vin.prevout.n) for vin in ctx.vin)
+        for n, vout in enumerate(ctx.vout):
+            address = get_address(vout.scriptPubKey)
+            if address:
+                created.append((tx_hash, n, address, vout.nValue, bitcoinlib.core.b2x(vout.scriptPubKey), block_index))
+
+    # Outputs are listed before spends are applied: inputs may spend outputs of the same block.
+    cursor.executemany('''INSERT OR REPLACE INTO utxos(tx_hash, vout, address, value, script, block_index) VALUES(?,?,?,?,?,?)''', created)
+    cursor.executemany('''INSERT INTO utxo_spends(tx_hash, vout, address, value, script, block_index, spent_block_index)
+                          SELECT tx_hash, vout, address, value, script, block_index, ? FROM utxos WHERE tx_hash = ? AND vout = ?''',
+                       [(block_index, tx_hash, n) for tx_hash, n in spent])
+    cursor.executemany('''DELETE FROM utxos WHERE tx_hash = ? AND vout = ?''', spent)
+
+    cursor.execute('''DELETE FROM utxo_spends WHERE spent_block_index <= ?''', (block_index - config.UNDOLOG_MAX_PAST_BLOCKS,))
+    set_last_block_index(cursor, block_index)
+    cursor.close()
+
+
+def rollback(db, block_index):
+    """Roll the index back to the end of `block_index`. If that is further back
+    than the spends kept, the index is emptied, to be rebuilt."""
+    last = last_block_index(db)
+    if last <= block_index:
+        return
+
+    cursor = get_cursor(db)
+    if last - block_index > config.UNDOLOG_MAX_PAST_BLOCKS:
+        logger.warning('UTXO index cannot be rolled back to block {}; rebuilding it.'.format(block_index))
+        cursor.execute('''DELETE FROM utxos''')
+        cursor.execute('''DELETE FROM utxo_spends''')
+        cursor.execute('''DELETE FROM utxo_index_block''')
+    else:
+        cursor.execute('''DELETE FROM utxos WHERE block_index > ?''', (block_index,))
+        cursor.execute('''INSERT OR REPLACE INTO utxos(tx_hash, vout, address, value, script, block_index)
+                          SELECT tx_hash, vout, address, value, script, block_index FROM utxo_spends
+                          WHERE spent_block_index > ? AND block_index <= ?''', (block_index, block_index))
+        cursor.execute('''DELETE FROM utxo_spends WHERE spent_block_index > ?''', (block_index,))
+        set_last_block_index(cursor, block_index)
+    cursor.close()
+
+
+def get_unspent_txouts(db, address):
+    """Return the confirmed unspent outputs of `address`, formatted as by
+    `backend.get_unspent_txouts()`."""
+    cursor = get_cursor(db)
+    last = last_block_index(db)
+    outputs = [{
+                'amount': value / config.UNIT,
+                'confirmations': last - block_index + 1,
+                'scriptPubKey': scriptpubkey,
+                'txid': tx_hash,
+                'vout': vout
+               } for tx_hash, vout, value, scriptpubkey, block_index in cursor.execute(
+                   '''SELECT tx_hash, vout, value, script, block_index FROM utxos WHERE address = ?''', (address,))]
+    cursor.close()
+    return outputs
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
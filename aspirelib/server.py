@@ -97,7 +97,17 @@ def initialise_config(database_file=None, log_file=None, api_log_file=None,
                 backend_ssl_verify=None, rpc_allow_cors=None, p2sh_dust_return_pubkey=None,
                 utxo_locks_max_addresses=config.DEFAULT_UTXO_LOCKS_MAX_ADDRESSES,
                 utxo_locks_max_age=config.DEFAULT_UTXO_LOCKS_MAX_AGE,
-                estimate_fee_per_kb=None):
+                estimate_fee_per_kb=None,
+                block_prefetch_depth=config.DEFAULT_BLOCK_PREFETCH_DEPTH,
+                decode_workers=config.DEFAULT_DECODE_WORKERS,
+                api_db_pool_size=config.DEFAULT_API_DB_POOL_SIZE,
+                snapshot_interval=config.DEFAULT_SNAPSHOT_INTERVAL,
+                snapshot_retention=config.DEFAULT_SNAPSHOT_RETENTION,
+                reparse_checkpoint_interval=config.DEFAULT_REPARSE_CHECKPOINT_INTERVAL,
+                backend_raw_transactions_disk_cache_size=config.DEFAULT_BACKEND_RAW_TRANSACTIONS_DISK_CACHE_SIZE,
+                backend_compact_caches=config.DEFAULT_BACKEND_COMPACT_CACHES,
+                utxo_index=config.DEFAULT_UTXO_INDEX,
+                pubkey_index=config.DEFAULT_PUBKEY_INDEX, holder_index=config.DEFAULT_HOLDER_INDEX):
 
     # Data directory
     data_dir = appdirs.user_data_dir(appauthor=config.XCP_NAME, appname=config.APP_NAME, roaming=True)
@@ -319,6 +329,17 @@ def initialise_config(database_file=None, log_file=None, api_log_file=None,
     config.CHECK_ASSET_CONSERVATION = check_asset_conservation
     config.UTXO_LOCKS_MAX_ADDRESSES = utxo_locks_max_addresses
     config.UTXO_LOCKS_MAX_AGE = utxo_locks_max_age
+    config.BLOCK_PREFETCH_DEPTH = block_prefetch_depth
+    config.DECODE_WORKERS = decode_workers
+    config.API_DB_POOL_SIZE = api_db_pool_size
+    config.SNAPSHOT_INTERVAL = snapshot_interval
+    config.SNAPSHOT_RETENTION = snapshot_retention
+    config.REPARSE_CHECKPOINT_INTERVAL = reparse_checkpoint_interval
+    config.BACKEND_RAW_TRANSACTIONS_DISK_CACHE_SIZE = backend_raw_transactions_disk_cache_size
+    config.BACKEND_COMPACT_CACHES = backend_compact_caches
+    config.UTXO_INDEX = utxo_index
+    config.PUBKEY_INDEX = pubkey_index
+    config.HOLDER_INDEX = holder_index
     transaction.UTXO_LOCKS = None  # reset the UTXO_LOCKS (for tests really)
 
     if estimate_fee_per_kb is not None:
@@ -369,9 +390,13 @@ def start_all(db):
     blocks.follow(db)
 
 
-def reparse(db, block_index=None, quiet=True):
+def reparse(db, block_index=None, quiet=True, fast=False):
     connect_to_backend()
-    blocks.reparse(db, block_index=block_index, quiet=quiet)
+    interrupted = blocks.interrupted_reparse(db)
+    if interrupted:
+        logger.info('Found an interrupted reparse towards block {} (last completed block: {}).'.format(
+            interrupted['target_block_index'], interrupted['last_block_index']))
+    blocks.reparse(db, block_index=block_index, quiet=quiet, fast=fast)
 
 
 def kickstart(db, bitcoind_dir):
@@ -0,0 +1,176 @@
+"""The raw transactions cache of the addrindex backend: compact entries and
+the disk tier."""
+import copy
+import collections
+
+import pytest
+from bitcoin.core import CTransaction, CTxIn, CTxOut, COutPoint, b2x, b2lx, lx
+from bitcoin.core.script import CScript, OP_DUP, OP_HASH160, OP_EQUAL, OP_EQUALVERIFY, OP_CHECKSIG, OP_CHECKMULTISIG, OP_RETURN
+
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib import script
+from aspirelib.lib.backend import addrindex
+
+PUBKEYS = [bytes([2 + i % 2]) + bytes([i]) * 32 for i in range(3)]
+
+
+def make_txs():
+    """Return a coinbase and a transaction paying to every kind of output
+    script, serialised."""
+    coinbase = CTransaction([CTxIn(scriptSig=CScript([b'\x01\x02']))], [CTxOut(50 * config.UNIT, CScript([PUBKEYS[0], OP_CHECKSIG]))])
+    outputs = [CScript([OP_DUP, OP_HASH160, b'\x01' * 20, OP_EQUALVERIFY, OP_CHECKSIG]),
+               CScript([PUBKEYS[1], OP_CHECKSIG]),
+               CScript([OP_HASH160, b'\x02' * 20, OP_EQUAL]),
+               CScript([1] + PUBKEYS + [3, OP_CHECKMULTISIG]),
+               CScript([OP_RETURN, b'data'])]
+    tx = CTransaction([CTxIn(COutPoint(lx('ab' * 32), 1), CScript([b'\x30' * 71, PUBKEYS[2]]), 0xfffffffe)],
+                      [CTxOut(n * 10000000 + 1, output) for n, output in enumerate(outputs)])
+    return coinbase.serialize(), tx.serialize()
+
+
+def backend_verbose(tx_bytes, confirmations=None):
+    """Return the verbose transaction as the backend would, with fields the
+    cache does not keep."""
+    tx = addrindex.decode_tx(tx_bytes)
+    tx.update({'version': 1, 'locktime': 0, 'size': len(tx_bytes), 'vsize': len(tx_bytes)})
+    for vout in tx['vout']:
+        vout['scriptPubKey'].update({'asm': 'asm', 'type': 'type'})
+    if confirmations:
+        tx.update({'confirmations': confirmations, 'blockhash': 'cd' * 32, 'time': 1500000000, 'blocktime': 1500000000})
+    return tx
+
+
+def kept(tx):
+    """The fields of a verbose transaction kept by compact entries."""
+    tx = copy.deepcopy(tx)
+    for key in ('version', 'locktime', 'size', 'vsize', 'time', 'blocktime'):
+        tx.pop(key, None)
+    for vout in tx['vout']:
+        vout['scriptPubKey'].pop('asm')
+        vout['scriptPubKey'].pop('type')
+    return tx
+
+
+def test_decode_tx(testnet_config):
+    coinbase, tx = make_txs()
+    assert addrindex.decode_tx(coinbase)['vin'] == [{'coinbase': '020102', 'sequence': 0xffffffff}]
+    assert addrindex.decode_tx(coinbase)['vout'][0]['scriptPubKey']['addresses'] == [script.pubkey_to_pubkeyhash(PUBKEYS[0])]
+
+    decoded = addrindex.decode_tx(tx)
+    assert decoded['txid'] == b2lx(CTransaction.deserialize(tx).GetHash())
+    assert decoded['hex'] == b2x(tx)
+    assert decoded['vin'] == [{'txid': 'ab' * 32, 'vout': 1, 'scriptSig': {'hex': b2x(CScript([b'\x30' * 71, PUBKEYS[2]]))}, 'sequence': 0xfffffffe}]
+    assert [vout['value'] for vout in decoded['vout']] == [0.00000001, 0.10000001, 0.20000001, 0.30000001, 0.40000001]
+    assert [vout['scriptPubKey'].get('addresses') for vout in decoded['vout']] == [
+        [script.base58_check_encode('01' * 20, config.ADDRESSVERSION)],
+        [script.pubkey_to_pubkeyhash(PUBKEYS[1])],
+        [script.base58_check_encode('02' * 20, config.P2SH_ADDRESSVERSION)],
+        [script.pubkey_to_pubkeyhash(pubkey) for pubkey in PUBKEYS],
+        None]
+
+
+@pytest.mark.parametrize('confirmations', [None, 12])
+def test_pack_tx_round_trip(testnet_config, confirmations):
+    for tx_bytes in make_txs():
+        tx = backend_verbose(tx_bytes, confirmations)
+        entry = addrindex.pack_tx(tx)
+        assert entry[0] == tx_bytes
+        assert addrindex.unpack_tx(entry) == kept(tx)
+        assert addrindex.get_tx_hex(entry) == tx['hex']
+        # Entries stored as is.
+        assert addrindex.unpack_tx(tx) is tx
+        assert addrindex.get_tx_hex(tx) == tx['hex']
+
+
+def clear_memory_cache(monkeypatch):
+    monkeypatch.setattr(addrindex, 'raw_transactions_cache', util.DictCache(size=config.BACKEND_RAW_TRANSACTIONS_CACHE_SIZE))
+
+
+@pytest.fixture
+def rpc(testnet_config, monkeypatch):
+    """The backend, serving the transactions of `make_txs()` (the coinbase
+    confirmed) and the confirmations of their block; return them and the
+    list of transactions fetched from it."""
+    txs = {}
+    for tx_bytes, confirmations in zip(make_txs(), (3, None)):
+        tx = backend_verbose(tx_bytes, confirmations)
+        txs[tx['txid']] = tx
+    blocks = {'cd' * 32: 3}
+    fetched = []
+
+    def rpc_batch(payload):
+        responses = []
+        for request in payload:
+            if request['method'] == 'getblockheader':
+                result = {'hash': request['params'][0], 'confirmations': blocks[request['params'][0]]}
+            else:
+                fetched.append(request['params'][0])
+                result = copy.deepcopy(txs[request['params'][0]])
+            responses.append({'id': request['id'], 'result': result, 'error': None})
+        return responses
+    monkeypatch.setattr(addrindex, 'rpc_batch', rpc_batch)
+    clear_memory_cache(monkeypatch)
+    monkeypatch.setattr(addrindex, 'raw_transactions_cache_stats', collections.Counter())
+    monkeypatch.setattr(addrindex, 'raw_transactions_disk_cache', None)
+    return txs, blocks, fetched
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_getrawtransaction_batch(rpc, monkeypatch, compact):
+    txs, blocks, fetched = rpc
+    monkeypatch.setattr(config, 'BACKEND_COMPACT_CACHES', compact)
+    expected = {tx_hash: kept(tx) if compact else tx for tx_hash, tx in txs.items()}
+
+    assert addrindex.getrawtransaction_batch(list(txs), verbose=True) == expected
+    assert addrindex.getrawtransaction_batch(list(txs)) == {tx_hash: tx['hex'] for tx_hash, tx in txs.items()}
+    assert addrindex.getrawtransaction_batch(list(txs), verbose=True) == expected
+    assert sorted(fetched) == sorted(txs)
+    assert all(isinstance(addrindex.raw_transactions_cache[tx_hash], tuple) == compact for tx_hash in txs)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_disk_cache(rpc, monkeypatch, compact):
+    txs, blocks, fetched = rpc
+    monkeypatch.setattr(config, 'BACKEND_COMPACT_CACHES', compact)
+    monkeypatch.setattr(config, 'BACKEND_RAW_TRANSACTIONS_DISK_CACHE_SIZE', 10)
+    confirmed, unconfirmed = txs
+    expected = {tx_hash: kept(tx) for tx_hash, tx in txs.items()}
+    stats = addrindex.raw_transactions_cache_stats
+
+    assert addrindex.getrawtransaction_batch(list(txs), verbose=True) == (expected if compact else txs)
+    assert stats == {'memory_hits': 0, 'disk_hits': 0, 'misses': 2}
+    # Only the confirmed transaction is stored.
+    assert list(addrindex.get_raw_transactions_disk_cache().get_many(txs)) == [confirmed]
+
+    # After a restart.
+    clear_memory_cache(monkeypatch)
+    assert addrindex.getrawtransaction_batch(list(txs)) == {tx_hash: tx['hex'] for tx_hash, tx in txs.items()}
+    assert stats == {'memory_hits': 0, 'disk_hits': 1, 'misses': 3}
+    assert collections.Counter(fetched) == {confirmed: 1, unconfirmed: 2}
+
+    # Verbose transactions are decoded, with the current confirmations of their block.
+    clear_memory_cache(monkeypatch)
+    blocks['cd' * 32] = 7
+    expected[confirmed]['confirmations'] = 7
+    assert addrindex.getrawtransaction_batch([confirmed], verbose=True) == {confirmed: expected[confirmed]}
+    assert stats == {'memory_hits': 0, 'disk_hits': 2, 'misses': 3}
+    assert addrindex.getrawtransaction_batch([confirmed], verbose=True) == {confirmed: expected[confirmed]}
+    assert stats == {'memory_hits': 1, 'disk_hits': 2, 'misses': 3}
+
+    # Unless the block left the main chain.
+    clear_memory_cache(monkeypatch)
+    blocks['cd' * 32] = -1
+    addrindex.getrawtransaction_batch([confirmed], verbose=True)
+    assert stats == {'memory_hits': 1, 'disk_hits': 2, 'misses': 4}
+    assert fetched[-1] == confirmed
+
+
+def test_disk_cache_eviction(testnet_config, tmpdir):
+    disk_cache = addrindex.RawTransactionDiskCache(str(tmpdir.join('rawtx')), 2)
+    disk_cache.put_many({'a': ('aa', 'cd' * 32), 'b': ('bb', 'cd' * 32)})
+    disk_cache.put_many({'c': ('cc', 'ef' * 32), 'a': ('aa', 'cd' * 32)})
+    assert disk_cache.get_many(['a', 'b', 'c']) == {'b': ('bb', 'cd' * 32), 'c': ('cc', 'ef' * 32)}
+    # Reopened.
+    disk_cache = addrindex.RawTransactionDiskCache(str(tmpdir.join('rawtx')), 2)
+    assert disk_cache.count == 2
@@ -0,0 +1,73 @@
+"""Settling the bet matches of a feed in one batch leaves the same ledger as
+settling them one by one."""
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib import log
+from aspirelib.lib.messages import bet
+from aspirelib.lib.messages import broadcast
+
+from aspirelib.test.conftest import make_address
+
+
+def settle_bet_matches_one_by_one(db, tx, timestamp, value, fee_fraction_int):
+    """Settle the bet matches as `broadcast.parse()` used to: a `credit()` per
+    payout and traced writes, match after match."""
+    cursor = db.cursor()
+    for command, category, bindings in broadcast.get_settlements(db, tx, timestamp, value, fee_fraction_int):
+        if category == 'credits':
+            util.credit(db, bindings['address'], bindings['asset'], bindings['quantity'], action=bindings['action'], event=bindings['event'])
+        elif category == 'bet_match_resolutions':
+            sql = 'insert into bet_match_resolutions values(:bet_match_id, :bet_match_type_id, :block_index, :settled, :bull_credit, :bear_credit, :winner, :escrow_less_fee, :fee)'
+            cursor.execute(sql, bindings)
+        else:
+            sql = 'update bet_matches set status = :status where id = :bet_match_id'
+            cursor.execute(sql, bindings)
+            log.message(db, tx['block_index'], 'update', 'bet_matches', bindings)
+    cursor.close()
+
+
+def match_cfds(l, feed):
+    """List CFD bet matches on `feed` (CFDs are disabled on testnet):
+    settled, liquidated for the bull and for the bear, and left pending.
+    The bettors have no ASP balance yet."""
+    a, b = make_address(7), make_address(6)
+    cfds = [(1, 5040, 1600000000), (0, 20 * 5040, 4000000001), (2, 20 * 5040, 4000000001), (1, 5040, 4000000001)]
+    block_index = l.block(*[(address, l.ops()) for cfd in cfds for address in (a, b)])
+    cursor = l.db.cursor()
+    with l.db:
+        txs = list(cursor.execute('''SELECT * FROM transactions WHERE block_index = ? ORDER BY tx_index''', (block_index,)))
+        for (initial_value, leverage, deadline), tx0, tx1 in zip(cfds, txs[::2], txs[1::2]):
+            cursor.execute('''INSERT INTO bet_matches VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''',
+                           (util.make_id(tx0['tx_hash'], tx1['tx_hash']), tx0['tx_index'], tx0['tx_hash'], tx0['source'],
+                            tx1['tx_index'], tx1['tx_hash'], tx1['source'], util.BET_TYPE_ID['BullCFD'], util.BET_TYPE_ID['BearCFD'],
+                            feed, initial_value, deadline, 0.0, leverage, 10 * config.UNIT, 10 * config.UNIT,
+                            block_index, block_index, block_index, 100, 100, block_index + 100, 5000000, 'pending'))
+    cursor.close()
+
+
+def test_settle_bet_matches(ledger, monkeypatch):
+    results = []
+    for name, settle_bet_matches in (('one_by_one', settle_bet_matches_one_by_one), ('batch', broadcast.settle_bet_matches)):
+        monkeypatch.setattr(broadcast, 'settle_bet_matches', settle_bet_matches)
+        l = ledger(name)
+        a, b, c, d = l.addresses
+        # A feed without any ASP balance, to collect the fees.
+        feed = make_address(5)
+        l.populate()
+        l.block((d, l.ops(['credit', d, config.XCP, 100 * config.UNIT])),
+                (feed, broadcast.compose(l.db, feed, 1500000000, 1.0, 0.05, 'feed')[2]))
+        l.block(*[(source, feed, bet.compose(l.db, source, feed, bet_type, 4000000000, wager, wager, target_value, 5040, 100)[2])
+                  for source, bet_type, wager, target_value in ((a, 2, 10 * config.UNIT, 1.0), (b, 3, 10 * config.UNIT, 1.0),
+                                                                (c, 2, 5 * config.UNIT, 2.0), (d, 3, 5 * config.UNIT, 2.0))])
+        match_cfds(l, feed)
+        l.block((feed, broadcast.compose(l.db, feed, 4000000000, 1.0, 0.05, 'settle')[2]))
+
+        dump = l.dump(['balances', 'credits', 'bet_matches', 'bet_match_resolutions', 'messages'])
+        results.append((dump, [l.hashes(i) for i in range(l.block_index + 1)]))
+
+    dump = results[1][0]
+    assert len(dump['bet_match_resolutions']) == 5
+    assert sorted(set(row[-1] for row in dump['bet_matches'])) == [
+        'pending', 'settled', 'settled: for equal', 'settled: for notequal', 'settled: liquidated for bear', 'settled: liquidated for bull']
+    assert set(row[1] for row in dump['balances'][-3:]) == set(make_address(i) for i in (5, 6, 7))
+    assert results[0] == results[1]
@@ -0,0 +1,164 @@
+"""Fixtures shared by the tests: a fresh ledger database in a temporary
+directory, and a `Ledger` helper that lists and parses blocks in it without a
+backend."""
+import json
+import hashlib
+import binascii
+
+import pytest
+
+from aspirelib import server
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib import log
+from aspirelib.lib import check
+from aspirelib.lib import script
+from aspirelib.lib import backend
+from aspirelib.lib import database
+from aspirelib.lib import blocks
+from aspirelib.lib.messages import bet
+from aspirelib.lib.messages import order
+from aspirelib.lib.messages import issuance
+from aspirelib.lib.messages import broadcast
+
+# Transactions whose data starts with `TEST_PREFIX` carry a JSON list of
+# `[function, *args]`, applied with `util.<function>(db, *args)` (e.g.
+# `['credit', address, asset, quantity]`); any other data is parsed as a
+# regular message.
+TEST_PREFIX = b'TEST'
+
+
+def make_address(i):
+    return script.base58_check_encode(binascii.hexlify(bytes([i]) * 20).decode('ascii'), config.ADDRESSVERSION_TESTNET)
+
+
+def block_hash(block_index):
+    return hashlib.sha256('block {}'.format(block_index).encode('ascii')).hexdigest()
+
+
+class Ledger(object):
+    """A database, with blocks listed and parsed as by `blocks.follow()`."""
+
+    def __init__(self, db):
+        self.db = db
+        self.block_index = config.BLOCK_FIRST - 1
+        self.tx_index = 0
+        self.addresses = [make_address(i) for i in range(1, 5)]
+        # An empty first block, which matches the checkpoint.
+        self.block()
+
+    def ops(self, *ops):
+        """Return the data of a transaction applying `ops`."""
+        return TEST_PREFIX + json.dumps(ops).encode('ascii')
+
+    def block(self, *txs):
+        """List and parse the next block, with `txs` as `(source, data)` or
+        `(source, destination, data)`."""
+        self.block_index += 1
+        block_time = 1500000000 + self.block_index * 600
+        cursor = self.db.cursor()
+        with self.db:
+            util.CURRENT_BLOCK_INDEX = self.block_index
+            cursor.execute('''INSERT INTO blocks(block_index, block_hash, block_time) VALUES(?,?,?)''',
+                           (self.block_index, block_hash(self.block_index), block_time))
+            for tx in txs:
+                source, destination, data = tx if len(tx) == 3 else (tx[0], None, tx[1])
+                tx_hash = hashlib.sha256('tx {}'.format(self.tx_index).encode('ascii')).hexdigest()
+                blocks.insert_tx_rows(self.db, [(self.tx_index, tx_hash, self.block_index, block_hash(self.block_index), block_time,
+                                                 source, destination, 0, 0, data)])
+                self.tx_index += 1
+            blocks.parse_block(self.db, self.block_index, block_time)
+        cursor.close()
+        if config.SNAPSHOT_INTERVAL and self.block_index % config.SNAPSHOT_INTERVAL == 0:
+            blocks.write_snapshot(self.db, self.block_index)
+        return self.block_index
+
+    def populate(self):
+        """Parse a few blocks of credits, debits, an issuance, orders, a feed
+        and bets, leaving funds in open orders, open bets and a pending bet
+        match. Return the index of the last block."""
+        a, b, c, d = self.addresses
+        self.block((a, self.ops(['credit', a, config.XCP, 1000 * config.UNIT], ['credit', b, config.XCP, 1000 * config.UNIT],
+                                ['credit', c, config.XCP, 1000 * config.UNIT])))
+        self.block((b, self.ops(['debit', b, config.XCP, 5 * config.UNIT], ['credit', d, config.XCP, 5 * config.UNIT])),
+                   (a, issuance.compose(self.db, a, None, 'BBBB', 1000, False, 'test')[2]))
+        self.block((a, order.compose(self.db, a, 'BBBB', 100, config.XCP, 10 * config.UNIT, 100, 0)[2]),
+                   (b, order.compose(self.db, b, config.XCP, 5 * config.UNIT, 'BBBB', 50, 100, 0)[2]),
+                   (c, order.compose(self.db, c, config.XCP, 2 * config.UNIT, 'BBBB', 30, 100, 0)[2]))
+        self.block((c, broadcast.compose(self.db, c, 1500000000, 100.0, 0.01, 'feed')[2]),
+                   (d, order.compose(self.db, d, config.XCP, 1 * config.UNIT, 'BBBB', 5, 100, 0)[2]))
+        self.block((a, c, bet.compose(self.db, a, c, 2, 4000000000, 10 * config.UNIT, 10 * config.UNIT, 1.0, 5040, 100)[2]),
+                   (b, c, bet.compose(self.db, b, c, 3, 4000000000, 10 * config.UNIT, 10 * config.UNIT, 1.0, 5040, 100)[2]),
+                   (d, c, bet.compose(self.db, d, c, 2, 4000000000, 2 * config.UNIT, 2 * config.UNIT, 1.0, 5040, 100)[2]))
+        return self.block((a, self.ops(['credit', a, 'BBBB', 7], ['debit', a, config.XCP, 1 * config.UNIT])))
+
+    def hashes(self, block_index=None):
+        cursor = self.db.cursor()
+        rows = list(cursor.execute('''SELECT ledger_hash, txlist_hash, messages_hash FROM blocks WHERE block_index = ?''',
+                                   (self.block_index if block_index is None else block_index,)))
+        cursor.close()
+        return rows[0]
+
+    def dump(self, tables):
+        """Return the rows of `tables`, by rowid; messages without their timestamp."""
+        cursor = self.db.cursor()
+        cursor.setrowtrace(None)
+        dump = {}
+        for table in tables:
+            columns = '*' if table != 'messages' else 'message_index, block_index, command, category, bindings'
+            dump[table] = list(cursor.execute('''SELECT rowid, {} FROM {} ORDER BY rowid'''.format(columns, table)))
+        cursor.close()
+        return dump
+
+
+def initialise_config(database_file, **kwargs):
+    server.initialise_config(database_file=database_file, testnet=True,
+                             backend_password='test', rpc_password='test', **kwargs)
+
+
+@pytest.fixture
+def testnet_config(tmpdir):
+    """Initialise the configuration of a testnet server, with its database in
+    a temporary directory."""
+    initialise_config(str(tmpdir.join('ledger.db')))
+
+
+@pytest.fixture
+def ledger(tmpdir, monkeypatch):
+    """Return a factory of `Ledger` objects on a fresh database `name`,
+    configured with the given `server.initialise_config()` arguments."""
+    connections = []
+
+    def make_ledger(name='ledger', **kwargs):
+        initialise_config(str(tmpdir.join('{}.db'.format(name))), **kwargs)
+        log.reset_message_index()
+        util.clear_asset_cache()
+        db = database.get_connection(read_only=False)
+        connections.append(db)
+        blocks.initialise(db)
+        return Ledger(db)
+
+    original_parse_tx = blocks.parse_tx
+
+    def parse_tx(db, tx):
+        if tx['data'].startswith(TEST_PREFIX):
+            for function, *args in json.loads(tx['data'][len(TEST_PREFIX):].decode('ascii')):
+                getattr(util, function)(db, *args, action='test', event=tx['tx_hash'])
+            return True
+        return original_parse_tx(db, tx)
+
+    # Reparses decode the coinbase of each block, looking for proof of work.
+    monkeypatch.setattr(blocks, 'parse_tx', parse_tx)
+    monkeypatch.setattr(blocks, 'get_tx_info', lambda *args, **kwargs: None)
+    monkeypatch.setattr(backend, 'getblockhash', block_hash)
+    monkeypatch.setattr(backend, 'getblock', lambda block_hash: None)
+    monkeypatch.setattr(backend, 'get_tx_list', lambda block: (['coinbase'], {'coinbase': ''}))
+    monkeypatch.setattr(check, 'software_version', lambda: None)
+
+    yield make_ledger
+
+    for db in connections:
+        db.close()
+    util.CURRENT_BLOCK_INDEX = None
+    log.reset_message_index()
+    util.clear_asset_cache()
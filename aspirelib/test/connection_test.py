@@ -0,0 +1,172 @@
+"""Backend RPC calls share a pool of kept-alive connections, no larger than
+the batch worker pool; failed connections and a backend that is not ready
+are retried with backoff."""
+import json
+import time
+import types
+import socket
+import threading
+import collections
+import http.server
+
+import pytest
+
+from aspirelib.lib import config
+from aspirelib.lib.backend import addrindex
+from aspirelib.lib.backend import connection
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Answer each JSON-RPC request with its params, or with the next error
+    of `server.errors`."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            error = server.errors.pop(0) if server.errors else None
+        time.sleep(server.delay)
+
+        def respond(request):
+            return {'id': request['id'], 'result': None if error else request['params'], 'error': error}
+        body = json.dumps([respond(request) for request in payload] if isinstance(payload, list) else respond(payload)).encode('utf-8')
+        with server.lock:
+            server.in_flight -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Backend:
+    """A JSON-RPC backend on `port`, which records the client connections,
+    and the most requests it served at once."""
+
+    def __init__(self, port):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.connections = set()
+        self.server.in_flight = self.server.max_in_flight = 0
+        self.server.errors = []
+        self.server.delay = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def backends(testnet_config, monkeypatch):
+    """Point the backend URL to a free port, with fresh connection pools and
+    latency counters. Return the port, a list of the `Backend`s started on
+    it, stopped at teardown, and the list of delays slept between retries."""
+    port = free_port()
+    monkeypatch.setattr(config, 'BACKEND_URL', 'http://127.0.0.1:{}'.format(port))
+    monkeypatch.setattr(config, 'BACKEND_RPC_BATCH_NUM_WORKERS', 3)
+    monkeypatch.setattr(config, 'RPC_BATCH_SIZE', 2)
+    monkeypatch.setattr(connection, 'session', None)
+    monkeypatch.setattr(connection, 'executor', None)
+    monkeypatch.setattr(connection, 'latency_stats', collections.defaultdict(lambda: [0, 0.0, 0.0]))
+    delays = []
+    sleep = types.SimpleNamespace(time=time.time, sleep=delays.append)
+    monkeypatch.setattr(connection, 'time', sleep)
+    monkeypatch.setattr(addrindex, 'time', sleep)
+    backends = []
+    yield port, backends, delays
+    if connection.executor is not None:
+        connection.executor.shutdown()
+    if connection.session is not None:
+        connection.session.close()
+    for backend in backends:
+        backend.stop()
+
+
+def make_requests(count):
+    return [{'method': 'echo', 'params': [i], 'jsonrpc': '2.0', 'id': i} for i in range(count)]
+
+
+def test_session_pool(backends):
+    port, started, delays = backends
+    backend = Backend(port)
+    started.append(backend)
+
+    # Calls one after the other keep reusing the same connection.
+    for i in range(5):
+        assert addrindex.rpc('echo', [i]) == [i]
+    assert len(backend.server.connections) == 1
+
+    # Batch chunks are sent in parallel, over no more connections than workers,
+    # and their responses come back in order.
+    backend.server.delay = 0.02
+    responses = addrindex.rpc_batch(make_requests(40))
+    assert [response['result'] for response in responses] == [[i] for i in range(40)]
+    assert 1 < backend.server.max_in_flight <= config.BACKEND_RPC_BATCH_NUM_WORKERS
+    assert len(backend.server.connections) <= config.BACKEND_RPC_BATCH_NUM_WORKERS
+    assert delays == []
+
+    stats = connection.get_latency_stats()
+    assert list(stats) == ['echo']
+    assert stats['echo']['calls'] == 45
+    assert 0 < stats['echo']['max'] <= stats['echo']['total']
+
+
+def test_post_retries(backends):
+    port, started, delays = backends
+
+    # The backend comes up after two failed tries.
+    def sleep(delay):
+        delays.append(delay)
+        if len(delays) == 2:
+            started.append(Backend(port))
+    connection.time.sleep = sleep
+
+    assert addrindex.rpc('echo', [1]) == [1]
+    assert len(delays) == 2
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= min(connection.BACKOFF_MAX, connection.BACKOFF_BASE * 2 ** attempt)
+
+
+def test_post_gives_up(backends):
+    port, started, delays = backends
+    assert connection.post(make_requests(1)) is None
+    assert len(delays) == connection.TRIES
+    assert all(0 <= delay <= connection.BACKOFF_MAX for delay in delays)
+    with pytest.raises(addrindex.BackendRPCError):
+        addrindex.rpc('echo', [1])
+
+
+def test_backend_not_ready(backends):
+    port, started, delays = backends
+    backend = Backend(port)
+    started.append(backend)
+    backend.server.errors = [{'code': -28, 'message': 'Verifying blocks...'}] * 3
+
+    assert addrindex.rpc('echo', [1]) == [1]
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= min(connection.NOT_READY_BACKOFF_MAX, connection.BACKOFF_BASE * 2 ** attempt)
+
+
+def test_backoff_delay():
+    delays = [connection.backoff_delay(10) for i in range(1000)]
+    assert all(0 <= delay <= connection.BACKOFF_MAX for delay in delays)
+    # Jittered, so that workers do not retry in lockstep.
+    assert len(set(delays)) > 1
+    assert max(connection.backoff_delay(10, cap=connection.NOT_READY_BACKOFF_MAX) for i in range(1000)) > connection.BACKOFF_MAX
@@ -0,0 +1,36 @@
+"""`util.credit_many()` leaves the same ledger as a loop of `util.credit()`."""
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib import blocks
+
+from aspirelib.test.conftest import make_address
+
+
+def test_credit_many(ledger):
+    # New holders, out of address order and credited more than once, and
+    # existing ones.
+    new = sorted((make_address(i) for i in range(10, 20)), reverse=True)
+    new[0], new[5] = new[5], new[0]
+    credits = [[address, 'BBBB', i + 1] for i, address in enumerate(new)]
+    credits += [[new[3], 'BBBB', 5], [new[7], config.XCP, 2]]
+
+    results = []
+    for name in ('loop', 'many'):
+        l = ledger(name)
+        a, b = l.addresses[:2]
+        l.populate()
+        credits_ = credits + [[a, 'BBBB', 3], [b, 'BBBB', 4], [a, config.XCP, 1]]
+        if name == 'loop':
+            l.block((a, l.ops(*[['credit'] + credit for credit in credits_])))
+        else:
+            l.block((a, l.ops(['credit_many', credits_])))
+
+        # A dividend credits the holders in the order of `holders()`.
+        holders = [holder['address'] for holder in util.holders(l.db, 'BBBB')]
+        l.block((a, l.ops(*[['credit', address, config.XCP, 1] for address in holders])))
+        # The transactions differ, and so does the txlist hash.
+        hashes = [l.hashes(i) for i in range(l.block_index + 1)]
+        results.append((l.dump(['balances', 'credits', 'messages']), holders,
+                        [(row['ledger_hash'], row['messages_hash']) for row in hashes]))
+
+    assert results[0] == results[1]
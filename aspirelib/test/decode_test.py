@@ -0,0 +1,79 @@
+"""Decoding transactions: on reparse, and in the decode process pool."""
+import functools
+
+import pytest
+from Crypto.Cipher import ARC4
+from bitcoin.core import CTransaction, CTxIn, CTxOut, COutPoint, b2x, lx
+from bitcoin.core.script import CScript, OP_DUP, OP_HASH160, OP_EQUALVERIFY, OP_CHECKSIG, OP_RETURN
+
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib import script
+from aspirelib.lib import backend
+from aspirelib.lib import blocks
+from aspirelib.lib.kickstart.utils import ib2h
+
+
+def p2pkh(i):
+    return CScript([OP_DUP, OP_HASH160, bytes([i]) * 20, OP_EQUALVERIFY, OP_CHECKSIG])
+
+
+def make_txs():
+    """Return a coinbase, a transaction funding two addresses, and two
+    transactions spending them with data, as hex; and the prevouts of the
+    latter."""
+    coinbase = CTransaction([CTxIn(scriptSig=CScript([b'\x01\x02']))], [CTxOut(50 * config.UNIT, p2pkh(1))])
+    funding = CTransaction([CTxIn(COutPoint(lx('ab' * 32), 0))], [CTxOut(config.UNIT, p2pkh(2)), CTxOut(config.UNIT, p2pkh(3))])
+
+    def data_tx(n, outputs, data):
+        prevout = COutPoint(funding.GetTxid(), n)
+        data = ARC4.new(prevout.hash[::-1]).encrypt(config.PREFIX + data)
+        return CTransaction([CTxIn(prevout)], outputs + [CTxOut(0, CScript([OP_RETURN, data]))])
+
+    send = data_tx(0, [CTxOut(5430, p2pkh(4))], b'send')
+    order = data_tx(1, [], b'order')
+    txs = [b2x(tx.serialize()) for tx in (coinbase, funding, send, order)]
+    return txs, {ib2h(funding.GetTxid()): txs[1]}
+
+
+def test_reparse_decodes_only_coinbase(ledger, monkeypatch):
+    ledgers = [ledger('parsed'), ledger('reparsed')]
+    for l in ledgers:
+        l.populate()
+
+    decoded = []
+    def get_tx_info(tx_hex, db=None, **kwargs):
+        decoded.append((tx_hex, db))
+    monkeypatch.setattr(backend, 'get_tx_list', lambda block: (['coinbase', 'send', 'order'], {'coinbase': 'cb', 'send': 'tx1', 'order': 'tx2'}))
+    monkeypatch.setattr(blocks, 'get_tx_info', get_tx_info)
+
+    a, b = ledgers[0].addresses[:2]
+    ledgers[0].block((a, ledgers[0].ops(['credit', b, 'BBBB', 1])))
+    assert decoded == []
+    monkeypatch.setattr(blocks, 'parse_block', functools.partial(blocks.parse_block, reparse=True))
+    ledgers[1].block((a, ledgers[1].ops(['credit', b, 'BBBB', 1])))
+
+    # The coinbase is decoded, with the database to credit proof of work; nothing else is.
+    assert decoded == [('cb', ledgers[1].db)]
+    assert ledgers[1].hashes() == ledgers[0].hashes()
+
+
+@pytest.fixture
+def decode_pool(testnet_config, monkeypatch):
+    monkeypatch.setattr(config, 'DECODE_WORKERS', 2)
+    monkeypatch.setattr(util, 'CURRENT_BLOCK_INDEX', config.BLOCK_FIRST + 1)
+    yield
+    if blocks.DECODE_POOL is not None:
+        blocks.DECODE_POOL.shutdown()
+        blocks.DECODE_POOL = None
+
+
+def test_decode_txs(decode_pool):
+    txs, prevouts = make_txs()
+    serial = [blocks.get_tx_info(tx, prevouts=prevouts) for tx in txs]
+    assert [tx_info[-1] for tx_info in serial] == [None, None, b'send', b'order']
+    assert serial[2][:2] == (script.base58_check_encode('02' * 20, config.ADDRESSVERSION), script.base58_check_encode('04' * 20, config.ADDRESSVERSION))
+
+    # In order, for any number of transactions and workers.
+    for tx_hexes, expected in ((txs, serial), (txs[::-1], serial[::-1]), (txs[2:3], serial[2:3]), ([], [])):
+        assert blocks.decode_txs(tx_hexes, prevouts=prevouts) == expected
@@ -0,0 +1,181 @@
+"""Orders, bets and RPS expire, and expired order matches are re-matched, in
+the same order as when `expire()` scanned them without the expiry indexes."""
+import json
+
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib.messages import bet
+from aspirelib.lib.messages import rps
+from aspirelib.lib.messages import order
+
+from aspirelib.test.conftest import make_address
+
+EXPIRY_INDEXES = ['orders_status_expire_idx', 'bets_status_expire_idx', 'bet_matches_status_deadline_idx', 'rps_status_expire_idx']
+TABLES = ['orders', 'order_matches', 'order_expirations', 'order_match_expirations',
+          'bets', 'bet_matches', 'bet_expirations', 'bet_match_expirations',
+          'rps', 'rps_matches', 'rps_expirations', 'rps_match_expirations',
+          'balances', 'credits', 'debits', 'messages']
+
+
+def expire_orders_unindexed(db, block_index):
+    """`order.expire()` as it was before the expiry indexes."""
+    cursor = db.cursor()
+    cursor.execute('''SELECT * FROM orders \
+                      WHERE (status = ? AND expire_index < ?)''', ('open', block_index))
+    for tx in list(cursor):
+        order.cancel_order(db, tx, 'expired', block_index)
+    cursor.execute('''SELECT * FROM order_matches WHERE (status = ? and match_expire_index < ?)''', ('pending', block_index))
+    order_matches = list(cursor)
+    for order_match in order_matches:
+        order.cancel_order_match(db, order_match, 'expired', block_index)
+    for order_match in order_matches:
+        cursor.execute('''SELECT * FROM transactions WHERE tx_hash = ?''', (order_match['tx0_hash'],))
+        order.match(db, list(cursor)[0], block_index)
+        cursor.execute('''SELECT * FROM transactions WHERE tx_hash = ?''', (order_match['tx1_hash'],))
+        order.match(db, list(cursor)[0], block_index)
+    cursor.close()
+
+
+def expire_bets_unindexed(db, block_index, block_time):
+    """`bet.expire()` as it was before the expiry indexes."""
+    cursor = db.cursor()
+    cursor.execute('''SELECT * FROM bets \
+                      WHERE (status = ? AND expire_index < ?)''', ('open', block_index))
+    for tx in cursor.fetchall():
+        bet.cancel_bet(db, tx, 'expired', block_index)
+        bindings = {'bet_index': tx['tx_index'], 'bet_hash': tx['tx_hash'], 'source': tx['source'], 'block_index': block_index}
+        cursor.execute('''INSERT INTO bet_expirations VALUES(:bet_index, :bet_hash, :source, :block_index)''', bindings)
+    cursor.execute('''SELECT * FROM bet_matches \
+                      WHERE (status = ? AND deadline < ?)''', ('pending', block_time - config.TWO_WEEKS))
+    for bet_match in cursor.fetchall():
+        bet.cancel_bet_match(db, bet_match, 'expired', block_index)
+        bindings = {'bet_match_id': bet_match['id'], 'tx0_address': bet_match['tx0_address'], 'tx1_address': bet_match['tx1_address'],
+                    'block_index': block_index}
+        cursor.execute('''INSERT INTO bet_match_expirations VALUES(:bet_match_id, :tx0_address, :tx1_address, :block_index)''', bindings)
+    cursor.close()
+
+
+def expire_rps_unindexed(db, block_index):
+    """`rps.expire()` as it was before the expiry indexes."""
+    cursor = db.cursor()
+    cursor.execute('''SELECT * FROM rps WHERE (status = ? AND expire_index < ?)''', ('open', block_index))
+    for tx in cursor.fetchall():
+        rps.cancel_rps(db, tx, 'expired', block_index)
+        bindings = {'rps_index': tx['tx_index'], 'rps_hash': tx['tx_hash'], 'source': tx['source'], 'block_index': block_index}
+        cursor.execute('''INSERT INTO rps_expirations VALUES(:rps_index, :rps_hash, :source, :block_index)''', bindings)
+    expire_bindings = ('pending', 'pending and resolved', 'resolved and pending', block_index)
+    cursor.execute('''SELECT * FROM rps_matches WHERE (status IN (?, ?, ?) AND match_expire_index < ?)''', expire_bindings)
+    for rps_match in cursor.fetchall():
+        new_rps_match_status = 'expired'
+        if rps_match['status'] == 'pending and resolved':
+            new_rps_match_status = 'concluded: second player wins'
+        elif rps_match['status'] == 'resolved and pending':
+            new_rps_match_status = 'concluded: first player wins'
+        rps.update_rps_match_status(db, rps_match, new_rps_match_status, block_index)
+        bindings = {'rps_match_id': rps_match['id'], 'tx0_address': rps_match['tx0_address'], 'tx1_address': rps_match['tx1_address'],
+                    'block_index': block_index}
+        cursor.execute('''INSERT INTO rps_match_expirations VALUES(:rps_match_id, :tx0_address, :tx1_address, :block_index)''', bindings)
+        if new_rps_match_status == 'expired':
+            sql = '''SELECT * FROM rps WHERE tx_hash IN (?, ?) AND status = ? AND expire_index >= ?'''
+            bindings = (rps_match['tx0_hash'], rps_match['tx1_hash'], 'matched', block_index)
+            for tx in list(cursor.execute(sql, bindings)):
+                cursor.execute('''UPDATE rps SET status = ? WHERE tx_index = ?''', ('open', tx['tx_index']))
+                util.debit(db, tx['source'], 'ASP', tx['wager'], action='reopen RPS after matching expiration', event=rps_match['id'])
+                rps.match(db, {'tx_index': tx['tx_index']}, block_index)
+    cursor.close()
+
+
+def open_rps(l, *games):
+    """Escrow the wagers of the RPS `games`, as `(source, expire_index,
+    status)`, and list them as `rps.parse()` would, since RPS is disabled on
+    testnet. Return their transactions."""
+    block_index = l.block(*[(source, l.ops(['debit', source, config.XCP, config.UNIT])) for source, _, _ in games])
+    cursor = l.db.cursor()
+    with l.db:
+        txs = list(cursor.execute('''SELECT * FROM transactions WHERE block_index = ? ORDER BY tx_index''', (block_index,)))
+        for tx, (source, expire_index, status) in zip(txs, games):
+            cursor.execute('''INSERT INTO rps(tx_index, tx_hash, block_index, source, possible_moves, wager, move_random_hash,
+                                              expiration, expire_index, status)
+                              VALUES(?,?,?,?,?,?,?,?,?,?)''',
+                           (tx['tx_index'], tx['tx_hash'], block_index, source, 3, config.UNIT, 'move', 10, expire_index, status))
+    cursor.close()
+    return txs
+
+
+def expire_all(l):
+    """Parse orders matched for BTC, bets and RPS games, and move back their
+    expiries so that they all expire in the next block, in another order than
+    that of their rowids. Return the index of that block."""
+    a, b, c, d = l.addresses
+    e = make_address(5)
+    l.populate()
+    matched_tx_index = l.tx_index
+    l.block((a, order.compose(l.db, a, 'BBBB', 10, config.BTC, 100000, 100, 0)[2]),
+            (b, order.compose(l.db, b, config.BTC, 100000, 'BBBB', 10, 100, 0)[2]),
+            (a, l.ops(['debit', a, 'BBBB', 5], ['credit', c, 'BBBB', 5])))
+    l.block((c, order.compose(l.db, c, 'BBBB', 5, config.BTC, 50000, 100, 0)[2]),
+            (d, order.compose(l.db, d, config.BTC, 50000, 'BBBB', 5, 100, 0)[2]),
+            (d, c, bet.compose(l.db, d, c, 3, 4000000000, 1 * config.UNIT, 1 * config.UNIT, 1.0, 5040, 100)[2]),
+            (b, c, bet.compose(l.db, b, c, 2, 4000000000, 3 * config.UNIT, 3 * config.UNIT, 1.0, 5040, 100)[2]))
+    # Left open, for the orders of `a` and `c` to be matched with again when
+    # their matches expire.
+    l.block((e, order.compose(l.db, e, config.BTC, 200000, 'BBBB', 20, 100, 0)[2]))
+
+    # The games of `a` and `c` expire, and that of `b` is re-opened, to
+    # match the last one of `a`, when its match with `d` expires.
+    block_index = l.block_index + 2
+    txs = open_rps(l, (a, block_index - 1, 'open'), (b, block_index + 100, 'matched'), (c, block_index - 2, 'open'),
+                   (d, block_index - 1, 'matched'), (a, block_index + 100, 'open'))
+    cursor = l.db.cursor()
+    with l.db:
+        tx0, tx1 = txs[1], txs[3]
+        cursor.execute('''INSERT INTO rps_matches(id, tx0_index, tx0_hash, tx0_address, tx1_index, tx1_hash, tx1_address, wager,
+                                                  possible_moves, tx0_block_index, tx1_block_index, block_index, tx0_expiration,
+                                                  tx1_expiration, match_expire_index, status)
+                          VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''',
+                       (util.make_id(tx0['tx_hash'], tx1['tx_hash']), tx0['tx_index'], tx0['tx_hash'], b, tx1['tx_index'], tx1['tx_hash'], d,
+                        config.UNIT, 3, tx0['block_index'], tx1['block_index'], tx0['block_index'], 10, 10, block_index - 1, 'pending'))
+        cursor.execute('''UPDATE order_matches SET match_expire_index = ? WHERE status = ?''', (block_index - 1, 'pending'))
+        # Orders matched for BTC stay open, to be re-matched.
+        cursor.execute('''UPDATE orders SET expire_index = ? - 1 - tx_index % 3 WHERE status = ? AND tx_index < ?''',
+                       (block_index, 'open', matched_tx_index))
+        cursor.execute('''UPDATE bets SET expire_index = ? - 1 - tx_index % 3 WHERE status = ?''', (block_index, 'open'))
+        cursor.execute('''UPDATE bet_matches SET deadline = 0 WHERE status = ?''', ('pending',))
+    cursor.close()
+
+    assert l.block() == block_index
+    return block_index
+
+
+def test_expire(ledger, monkeypatch):
+    indexed = (order.expire, bet.expire, rps.expire)
+    unindexed = (expire_orders_unindexed, expire_bets_unindexed, expire_rps_unindexed)
+    results = []
+    for name, (expire_orders, expire_bets, expire_rps) in (('unindexed', unindexed), ('indexed', indexed)):
+        monkeypatch.setattr(order, 'expire', expire_orders)
+        monkeypatch.setattr(bet, 'expire', expire_bets)
+        monkeypatch.setattr(rps, 'expire', expire_rps)
+        l = ledger(name)
+        if name == 'unindexed':
+            cursor = l.db.cursor()
+            for index in EXPIRY_INDEXES:
+                cursor.execute('''DROP INDEX {}'''.format(index))
+            cursor.close()
+        block_index = expire_all(l)
+        results.append((l.dump(TABLES), l.hashes()))
+    assert results[0] == results[1]
+
+    # Everything expired in that block, orders in another order than by
+    # rowid, and the expired matches were made again.
+    cursor = l.db.cursor()
+    for table, count in (('order_expirations', 2), ('order_match_expirations', 2), ('bet_expirations', 2),
+                         ('bet_match_expirations', 1), ('rps_expirations', 2), ('rps_match_expirations', 1)):
+        expirations = list(cursor.execute('''SELECT * FROM {} WHERE block_index = ?'''.format(table), (block_index,)))
+        assert len(expirations) >= count, table
+    order_indexes = [json.loads(message['bindings'])['order_index']
+                     for message in cursor.execute('''SELECT * FROM messages WHERE block_index = ? AND category = ? ORDER BY message_index''',
+                                                   (block_index, 'order_expirations'))]
+    assert order_indexes != sorted(order_indexes)
+    for table in ('order_matches', 'rps_matches'):
+        assert list(cursor.execute('''SELECT * FROM {} WHERE block_index = ?'''.format(table), (block_index,))), table
+    cursor.close()
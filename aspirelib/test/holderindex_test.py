@@ -0,0 +1,83 @@
+"""The asset holder index follows credits, debits and escrows, and the undolog
+replays of them."""
+from aspirelib.lib import config
+from aspirelib.lib import check
+from aspirelib.lib import blocks
+from aspirelib.lib import holderindex
+from aspirelib.lib.messages import order
+
+
+def escrow_in_rps(l):
+    """Escrow ASP in two RPS games, then match and resolve them, as
+    `rps.parse()` and `rpsresolve.parse()` would (RPS is disabled on
+    testnet). Return the index of the block."""
+    a, b = l.addresses[:2]
+    block_index = l.block((a, l.ops(['debit', a, config.XCP, 3 * config.UNIT])),
+                          (b, l.ops(['debit', b, config.XCP, 3 * config.UNIT])))
+    cursor = l.db.cursor()
+    with l.db:
+        txs = list(cursor.execute('''SELECT * FROM transactions WHERE block_index = ? ORDER BY tx_index''', (block_index,)))
+        for tx in txs:
+            cursor.execute('''INSERT INTO rps(tx_index, tx_hash, block_index, source, possible_moves, wager, move_random_hash,
+                                              expiration, expire_index, status) VALUES(?,?,?,?,?,?,?,?,?,?)''',
+                           (tx['tx_index'], tx['tx_hash'], block_index, tx['source'], 3, 3 * config.UNIT, 'move', 10, block_index + 10, 'open'))
+    assert holderindex.check(l.db) == []
+
+    tx0, tx1 = txs
+    with l.db:
+        cursor.execute('''UPDATE rps SET status = ? WHERE block_index = ?''', ('matched', block_index))
+        cursor.execute('''INSERT INTO rps_matches(id, tx0_index, tx0_hash, tx0_address, tx1_index, tx1_hash, tx1_address, wager,
+                                                  possible_moves, tx0_block_index, tx1_block_index, block_index, status)
+                          VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)''',
+                       (tx0['tx_hash'] + tx1['tx_hash'], tx0['tx_index'], tx0['tx_hash'], a, tx1['tx_index'], tx1['tx_hash'], b,
+                        3 * config.UNIT, 3, block_index, block_index, block_index, 'pending'))
+    assert holderindex.check(l.db) == []
+
+    for status in ('pending and resolved', 'concluded: first player wins'):
+        with l.db:
+            cursor.execute('''UPDATE rps_matches SET status = ? WHERE tx0_index = ?''', (status, tx0['tx_index']))
+        assert holderindex.check(l.db) == []
+    cursor.close()
+    return block_index
+
+
+def get_holdings(l):
+    return sorted(row[1:] for row in l.dump(['asset_holders'])['asset_holders'])
+
+
+def test_holder_index(ledger):
+    l = ledger(holder_index=True)
+    l.populate()
+    assert holderindex.check(l.db) == []
+    assert holderindex.get_holders(l.db, 'BBBB')
+    assert any(holder['escrowed'] for holder in holderindex.get_holders(l.db, config.XCP))
+
+    escrow_in_rps(l)
+    assert holderindex.check(l.db) == []
+    check.holder_index(l.db)
+
+
+def test_holder_index_undolog_replay(ledger, monkeypatch):
+    l = ledger(holder_index=True)
+    a, b, c, d = l.addresses
+    block_index = l.populate()
+    holdings = get_holdings(l)
+
+    # Move the balances behind open orders and bets, fill the rest of the order of `a`, and escrow in RPS.
+    l.block((a, l.ops(['debit', a, 'BBBB', 7], ['credit', b, config.XCP, 2 * config.UNIT])),
+            (c, l.ops(['debit', c, config.XCP, 1 * config.UNIT], ['credit', d, config.XCP, 5 * config.UNIT])))
+    l.block((d, order.compose(l.db, d, config.XCP, 3 * config.UNIT, 'BBBB', 15, 100, 0)[2]),
+            (b, l.ops(['credit', b, 'BBBB', 1], ['debit', b, 'BBBB', 1])))
+    escrow_in_rps(l)
+    assert get_holdings(l) != holdings
+
+    # Neither the full reparse nor a rebuild of the index may hide a bad replay.
+    def fail(*args, **kwargs):
+        raise AssertionError('not rolled back from the undolog')
+    monkeypatch.setattr(blocks, 'reinitialise', fail)
+    monkeypatch.setattr(holderindex, 'rebuild', fail)
+
+    blocks.reparse(l.db, block_index=block_index)
+    assert holderindex.check(l.db) == []
+    check.holder_index(l.db)
+    assert get_holdings(l) == holdings
@@ -0,0 +1,105 @@
+"""Mempool transactions are parsed once each, in a savepoint that is rolled
+back, and only their messages are kept in the `mempool` table."""
+import collections
+
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib import log
+from aspirelib.lib import backend
+from aspirelib.lib import blocks
+from aspirelib.lib.messages import order
+from aspirelib.lib.messages import issuance
+
+LEDGER_TABLES = ['blocks', 'transactions', 'balances', 'credits', 'debits', 'issuances', 'orders', 'order_matches', 'messages']
+
+
+def test_refresh_mempool(ledger, monkeypatch):
+    l = ledger()
+    a, b, c, d = l.addresses
+    block_index = l.populate()
+
+    # Mempool transactions by hash: `None` for the ones that are not Aspire transactions.
+    mempool_txs = {
+        'order': (a, order.compose(l.db, a, 'BBBB', 1, config.XCP, 1 * config.UNIT, 100, 0)[2]),
+        'other': None,
+        'issuance': (c, issuance.compose(l.db, c, None, 'CCCC', 1000, False, 'new')[2]),
+        'other order': (d, order.compose(l.db, d, config.XCP, 1 * config.UNIT, 'BBBB', 1, 100, 0)[2]),
+    }
+    raw_mempool = []
+    fetched = []
+    parsed = []
+
+    def getrawtransaction_batch(txhash_list, *args, **kwargs):
+        fetched.extend(txhash_list)
+        return {tx_hash: '' for tx_hash in txhash_list}
+
+    def get_tx_rows(db, block_hash, block_index, block_time, txhash_list, raw_transactions, tx_index, prevouts=None):
+        rows = []
+        for tx_hash in txhash_list:
+            if mempool_txs[tx_hash] is not None:
+                source, data = mempool_txs[tx_hash]
+                rows.append((tx_index, tx_hash, config.MEMPOOL_BLOCK_INDEX, config.MEMPOOL_BLOCK_HASH, block_time,
+                             source, None, 0, 0, data))
+                tx_index += 1
+        return rows
+
+    parse_tx = blocks.parse_tx
+
+    def counting_parse_tx(db, tx):
+        parsed.append(tx['tx_hash'])
+        return parse_tx(db, tx)
+
+    monkeypatch.setattr(backend, 'getrawmempool', lambda: list(raw_mempool))
+    monkeypatch.setattr(backend, 'getrawtransaction_batch', getrawtransaction_batch)
+    monkeypatch.setattr(blocks, 'get_prevouts', lambda raw_transactions: {})
+    monkeypatch.setattr(blocks, 'get_tx_rows', get_tx_rows)
+    monkeypatch.setattr(blocks, 'parse_tx', counting_parse_tx)
+
+    def get_mempool():
+        cursor = l.db.cursor()
+        mempool = collections.Counter(message['tx_hash'] for message in cursor.execute('''SELECT * FROM mempool'''))
+        cursor.close()
+        return mempool
+
+    dump = l.dump(LEDGER_TABLES)
+    not_supported, not_supported_sorted = {}, collections.deque()
+    asset_cache = dict(util.ASSET_CACHE.dict)
+    assert asset_cache
+
+    def refresh(*tx_hashes):
+        raw_mempool[:] = tx_hashes
+        fetched.clear()
+        parsed.clear()
+        return blocks.refresh_mempool(l.db, block_index + 1, l.tx_index, not_supported, not_supported_sorted)
+
+    _, xcp_mempool = refresh('order', 'other', 'issuance')
+    assert sorted(fetched) == ['issuance', 'order', 'other']
+    assert parsed == ['order', 'issuance']
+    mempool = get_mempool()
+    assert set(mempool) == {'order', 'issuance'}
+    assert sum(mempool.values()) == len(xcp_mempool)
+    assert not_supported == {'other': ''}
+    assert list(not_supported_sorted) == [(block_index + 1, 'other')]
+
+    # Nothing outlives the savepoints: no rows, no messages, no message
+    # indexes, and no asset in the shared cache, which is kept as it was.
+    assert l.dump(LEDGER_TABLES) == dump
+    assert log.MESSAGE_INDEX is None
+    assert util.ASSET_CACHE.dict == asset_cache
+
+    # Only new transactions are fetched and parsed; messages of evicted ones are dropped.
+    issuance_messages = mempool['issuance']
+    _, xcp_mempool = refresh('issuance', 'other', 'other order')
+    assert fetched == ['other order']
+    assert parsed == ['other order']
+    assert set(tx_hash for tx_hash, message in xcp_mempool) == {'other order'}
+    mempool = get_mempool()
+    assert set(mempool) == {'issuance', 'other order'}
+    assert mempool['issuance'] == issuance_messages
+    assert l.dump(LEDGER_TABLES) == dump
+    assert util.ASSET_CACHE.dict == asset_cache
+
+    # The ledger goes on from where it was, with no gap in message indexes.
+    l.block((a, l.ops(['credit', a, 'BBBB', 1])))
+    message_indexes = [row[1] for row in l.dump(['messages'])['messages']]
+    assert message_indexes == list(range(len(message_indexes)))
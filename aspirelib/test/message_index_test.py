@@ -0,0 +1,60 @@
+"""Message indexes allocated in memory stay dense, and in step with the
+`messages` table, across rollbacks, reparses and failed contract calls."""
+from aspirelib.lib import config
+from aspirelib.lib import log
+from aspirelib.lib import blocks
+from aspirelib.lib.messages import publish
+from aspirelib.lib.messages import execute
+
+# A contract that stores 1 at 0, then loops until it runs out of gas:
+# `PUSH1 1 PUSH1 0 SSTORE PUSH1 5 JUMP`, returned by its init code.
+LOOPING_CODE = bytes.fromhex('6001600057600558')
+INIT_CODE = ''.join('60{:02x}60{:02x}55'.format(byte, i) for i, byte in enumerate(LOOPING_CODE)) + '60{:02x}6000f2'.format(len(LOOPING_CODE))
+
+
+def check_message_indexes(l):
+    """Parse a block of messages, then check that message indexes are dense
+    and that the next one follows the last in the database."""
+    a, b = l.addresses[:2]
+    l.block((a, l.ops(['credit', b, config.XCP, 5], ['debit', b, config.XCP, 5])))
+    message_indexes = [row[1] for row in l.dump(['messages'])['messages']]
+    assert message_indexes == list(range(len(message_indexes)))
+    assert log.MESSAGE_INDEX == len(message_indexes)
+
+
+def test_message_indexes_after_rollback(ledger):
+    l = ledger()
+    l.populate()
+    blocks.reparse(l.db, block_index=3)
+    l.block_index = 3
+    check_message_indexes(l)
+
+
+def test_message_indexes_after_reparse(ledger, monkeypatch):
+    monkeypatch.setattr(config, 'UNDOLOG_MAX_PAST_BLOCKS', 2)
+    l = ledger()
+    l.populate()
+    l.block()
+    l.block()
+    blocks.reparse(l.db, block_index=3)
+    l.block_index = 3
+    check_message_indexes(l)
+
+
+def test_message_indexes_after_contract_out_of_gas(ledger):
+    l = ledger()
+    a, b = l.addresses[:2]
+    l.populate()
+
+    l.block((a, publish.compose(l.db, a, 1, 100000, 0, INIT_CODE)[2]))
+    cursor = l.db.cursor()
+    contracts = list(cursor.execute('''SELECT * FROM contracts'''))
+    assert [contract['code'] for contract in contracts] == [LOOPING_CODE]
+
+    # The storage and messages of the call are rolled back with it, within the block.
+    l.block((b, execute.compose(l.db, b, contracts[0]['contract_id'], 1, 100000, 7, '')[2]),
+            (a, l.ops(['credit', a, config.XCP, 5])))
+    assert [execution['status'] for execution in cursor.execute('''SELECT * FROM executions ORDER BY tx_index''')] == ['valid', 'out of gas']
+    assert list(cursor.execute('''SELECT * FROM storage''')) == []
+    cursor.close()
+    check_message_indexes(l)
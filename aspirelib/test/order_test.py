@@ -0,0 +1,73 @@
+"""Orders are matched with the same candidates, in the same order, as when
+every open order of the pair was fetched and sorted by exact price."""
+from aspirelib.lib import config
+from aspirelib.lib import util
+from aspirelib.lib.messages import order
+from aspirelib.lib.messages import issuance
+
+from aspirelib.test.conftest import make_address
+
+# An order giving `G` BBBB for `H` ASP, and the orders giving ASP for BBBB
+# around its inverse price, which their REAL price may not tell apart:
+# `(give_quantity, get_quantity, matched)`.
+G, H = 10 ** 15 + 7, 3 * 10 ** 14 + 1
+BOOK = [
+    (1000 * H, 1000 * G + 1, False),                        # Above, by less than a REAL can tell.
+    (4000 * H, 4000 * G + 4000 * G // 10 ** 10, False),     # Above, within `PRICE_ROUNDING_MARGIN`.
+    (1000 * H, 1000 * G + 1000 * G // 10 ** 8, False),      # Above, beyond the margin.
+    (1000 * H, 1000 * G - 1, True),                         # Below, by less than a REAL can tell.
+    (H, G, True),                                           # At the price, first of three.
+    (2 * H, 2 * G, True),
+    (1000 * H, 1000 * G - 1000 * G // 10 ** 10, True),      # Below, within the margin: the best price.
+    (3 * H, 3 * G, True),
+    (13 * H, 13 * G, True),                                 # At the price, which rounds above it as a REAL.
+]
+TABLES = ['orders', 'order_matches', 'balances', 'credits', 'debits', 'messages']
+
+
+def get_candidates_sorted(db, tx, tx1):
+    """Return the candidates as `order.match()` used to: every open order of
+    the pair, sorted by tx index, then by price."""
+    cursor = db.cursor()
+    cursor.execute('''SELECT * FROM orders \
+                      WHERE (give_asset=? AND get_asset=? AND status=? AND tx_hash != ?)''',
+                   (tx1['get_asset'], tx1['give_asset'], 'open', tx1['tx_hash']))
+    candidates = cursor.fetchall()
+    candidates = sorted(candidates, key=lambda x: x['tx_index'])
+    candidates = sorted(candidates, key=lambda x: util.price(x['get_quantity'], x['give_quantity']))
+    cursor.close()
+    return candidates
+
+
+def match_book(l):
+    """Match two orders against `BOOK`; return the tx indexes of the book."""
+    a, b = l.addresses[:2]
+    addresses = [make_address(10 + i) for i in range(len(BOOK))]
+    l.block(*[(address, l.ops(['credit', address, config.XCP, give_quantity])) for address, (give_quantity, _, _) in zip(addresses, BOOK)])
+    l.block((a, l.ops(['credit', a, config.XCP, 1000 * config.UNIT])))
+    l.block((a, issuance.compose(l.db, a, None, 'BBBB', 2008 * G, False, 'test')[2]))
+    l.block((a, l.ops(['debit', a, 'BBBB', 5 * G], ['credit', b, 'BBBB', 5 * G])))
+    tx_index = l.tx_index
+    l.block(*[(address, order.compose(l.db, address, config.XCP, give_quantity, 'BBBB', get_quantity, 100, 0)[2])
+              for address, (give_quantity, get_quantity, _) in zip(addresses, BOOK)])
+    l.block((a, order.compose(l.db, a, 'BBBB', 2003 * G, config.XCP, 2003 * H, 100, 0)[2]))
+    l.block((b, order.compose(l.db, b, 'BBBB', 5 * G, config.XCP, 5 * H, 100, 0)[2]))
+    return list(range(tx_index, tx_index + len(BOOK)))
+
+
+def test_match_near_price_rounding_margin(ledger, monkeypatch):
+    get_candidates = order.get_candidates
+    results = []
+    for name, function in (('sorted', get_candidates_sorted), ('filtered', get_candidates)):
+        monkeypatch.setattr(order, 'get_candidates', function)
+        l = ledger(name)
+        book = match_book(l)
+        results.append((l.dump(TABLES), l.hashes(), book))
+    assert results[0] == results[1]
+
+    # The matches take the book from the best price, then by tx index, and
+    # none is made above the price.
+    dump, hashes, book = results[1]
+    matched = [row[2] for row in dump['order_matches']]
+    assert set(matched) == set(tx_index for tx_index, (_, _, match) in zip(book, BOOK) if match)
+    assert matched[:4] == [book[6], book[3], book[4], book[5]]
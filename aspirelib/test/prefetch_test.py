@@ -0,0 +1,127 @@
+"""Blocks are prefetched in order, at most `depth` ahead of the consumer, and
+as they are mined; errors are raised to the consumer, and stops are heeded."""
+import time
+
+import pytest
+from bitcoin.core import CBlock, CTransaction, CTxIn, CTxOut
+from bitcoin.core.script import CScript
+
+from aspirelib.lib import config
+from aspirelib.lib import backend
+
+
+def block_hash(block_index):
+    return '{:064x}'.format(block_index)
+
+
+def make_block(block_index):
+    coinbase = CTransaction([CTxIn(scriptSig=CScript([block_index.to_bytes(4, 'little')]))], [CTxOut(50 * config.UNIT, CScript())])
+    return CBlock(vtx=[coinbase])
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class Chain:
+    """A backend with `block_count` blocks, which records the blocks fetched
+    and raises the errors of `errors`, by block index."""
+
+    def __init__(self, monkeypatch, block_count):
+        self.block_count = block_count
+        self.fetched = []
+        self.errors = {}
+        monkeypatch.setattr(config, 'BACKEND_POLL_INTERVAL', 0.01)
+        monkeypatch.setattr(backend, 'getblockcount', lambda: self.block_count)
+        monkeypatch.setattr(backend, 'getblockhash', block_hash)
+        monkeypatch.setattr(backend, 'getblock', self.getblock)
+
+    def getblock(self, block_hash):
+        block_index = int(block_hash, 16)
+        if block_index in self.errors:
+            raise self.errors[block_index]
+        self.fetched.append(block_index)
+        return make_block(block_index)
+
+
+@pytest.fixture
+def prefetchers(testnet_config):
+    """Return a list to add prefetchers to, which are stopped at teardown."""
+    prefetchers = []
+    yield prefetchers
+    for prefetcher in prefetchers:
+        prefetcher.stop()
+        prefetcher.join(1)
+
+
+def start(prefetchers, block_index, depth):
+    prefetcher = backend.BlockPrefetcher(block_index, depth)
+    prefetchers.append(prefetcher)
+    prefetcher.start()
+    return prefetcher
+
+
+def test_prefetch_in_order(monkeypatch, prefetchers):
+    chain = Chain(monkeypatch, 20)
+    prefetcher = start(prefetchers, 5, 3)
+    for block_index in range(5, 21):
+        block = make_block(block_index)
+        assert prefetcher.get(block_index) == (block_hash(block_index), block) + backend.get_tx_list(block)
+    assert chain.fetched == list(range(5, 21))
+
+
+def test_prefetch_depth(monkeypatch, prefetchers):
+    chain = Chain(monkeypatch, 100)
+    prefetcher = start(prefetchers, 1, 3)
+
+    # `depth` blocks in the queue, and the next one waiting to be put in it.
+    wait_for(lambda: len(chain.fetched) == 4)
+    time.sleep(0.1)
+    assert chain.fetched == [1, 2, 3, 4]
+    prefetcher.get(1)
+    wait_for(lambda: len(chain.fetched) == 5)
+    time.sleep(0.1)
+    assert chain.fetched == [1, 2, 3, 4, 5]
+
+
+def test_prefetch_new_blocks(monkeypatch, prefetchers):
+    chain = Chain(monkeypatch, 2)
+    prefetcher = start(prefetchers, 1, 10)
+    prefetcher.get(1)
+    prefetcher.get(2)
+    time.sleep(0.1)
+    assert chain.fetched == [1, 2]
+
+    chain.block_count = 3
+    assert prefetcher.get(3)[0] == block_hash(3)
+    assert chain.fetched == [1, 2, 3]
+
+
+def test_prefetch_error(monkeypatch, prefetchers):
+    chain = Chain(monkeypatch, 10)
+    chain.errors[3] = backend.addrindex.BackendRPCError('block 3')
+    prefetcher = start(prefetchers, 1, 10)
+    prefetcher.get(1)
+    prefetcher.get(2)
+    with pytest.raises(backend.addrindex.BackendRPCError):
+        prefetcher.get(3)
+
+    # The prefetcher ends with the error, and fetches nothing past it.
+    prefetcher.join(1)
+    assert not prefetcher.is_alive()
+    assert chain.fetched == [1, 2]
+
+
+def test_prefetch_stop(monkeypatch, prefetchers):
+    chain = Chain(monkeypatch, 100)
+    prefetcher = start(prefetchers, 1, 1)
+
+    # Stopped while waiting to put a block in the full queue.
+    wait_for(lambda: len(chain.fetched) == 2)
+    prefetcher.stop()
+    prefetcher.join(1)
+    assert not prefetcher.is_alive()
+    assert chain.fetched == [1, 2]
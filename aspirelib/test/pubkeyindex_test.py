@@ -0,0 +1,108 @@
+"""The pubkey index records the public keys revealed by the inputs of parsed
+blocks, outside the ledger, keeps them across rollbacks and reparses, and is
+consulted by `backend.pubkeyhash_to_pubkey()` before the backend."""
+import pytest
+from bitcoin.core import CBlock, CTransaction, CTxIn, CTxOut, COutPoint, b2x, lx
+from bitcoin.core.script import CScript
+
+from aspirelib.lib import util
+from aspirelib.lib import config
+from aspirelib.lib import script
+from aspirelib.lib import blocks
+from aspirelib.lib import backend
+from aspirelib.lib import pubkeyindex
+
+SIGNATURE = bytes.fromhex('30440220') + bytes(32) + bytes.fromhex('0220') + bytes(32) + b'\x01'
+COMPRESSED = b'\x02' + bytes(range(32))
+UNCOMPRESSED = b'\x04' + bytes(range(64))
+
+
+def spend(*script_sigs):
+    """Return a transaction with inputs signed by `script_sigs`."""
+    return CTransaction([CTxIn(COutPoint(lx('ab' * 32), n), script_sig) for n, script_sig in enumerate(script_sigs)],
+                        [CTxOut(config.UNIT, CScript())])
+
+
+def revealed(*pubkeys):
+    return sorted((script.pubkey_to_pubkeyhash(pubkey), b2x(pubkey)) for pubkey in pubkeys)
+
+
+@pytest.fixture
+def indexed(ledger, monkeypatch):
+    """A ledger with the pubkey index on, and a block revealing `COMPRESSED`
+    and `UNCOMPRESSED` parsed and indexed as by `blocks.follow()`."""
+    monkeypatch.setattr(pubkeyindex, 'PUBKEY_CACHE', util.DictCache(size=pubkeyindex.PUBKEY_CACHE_SIZE))
+    l = ledger(pubkey_index=True)
+    l.populate()
+    block = CBlock(vtx=[CTransaction([CTxIn(scriptSig=CScript([b'\x01']))], [CTxOut(50 * config.UNIT, CScript())]),
+                        spend(CScript([SIGNATURE, COMPRESSED])),
+                        spend(CScript([SIGNATURE, UNCOMPRESSED]), CScript([SIGNATURE, COMPRESSED]))])
+    a = l.addresses[0]
+    l.block((a, l.ops(['credit', a, config.XCP, 1])))
+    with l.db:
+        pubkeyindex.index_block(l.db, block)
+    return l
+
+
+def get_index(l):
+    cursor = l.db.cursor()
+    index = sorted((row['pubkeyhash'], row['pubkey']) for row in cursor.execute('''SELECT * FROM pubkeys'''))
+    cursor.close()
+    return index
+
+
+def test_get_pubkeys(testnet_config):
+    multisig = CScript([b'', SIGNATURE, SIGNATURE])
+    not_a_pubkey = CScript([SIGNATURE, b'\x05' + bytes(32)])
+    truncated = CScript(b'\x4c\x10\x00')
+    tx = spend(CScript([SIGNATURE, COMPRESSED]), multisig, not_a_pubkey, truncated, CScript([SIGNATURE, UNCOMPRESSED]))
+    assert sorted(pubkeyindex.get_pubkeys(tx)) == revealed(COMPRESSED, UNCOMPRESSED)
+
+    coinbase = CTransaction([CTxIn(scriptSig=CScript([SIGNATURE, COMPRESSED]))], [CTxOut(50 * config.UNIT, CScript())])
+    assert list(pubkeyindex.get_pubkeys(coinbase)) == []
+
+
+def test_index_block(indexed):
+    l = indexed
+    assert get_index(l) == revealed(COMPRESSED, UNCOMPRESSED)
+
+    # Nothing of the index is in the ledger, nor in the undolog.
+    cursor = l.db.cursor()
+    assert list(cursor.execute('''SELECT * FROM messages WHERE category = ?''', ('pubkeys',))) == []
+    assert list(cursor.execute('''SELECT * FROM undolog WHERE table_name = ?''', ('pubkeys',))) == []
+    cursor.close()
+
+
+def test_lookup(indexed, monkeypatch):
+    l = indexed
+    def searchrawtransactions(address, unconfirmed=False):
+        raise AssertionError('searched the backend')
+    monkeypatch.setattr(backend, 'searchrawtransactions', searchrawtransactions)
+
+    pubkeyhash, pubkey = revealed(COMPRESSED)[0]
+    assert backend.pubkeyhash_to_pubkey(pubkeyhash, db=l.db) == pubkey
+    assert pubkeyindex.PUBKEY_CACHE[pubkeyhash] == pubkey
+
+    # Without the index, only the keys found earlier are known.
+    monkeypatch.setattr(config, 'PUBKEY_INDEX', False)
+    other_pubkeyhash = revealed(UNCOMPRESSED)[0][0]
+    assert pubkeyindex.lookup(l.db, pubkeyhash) == pubkey
+    assert pubkeyindex.lookup(l.db, other_pubkeyhash) is None
+
+
+def test_rollback(indexed, monkeypatch):
+    l = indexed
+    index = get_index(l)
+
+    # A public key stays valid, whatever happens to the block that revealed
+    # it: rolled back with the undolog,
+    blocks.reparse(l.db, block_index=l.block_index - 1)
+    assert get_index(l) == index
+
+    # or reparsed, past the undolog.
+    monkeypatch.setattr(config, 'UNDOLOG_MAX_PAST_BLOCKS', 2)
+    l.block_index -= 1
+    l.block()
+    l.block()
+    blocks.reparse(l.db, block_index=3)
+    assert get_index(l) == index
@@ -0,0 +1,39 @@
+"""Rolling back from a ledger snapshot gives the same ledger as a full
+reparse."""
+from aspirelib.lib import config
+from aspirelib.lib import blocks
+
+
+def roll_back(l, block_index):
+    """Parse the same blocks in `l`, then roll back to `block_index`, too far
+    back for the undolog; return the ledger and its consensus hashes."""
+    l.populate()
+    l.block((l.addresses[0], l.ops(['credit', l.addresses[1], config.XCP, 5])))
+    l.block((l.addresses[1], l.ops(['debit', l.addresses[1], config.XCP, 5])))
+    l.block()
+    blocks.reparse(l.db, block_index=block_index)
+    assert l.dump(['blocks'])['blocks'][-1][1] == block_index
+    return l.dump(blocks.SNAPSHOT_TABLES), [l.hashes(i) for i in range(block_index + 1)]
+
+
+def test_snapshot_rollback(ledger, monkeypatch):
+    monkeypatch.setattr(config, 'UNDOLOG_MAX_PAST_BLOCKS', 2)
+    block_index = 4
+
+    restored = []
+    restore_snapshot = blocks.restore_snapshot
+    def restore_snapshot_spy(db):
+        restored.append(True)
+        restore_snapshot(db)
+    monkeypatch.setattr(blocks, 'restore_snapshot', restore_snapshot_spy)
+
+    l = ledger('snapshots', snapshot_interval=3, snapshot_retention=3)
+    from_snapshot = roll_back(l, block_index)
+    assert restored == [True]
+    assert blocks.list_snapshots() == [9, 6, 3]
+
+    l = ledger('full')
+    from_full_reparse = roll_back(l, block_index)
+    assert restored == [True]
+
+    assert from_snapshot == from_full_reparse
@@ -0,0 +1,78 @@
+"""Rolling back with the undolog restores the tables as they were at the end
+of the target block, which is what replaying the statements of the old
+undolog one by one did."""
+import apsw
+
+from aspirelib.lib import blocks
+
+
+def full_reparse(*args, **kwargs):
+    raise AssertionError('full reparse')
+
+
+def test_undolog_replay(ledger, monkeypatch):
+    l = ledger()
+    a, b, c, d = l.addresses
+    l.block((a, l.ops(['credit', a, 'ASP', 100000], ['credit', b, 'ASP', 100000])))
+    block_index = l.block((a, l.ops(['debit', a, 'ASP', 10], ['credit', c, 'ASP', 10])))
+    expected = l.dump(blocks.UNDOLOG_TABLES)
+    hashes = l.hashes()
+
+    # Rows updated several times, inserted then updated, and deleted.
+    l.populate()
+    l.block((b, l.ops(['debit', b, 'ASP', 1], ['debit', b, 'ASP', 1], ['credit', a, 'ASP', 2])))
+    assert l.dump(blocks.UNDOLOG_TABLES) != expected
+
+    monkeypatch.setattr(blocks, 'reinitialise', full_reparse)
+    blocks.reparse(l.db, block_index=block_index)
+
+    assert l.dump(blocks.UNDOLOG_TABLES) == expected
+    assert l.hashes(block_index) == hashes
+    assert l.dump(['blocks'])['blocks'][-1][1] == block_index
+
+
+def test_undolog_replay_values(ledger, monkeypatch):
+    """Old rows are restored value for value, with their types, however wide."""
+    l = ledger()
+    block_index = l.populate()
+    long_text = "it's " + 'x' * 20000
+    with l.db:
+        cursor = l.db.cursor()
+        cursor.execute('''UPDATE broadcasts SET value = ?, text = ?''', (0.1 + 0.2, long_text))
+        cursor.execute('''UPDATE issuances SET description = ?, call_price = ?''', (b"\x00\xff'", 1e-300))
+    expected = l.dump(blocks.UNDOLOG_TABLES)
+
+    l.block((l.addresses[0], l.ops(['credit', l.addresses[1], 'ASP', 5])))
+    with l.db:
+        cursor.execute('''UPDATE broadcasts SET value = ?, text = ?''', (1, ''))
+        cursor.execute('''DELETE FROM issuances''')
+        cursor.close()
+    assert l.dump(blocks.UNDOLOG_TABLES) != expected
+
+    # No statement of the replay grows with the rows.
+    l.db.limit(apsw.SQLITE_LIMIT_SQL_LENGTH, 10000)
+    monkeypatch.setattr(blocks, 'reinitialise', full_reparse)
+    blocks.reparse(l.db, block_index=block_index)
+
+    dump = l.dump(blocks.UNDOLOG_TABLES)
+    assert dump == expected
+    assert [type(row[6]) for row in dump['broadcasts']] == [float]
+    assert [type(row[13]) for row in dump['issuances']] == [bytes]
+
+
+def test_undolog_replay_error_falls_back_to_full_reparse(ledger, monkeypatch):
+    l = ledger()
+    block_index = l.populate()
+    expected = l.dump(blocks.UNDOLOG_TABLES)
+    l.block((l.addresses[0], l.ops(['credit', l.addresses[1], 'ASP', 5])))
+
+    # Any database error, not only `SQLError`, makes the undolog unusable.
+    replays = []
+    def replay_undolog(cursor, undolog):
+        replays.append(undolog)
+        cursor.execute('''INSERT INTO blocks(block_index, block_hash) VALUES(0, 'duplicate')''')
+    monkeypatch.setattr(blocks, 'replay_undolog', replay_undolog)
+    blocks.reparse(l.db, block_index=block_index)
+
+    assert replays
+    assert l.dump(blocks.UNDOLOG_TABLES) == expected
@@ -0,0 +1,135 @@
+"""The UTXO index follows the blocks, rolls back with them, and is overlaid
+with the mempool by `backend.get_unspent_txouts()`."""
+import types
+
+import pytest
+from bitcoin.core import CBlock, CTransaction, CTxIn, CTxOut, COutPoint, b2lx, b2x
+from bitcoin.core.script import CScript, OP_DUP, OP_HASH160, OP_EQUALVERIFY, OP_CHECKSIG
+
+from aspirelib.lib import config
+from aspirelib.lib import blocks
+from aspirelib.lib import backend
+from aspirelib.lib import utxoindex
+
+from aspirelib.test.conftest import block_hash
+
+
+def pay_to(i):
+    return CScript([OP_DUP, OP_HASH160, bytes([i]) * 20, OP_EQUALVERIFY, OP_CHECKSIG])
+
+
+def make_tx(spends, payments, coinbase=None):
+    """Return a transaction spending the outputs `spends`, as `(tx, n)`, and
+    paying each `(i, value)` of `payments` to address `i`."""
+    if coinbase is not None:
+        vin = [CTxIn(scriptSig=CScript([coinbase]))]
+    else:
+        vin = [CTxIn(COutPoint(tx.GetHash(), n)) for tx, n in spends]
+    return CTransaction(vin, [CTxOut(value * config.UNIT, pay_to(i)) for i, value in payments])
+
+
+def verbose(tx):
+    """`tx` as returned by `getrawtransaction(..., verbose=True)`, unconfirmed."""
+    return {'txid': b2lx(tx.GetHash()),
+            'vin': [{'txid': b2lx(vin.prevout.hash), 'vout': vin.prevout.n} for vin in tx.vin],
+            'vout': [{'n': n, 'value': vout.nValue / config.UNIT, 'scriptPubKey': {'hex': b2x(vout.scriptPubKey)}}
+                     for n, vout in enumerate(tx.vout)]}
+
+
+def outpoints(outputs):
+    return sorted((output['txid'], output['vout'], output['amount'], output['confirmations']) for output in outputs)
+
+
+@pytest.fixture
+def chain(ledger, monkeypatch):
+    """A ledger with the UTXO index on, and blocks 1 to 3 listed in the backend."""
+    l = ledger(utxo_index=True)
+    txs = {}
+    txs[1] = make_tx(None, [(1, 50), (2, 10)], coinbase=1)
+    txs[2] = make_tx([(txs[1], 0)], [(2, 20), (1, 29)])
+    txs[3] = make_tx([(txs[2], 1)], [(3, 28)])
+    # Block 3 also spends an output of the same block.
+    txs[4] = make_tx([(txs[3], 0)], [(3, 27)])
+    cblocks = {block_hash(0): CBlock(vtx=[make_tx(None, [], coinbase=0)]),
+               block_hash(1): CBlock(vtx=[txs[1]]),
+               block_hash(2): CBlock(vtx=[make_tx(None, [], coinbase=2), txs[2]]),
+               block_hash(3): CBlock(vtx=[make_tx(None, [], coinbase=3), txs[3], txs[4]])}
+    monkeypatch.setattr(backend, 'getblockcount', lambda: 3)
+    monkeypatch.setattr(backend, 'getblock', lambda block_hash: cblocks[block_hash])
+    monkeypatch.setattr(config, 'BACKEND_POLL_INTERVAL', 0.01)
+    for i in range(3):
+        l.block()
+    l.txs = {i: b2lx(tx.GetHash()) for i, tx in txs.items()}
+    return l
+
+
+def test_build_and_lookup(chain):
+    l = chain
+    a, b, c = l.addresses[:3]
+    assert not utxoindex.is_ready(l.db)
+    blocks.update_utxo_index(l.db)
+    assert utxoindex.is_ready(l.db)
+    assert utxoindex.last_block_index(l.db) == 3
+
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, a)) == []
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, b)) == sorted([(l.txs[1], 1, 10, 3), (l.txs[2], 0, 20, 2)])
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, c)) == [(l.txs[4], 0, 27, 1)]
+
+
+def test_rollback(chain, monkeypatch):
+    l = chain
+    a, b, c = l.addresses[:3]
+    blocks.update_utxo_index(l.db)
+    indexed = outpoints(utxoindex.get_unspent_txouts(l.db, a))
+
+    # With the blocks.
+    monkeypatch.setattr(config, 'UNDOLOG_MAX_PAST_BLOCKS', 5)
+    blocks.reparse(l.db, block_index=1)
+    assert utxoindex.last_block_index(l.db) == 1
+    assert utxoindex.is_ready(l.db)
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, a)) == [(l.txs[1], 0, 50, 1)]
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, b)) == [(l.txs[1], 1, 10, 1)]
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, c)) == []
+
+    # Too far back for the spends kept: emptied, then rebuilt.
+    l.block_index = 1
+    l.block()
+    l.block()
+    blocks.update_utxo_index(l.db)
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, a)) == indexed
+    monkeypatch.setattr(config, 'UNDOLOG_MAX_PAST_BLOCKS', 1)
+    utxoindex.rollback(l.db, 1)
+    assert utxoindex.last_block_index(l.db) == config.BLOCK_FIRST - 1
+    blocks.update_utxo_index(l.db)
+    assert outpoints(utxoindex.get_unspent_txouts(l.db, c)) == [(l.txs[4], 0, 27, 1)]
+
+
+def test_mempool_overlay(chain, monkeypatch):
+    l = chain
+    b = l.addresses[1]
+    blocks.update_utxo_index(l.db)
+    monkeypatch.setattr(backend, 'MEMPOOL_CACHE_INITIALIZED', True)
+
+    # `b` spends its output of block 1 in the mempool.
+    mempool_tx = verbose(make_tx([], [(2, 9)]))
+    mempool_tx['vin'] = [{'txid': l.txs[1], 'vout': 1}]
+
+    def searchrawtransactions(address, unconfirmed=False):
+        raise AssertionError('searched the backend')
+    monkeypatch.setattr(backend, 'searchrawtransactions', searchrawtransactions)
+    monkeypatch.setattr(backend, 'BACKEND', lambda: types.SimpleNamespace(unconfirmed_transactions=lambda address: [mempool_tx]))
+    assert outpoints(backend.get_unspent_txouts(b, db=l.db)) == [(l.txs[2], 0, 20, 2)]
+    assert outpoints(backend.get_unspent_txouts(b, unconfirmed=True, db=l.db)) == sorted(
+        [(l.txs[2], 0, 20, 2), (mempool_tx['txid'], 0, 9, 0)])
+
+    # A backend that cannot list the mempool transactions of an address.
+    def unconfirmed_transactions(address):
+        raise NotImplementedError
+    searched = []
+    def searchrawtransactions(address, unconfirmed=False):
+        searched.append(address)
+        return [mempool_tx]
+    monkeypatch.setattr(backend, 'BACKEND', lambda: types.SimpleNamespace(unconfirmed_transactions=unconfirmed_transactions))
+    monkeypatch.setattr(backend, 'searchrawtransactions', searchrawtransactions)
+    assert outpoints(backend.get_unspent_txouts(b, unconfirmed=True, db=l.db)) == [(mempool_tx['txid'], 0, 9, 0)]
+    assert searched == [b]